@@ -0,0 +1,137 @@
+'''
+Validation of many requests and responses at once, optionally spread over
+a pool of worker processes.
+
+A record is a dict with the ``method`` and ``path`` of a request and,
+optionally, its ``body``, ``headers`` and ``resource_name``.  Records with a
+``status`` describe a response and are checked with validateResponse, all
+others with validateRequest.
+'''
+from collections import deque
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
+
+from .validate import RestdocError, RestdocBodyError
+
+class ValidationResult(object):
+    '''
+    The outcome of validating one record: the name of the resource, the
+    uri params and the matching schema spec, or, if the record is invalid,
+    the error message and the name of the resource if one was found.
+    '''
+
+    def __init__(self, resource_name=None, uri_params=None, schema=None, error=None):
+        self.resource_name = resource_name
+        self.uri_params = uri_params
+        self.schema = schema
+        self.error = error
+
+    @property
+    def valid(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.error is not None:
+            return "<ValidationResult error=%r>" % self.error
+        return "<ValidationResult resource=%r>" % self.resource_name
+
+def validate_record(validator, record, diagnose=False):
+    '''
+    Validate one record, returning a :class:`ValidationResult`.  The error
+    of a body matching none of its schemas is only the summary, unless
+    ``diagnose`` is true, in which case it lists the errors of every
+    schema, which takes validating the body against each of them again.
+    Records that cannot be validated at all, such as ones without a
+    ``method``, give a result with an error too.
+    '''
+    try:
+        if 'status' in record:
+            resource, uri_params, schema = validator.validateResponse(record['method'],
+                    record.get('path'), record['status'], body=record.get('body', ''),
+                    headers=record.get('headers', {}), resource_name=record.get('resource_name'))
+        else:
+            resource, uri_params, schema = validator.validateRequest(record['method'],
+                    record.get('path'), body=record.get('body', ''),
+                    headers=record.get('headers', {}), resource_name=record.get('resource_name'))
+    except RestdocBodyError as e:
+        error = diagnose and str(e) or e.summary
+        return ValidationResult(record_resource_name(record, e), error=error)
+    except RestdocError as e:
+        return ValidationResult(record_resource_name(record, e), error=str(e))
+    except Exception as e:
+        return ValidationResult(error="Invalid record: %s: %s" % (type(e).__name__, e))
+    return ValidationResult(validator._getResourceName(resource), uri_params, schema)
+
+def record_resource_name(record, error):
+    '''
+    Return the name of the resource a record failing with ``error`` is for,
+    or None if there is no such resource.
+    '''
+    if record.get('resource_name') is not None:
+        return record['resource_name']
+    return error.resource_name
+
+# The validator of a worker process, set once by init_worker.
+worker_validator = None
+
+def init_worker(validator):
+    global worker_validator
+    worker_validator = validator
+
+def worker_pool(validator, workers):
+    '''
+    Return a process pool of ``workers`` processes, each with a copy of
+    ``validator``.  Forked workers share it with the parent process rather
+    than building their own; elsewhere it is pickled to each worker.
+    '''
+    return Pool(workers, init_worker, (validator,))
+
+def imap_chunks(pool, func, items, chunk_size, window):
+    '''
+    Call ``func`` in ``pool`` on successive lists of up to ``chunk_size``
+    of ``items``, yielding the results in order.  No more than ``window``
+    chunks are in flight at a time.
+    '''
+    items = iter(items)
+    pending = deque()
+    while True:
+        while len(pending) < window:
+            chunk = list(islice(items, chunk_size))
+            if not chunk:
+                break
+            pending.append(pool.apply_async(func, (chunk,)))
+        if not pending:
+            return
+        yield pending.popleft().get()
+
+def _validate_chunk(diagnose, records):
+    return [validate_record(worker_validator, record, diagnose) for record in records]
+
+def validate_many(validator, records, workers=1, chunk_size=256, diagnose=False):
+    '''
+    Validate every record of the iterable ``records``, yielding a
+    :class:`ValidationResult` for each, in order.
+
+    With more than one worker, records are sent to a process pool in chunks
+    of ``chunk_size``.  Every worker gets a copy of the validator once, and
+    at most two chunks per worker are in flight at a time, so
+    ``records`` is consumed only as fast as results are.
+
+    ``diagnose`` is passed on to :func:`validate_record`.
+    '''
+    if workers <= 1:
+        for record in records:
+            yield validate_record(validator, record, diagnose)
+        return
+
+    pool = worker_pool(validator, workers)
+    try:
+        validate_chunk = partial(_validate_chunk, diagnose)
+        for results in imap_chunks(pool, validate_chunk, records, chunk_size, 2 * workers):
+            for result in results:
+                yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
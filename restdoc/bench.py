@@ -0,0 +1,370 @@
+'''
+Benchmarks of RestdocValidator on synthetic restdocs.
+
+A scenario is a set of parameters for :func:`synthetic_restdoc`.  Running
+one builds a validator from the generated restdoc and measures how long
+the build takes, how much memory it adds, the latency of findResource and
+the throughput of validateRequest and validateResponse on generated
+traffic.  Each scenario runs in a process of its own so that memory use
+and caches do not carry over from one to the next.
+
+Results are written as JSON, and can be compared with earlier results to
+flag regressions::
+
+  python -m restdoc.bench --output baseline.json
+  python -m restdoc.bench --compare baseline.json
+'''
+import gc
+import json
+import platform
+import random
+import sys
+import time
+import types
+from multiprocessing import Pool
+from timeit import default_timer
+
+from .validate import RestdocValidator
+
+RESULTS_VERSION = 1
+
+# The parameters of synthetic_restdoc, with their defaults.
+DEFAULT_PARAMS = {
+    'resources' : 100,          # number of resources
+    'depth' : 3,                # literal path segments per resource
+    'params' : 1,               # parameter path segments per resource
+    'validations' : 1,          # match validations per parameter
+    'properties' : 4,           # properties per schema object
+    'nesting' : 1,              # levels of objects nested in a schema
+    'accepts' : 2,              # schemas accepted by each POST
+}
+
+SCENARIOS = {
+    'small' : dict(resources=10),
+    'medium' : dict(resources=200),
+    'large' : dict(resources=2000),
+    'deep_paths' : dict(resources=200, depth=8, params=3, validations=3),
+    'large_schemas' : dict(resources=50, properties=30, nesting=3),
+    'many_types' : dict(resources=50, accepts=10),
+    'large_compact' : dict(resources=2000, keep_restdoc=False),
+}
+
+# Scenario parameters passed on to RestdocValidator.
+VALIDATOR_OPTIONS = ('keep_restdoc', 'lazy')
+
+# Each metric, and whether higher values are better.
+METRICS = [
+    ('build_s', False),
+    ('peak_memory_kb', False),
+    ('retained_kb', False),
+    ('find_p50_us', False),
+    ('find_p90_us', False),
+    ('find_p99_us', False),
+    ('requests_per_s', True),
+    ('responses_per_s', True),
+]
+
+WORDS = ['agents', 'groups', 'regions', 'files', 'users', 'items', 'orders', 'events', 'jobs', 'tags']
+
+def synthetic_restdoc(seed=0, **params):
+    '''
+    Return a restdoc with the shape described by ``params`` (see
+    DEFAULT_PARAMS).  The same parameters and seed give the same restdoc.
+
+    Paths share their leading literal segments the way real APIs do.  Each
+    resource has a GET, responding with one schema, and a POST accepting
+    several schemas told apart by a ``kind`` property.
+    '''
+    p = dict(DEFAULT_PARAMS, **params)
+    rng = random.Random(seed)
+    schemas = {}
+    resources = []
+    for i in xrange(p['resources']):
+        segments = [rng.choice(WORDS) for j in xrange(p['depth'] - 1)] + ['r%d' % i]
+        resource_params = {}
+        for j in xrange(p['params']):
+            name = 'p%d' % j
+            segments.append('{%s}' % name)
+            resource_params[name] = {
+                'validations' : [{'type' : 'match', 'pattern' : '^[0-9]{1,%d}$' % (k + 9)}
+                                 for k in xrange(p['validations'])],
+            }
+        name = 'r%d' % i
+        accepts = []
+        for j in xrange(p['accepts']):
+            schema_name = '%s_type%d' % (name, j)
+            schemas[schema_name] = synthetic_schema(rng, p['properties'], p['nesting'], 'type%d' % j)
+            accepts.append({'type' : 'application/json', 'schema' : schema_name})
+        resources.append({
+            'id' : name,
+            'path' : '/' + '/'.join(segments),
+            'params' : resource_params,
+            'methods' : {
+                'GET' : {
+                    'statusCodes' : {
+                        '200' : {
+                            'response' : {
+                                'types' : [accepts[0]],
+                                'headers' : {'ETag' : {'required' : True}},
+                            },
+                        },
+                    },
+                },
+                'POST' : {
+                    'accepts' : accepts,
+                },
+            },
+        })
+    return {'schemas' : schemas, 'resources' : resources}
+
+def synthetic_schema(rng, properties, nesting, kind):
+    schema = object_schema(rng, properties, nesting)
+    schema['required'].append('kind')
+    schema['properties']['kind'] = {'type' : 'string', 'enum' : [kind]}
+    return {'type' : 'inline', 'schema' : schema}
+
+def object_schema(rng, properties, nesting):
+    members = {}
+    for i in xrange(properties):
+        if nesting and i == 0:
+            members['nested'] = object_schema(rng, properties, nesting - 1)
+            continue
+        kind = rng.choice(('integer', 'string', 'boolean'))
+        member = {'type' : kind}
+        if kind == 'integer':
+            member['minimum'] = 0
+        elif kind == 'string':
+            member['maxLength'] = 20
+        members['f%d' % i] = member
+    return {'type' : 'object', 'required' : sorted(members), 'properties' : members}
+
+def sample_body(schema):
+    '''
+    Return a body valid against a schema generated by synthetic_schema.
+    '''
+    kind = schema.get('type')
+    if 'enum' in schema:
+        return schema['enum'][0]
+    if kind == 'object':
+        return dict((name, sample_body(member)) for name, member in schema['properties'].iteritems())
+    return {'integer' : 1, 'string' : 'abc', 'boolean' : True}[kind]
+
+def synthetic_traffic(restdoc, count, seed=0):
+    '''
+    Return ``count`` valid request records and ``count`` valid response
+    records for resources of ``restdoc``, in the format used by
+    :mod:`restdoc.batch`.
+    '''
+    rng = random.Random(seed)
+    schemas = restdoc['schemas']
+    requests = []
+    responses = []
+    for i in xrange(count):
+        resource = rng.choice(restdoc['resources'])
+        path = resource['path']
+        for name in resource['params']:
+            path = path.replace('{%s}' % name, str(rng.randint(0, 10 ** 6)))
+        post = resource['methods']['POST']
+        accepted = rng.choice(post['accepts'])
+        requests.append({'method' : 'POST', 'path' : path,
+                         'body' : sample_body(schemas[accepted['schema']]['schema'])})
+        returned = resource['methods']['GET']['statusCodes']['200']['response']['types'][0]
+        responses.append({'method' : 'GET', 'path' : path, 'status' : 200, 'headers' : {'ETag' : '1'},
+                          'body' : sample_body(schemas[returned['schema']]['schema'])})
+    return requests, responses
+
+def max_rss_kb():
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # Reported in bytes rather than kilobytes.
+        rss //= 1024
+    return rss
+
+# Shared by everything, so not counted by object_size.
+SHARED_TYPES = (type, types.ClassType, types.ModuleType, types.FunctionType, types.BuiltinFunctionType)
+
+def object_size(root):
+    '''
+    Return the bytes taken by ``root`` and every object it refers to,
+    directly or not, other than classes, functions and modules.
+    '''
+    seen = set()
+    pending = [root]
+    size = 0
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, SHARED_TYPES):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        pending.extend(gc.get_referents(obj))
+    return size
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def run_scenario(params, traffic=2000, builds=3, seed=0):
+    '''
+    Measure a validator built from ``synthetic_restdoc(seed, **params)``
+    and return a dict of each metric in METRICS.  Parameters named in
+    VALIDATOR_OPTIONS are passed to the validator instead.
+    '''
+    params = dict(params)
+    options = dict((name, params.pop(name)) for name in VALIDATOR_OPTIONS if name in params)
+    restdoc = synthetic_restdoc(seed, **params)
+    requests, responses = synthetic_traffic(restdoc, traffic, seed)
+    # Restdocs are read from JSON, with a string for every key and value.
+    restdoc = json.loads(json.dumps(restdoc))
+    metrics = {}
+
+    rss = max_rss_kb()
+    build_times = []
+    validator = None
+    for i in xrange(builds):
+        del validator
+        start = default_timer()
+        validator = RestdocValidator(restdoc, **options)
+        build_times.append(default_timer() - start)
+    metrics['build_s'] = min(build_times)
+    # Only meaningful in a fresh process, where the build sets the peak.
+    metrics['peak_memory_kb'] = max_rss_kb() - rss
+    metrics['retained_kb'] = object_size(validator) / 1024.0
+
+    # As timeit does, keep the collector from adding to the timings.
+    gc.disable()
+    try:
+        metrics.update(time_validator(validator, requests, responses))
+    finally:
+        gc.enable()
+    return metrics
+
+def time_validator(validator, requests, responses):
+    metrics = {}
+    # Warm up first.
+    for record in requests[:100]:
+        validator.validateRequest(record['method'], record['path'], record['body'])
+
+    latencies = []
+    for record in requests:
+        start = default_timer()
+        validator.findResource(record['path'])
+        latencies.append(default_timer() - start)
+    for name, fraction in (('find_p50_us', 0.5), ('find_p90_us', 0.9), ('find_p99_us', 0.99)):
+        metrics[name] = percentile(latencies, fraction) * 1e6
+
+    start = default_timer()
+    for record in requests:
+        validator.validateRequest(record['method'], record['path'], record['body'])
+    metrics['requests_per_s'] = len(requests) / (default_timer() - start)
+
+    start = default_timer()
+    for record in responses:
+        validator.validateResponse(record['method'], record['path'], record['status'],
+                                   record['body'], record['headers'])
+    metrics['responses_per_s'] = len(responses) / (default_timer() - start)
+    return metrics
+
+def run_benchmarks(scenarios, traffic=2000, builds=3, progress=None):
+    '''
+    Run each scenario, a dict of name to params, in a fresh process and
+    return the results.  ``progress``, if given, is called with the name
+    and metrics of each scenario once it is done.
+    '''
+    results = {
+        'version' : RESULTS_VERSION,
+        'python' : platform.python_version(),
+        'platform' : platform.platform(),
+        'time' : time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'scenarios' : {},
+    }
+    for name in sorted(scenarios):
+        params = dict(DEFAULT_PARAMS, **scenarios[name])
+        pool = Pool(1)
+        try:
+            metrics = pool.apply(run_scenario, (params, traffic, builds))
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+        results['scenarios'][name] = {'params' : params, 'metrics' : metrics}
+        if progress is not None:
+            progress(name, metrics)
+    return results
+
+def compare_results(baseline, current, threshold=0.1):
+    '''
+    Compare the metrics of the scenarios in both results.  Return a list
+    of ``(scenario, metric, baseline value, current value, change)``
+    tuples, where change is the relative change, positive when worse, and
+    the list of those that got worse by more than ``threshold``.
+    '''
+    rows = []
+    regressions = []
+    for name in sorted(current['scenarios']):
+        if name not in baseline['scenarios']:
+            continue
+        old = baseline['scenarios'][name]
+        new = current['scenarios'][name]
+        if old['params'] != new['params']:
+            continue
+        for metric, higher_is_better in METRICS:
+            if metric not in old['metrics'] or metric not in new['metrics']:
+                continue
+            before = old['metrics'][metric]
+            after = new['metrics'][metric]
+            if before <= 0:
+                continue
+            change = (after - before) / float(before)
+            if higher_is_better:
+                change = -change
+            row = (name, metric, before, after, change)
+            rows.append(row)
+            if change > threshold:
+                regressions.append(row)
+    return rows, regressions
+
+def print_comparison(rows, regressions, out=sys.stdout):
+    from prettytable import PrettyTable
+    t = PrettyTable(('scenario', 'metric', 'baseline', 'current', 'change', ''))
+    for row in rows:
+        name, metric, before, after, change = row
+        t.add_row([name, metric, '%.4g' % before, '%.4g' % after, '%+.1f%%' % (change * 100),
+                   row in regressions and 'REGRESSION' or ''])
+    print >>out, t
+    print >>out, "%d regressions" % len(regressions)
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m restdoc.bench',
+        description="Benchmark restdoc validation on synthetic restdocs.")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help="Scenario to run; may be repeated (default: all)")
+    parser.add_argument('--traffic', type=int, default=2000,
+                        help="Number of requests and of responses validated per scenario")
+    parser.add_argument('--builds', type=int, default=3, help="Number of validator builds timed")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--compare', metavar='BASELINE', help="Compare with results saved earlier")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="Relative change counted as a regression (default: 0.1)")
+    args = parser.parse_args()
+
+    names = args.scenario or sorted(SCENARIOS)
+    def progress(name, metrics):
+        sys.stderr.write("%s: %s\n" % (name, ', '.join('%s=%.4g' % (metric, metrics[metric])
+                                                       for metric, higher_is_better in METRICS)))
+    results = run_benchmarks(dict((name, SCENARIOS[name]) for name in names),
+                             args.traffic, args.builds, progress)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows, regressions = compare_results(baseline, results, args.threshold)
+        print_comparison(rows, regressions)
+        return regressions and 1 or 0
+    return 0
+
+if __name__ == '__main__': sys.exit(main())
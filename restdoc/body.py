@@ -0,0 +1,150 @@
+'''
+Reading and decoding raw JSON bodies.
+
+Bodies are read in chunks so that oversized input is rejected as soon as
+it passes the size limit.  Bodies larger than a threshold are also run
+through :class:`JSONScanner` while they are read, so malformed input is
+rejected at the first invalid byte rather than after the whole body has
+been read.
+'''
+import re
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+class BodyError(ValueError):
+    '''
+    a body that is too large or is not valid JSON
+    '''
+
+# Tokens, skipping any whitespace before them.
+token_re = re.compile(r'''[ \t\n\r]*(?:
+    (?P<punct>[{}\[\],:]) |
+    (?P<string>"(?:[^"\\\x00-\x1f]|\\["\\/bfnrt]|\\u[0-9a-fA-F]{4})*") |
+    (?P<number>-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?) |
+    (?P<literal>true|false|null)
+    )''', re.VERBOSE)
+space_re = re.compile(r'[ \t\n\r]*')
+# What an unfinished token at the end of the input may look like.
+partial_token_re = re.compile(r'''[ \t\n\r]*(?:
+    "(?:[^"\\\x00-\x1f]|\\["\\/bfnrt]|\\u[0-9a-fA-F]{4})*(?:\\u?[0-9a-fA-F]{0,3})? |
+    -?(?:0|[1-9][0-9]*)?(?:\.[0-9]*)?(?:[eE][+-]?[0-9]*)? |
+    t(?:r(?:ue?)?)? | f(?:a(?:l(?:se?)?)?)? | n(?:u(?:ll?)?)?
+    )\Z''', re.VERBOSE)
+
+# Scanner states: what may come next.
+VALUE, FIRST_VALUE, FIRST_KEY, KEY, COLON, NEXT, DONE = range(7)
+
+class JSONScanner(object):
+    '''
+    Checks the syntax of JSON text fed to it in chunks, raising BodyError
+    at the first byte that cannot be part of a JSON document.
+    '''
+
+    def __init__(self):
+        self.state = VALUE
+        # The open containers, '{' or '['.
+        self.stack = []
+        self.offset = 0
+        self.pending = ''
+
+    def feed(self, data, final=False):
+        buf = self.pending + data
+        pos = 0
+        end = len(buf)
+        while pos < end:
+            m = token_re.match(buf, pos)
+            if m is None or m.lastgroup in ('number', 'literal'):
+                # The rest may be a token continued in the next chunk.
+                if not final and partial_token_re.match(buf, pos):
+                    break
+            if m is None:
+                if space_re.match(buf, pos).end() == end:
+                    pos = end
+                    break
+                self._error(buf, pos)
+            self._token(m, buf, pos)
+            pos = m.end()
+        self.offset += pos
+        self.pending = buf[pos:]
+        if final:
+            if self.pending or self.state != DONE:
+                raise BodyError("Truncated JSON body")
+
+    def _error(self, buf, pos):
+        pos = space_re.match(buf, pos).end()
+        raise BodyError("Malformed JSON body at byte %d" % (self.offset + pos))
+
+    def _token(self, m, buf, pos):
+        kind = m.lastgroup
+        token = m.group(kind)
+        state = self.state
+        if kind == 'punct':
+            if token in '{[' and state in (VALUE, FIRST_VALUE):
+                self.stack.append(token)
+                self.state = token == '{' and FIRST_KEY or FIRST_VALUE
+            elif token == '}' and (state == FIRST_KEY or state == NEXT and self.stack[-1] == '{'):
+                self._close()
+            elif token == ']' and (state == FIRST_VALUE or state == NEXT and self.stack[-1] == '['):
+                self._close()
+            elif token == ',' and state == NEXT:
+                self.state = self.stack[-1] == '{' and KEY or VALUE
+            elif token == ':' and state == COLON:
+                self.state = VALUE
+            else:
+                self._error(buf, pos)
+        elif kind == 'string' and state in (FIRST_KEY, KEY):
+            self.state = COLON
+        elif state in (VALUE, FIRST_VALUE):
+            self.state = self.stack and NEXT or DONE
+        else:
+            self._error(buf, pos)
+
+    def _close(self):
+        self.stack.pop()
+        self.state = self.stack and NEXT or DONE
+
+def read_body(source, max_size=None, chunk_size=65536, scan_size=None):
+    '''
+    Read and decode the JSON body in ``source``, a string or a file-like
+    object.  Raises BodyError once more than ``max_size`` bytes have been
+    read, or when the body is not valid JSON.  Bodies longer than
+    ``scan_size`` are checked for malformed input while they are read.
+    Empty bodies decode to ''.
+    '''
+    if isinstance(source, (basestring, bytearray)):
+        if max_size is not None and len(source) > max_size:
+            raise BodyError("Body larger than %d bytes" % max_size)
+        data = source
+        if isinstance(source, bytearray):
+            data = str(source)
+    else:
+        chunks = []
+        size = 0
+        scanner = None
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                raise BodyError("Body larger than %d bytes" % max_size)
+            if scanner is None and scan_size is not None and size > scan_size:
+                scanner = JSONScanner()
+                for previous in chunks:
+                    scanner.feed(previous)
+            if scanner is not None:
+                scanner.feed(chunk)
+            chunks.append(chunk)
+        if scanner is not None:
+            scanner.feed('', final=True)
+        data = ''.join(chunks)
+
+    if data.strip() == '':
+        return ''
+    try:
+        return json.loads(data)
+    except ValueError as e:
+        raise BodyError("Malformed JSON body: %s" % e)
@@ -0,0 +1,367 @@
+'''
+Offline conformance checking of recorded traffic against a restdoc.
+
+Traffic is read from HAR files or from JSON lines access logs, either of
+which may be gzipped.  Each line of a JSON lines log describes one
+exchange::
+
+  {"method": "GET", "path": "/agents/42", "status": 200,
+   "request": {"headers": {...}, "body": ...},
+   "response": {"headers": {...}, "body": ...}}
+
+``url`` may be given instead of ``path``, and a ``text`` member holding
+the raw JSON text may be given instead of a decoded ``body``.  Exchanges
+without a ``status`` or ``response`` only have their request checked.
+
+Input is streamed: HAR entries and log lines are cut out of the input
+without decoding it, and handed in chunks to worker processes which decode
+and validate them and send back only a summary.
+'''
+import base64
+import gzip
+import io
+import re
+import sys
+import time
+from functools import partial
+from itertools import islice
+from multiprocessing import cpu_count
+from urlparse import urlsplit
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from . import batch
+from .validate import RestdocValidator
+
+class CheckSummary(object):
+    '''
+    Counts of checked and failed requests and responses, keyed by
+    ``(resource, method, status)``, where status is None for requests,
+    along with up to ``max_samples`` sample failures for each key.
+    '''
+
+    def __init__(self, max_samples=3):
+        self.max_samples = max_samples
+        self.exchanges = 0
+        self.unreadable = 0
+        self.checked = {}
+        self.failed = {}
+        self.samples = {}
+
+    def add(self, key, result, body):
+        self.checked[key] = self.checked.get(key, 0) + 1
+        if result.valid:
+            return
+        self.failed[key] = self.failed.get(key, 0) + 1
+        samples = self.samples.setdefault(key, [])
+        if len(samples) < self.max_samples:
+            samples.append((result.error, sample_body(body)))
+
+    def merge(self, other):
+        self.exchanges += other.exchanges
+        self.unreadable += other.unreadable
+        for key, count in other.checked.iteritems():
+            self.checked[key] = self.checked.get(key, 0) + count
+        for key, count in other.failed.iteritems():
+            self.failed[key] = self.failed.get(key, 0) + count
+        for key, samples in other.samples.iteritems():
+            mine = self.samples.setdefault(key, [])
+            mine.extend(samples[:self.max_samples - len(mine)])
+
+def sample_body(body, max_length=200):
+    if isinstance(body, basestring):
+        text = body
+    else:
+        text = json.dumps(body)
+    if len(text) > max_length:
+        text = text[:max_length] + '...'
+    return text
+
+def open_log(filename):
+    '''
+    Open a traffic log for reading as bytes, decompressing gzipped logs.
+    '''
+    if filename == '-':
+        stream = io.open(sys.stdin.fileno(), 'rb', closefd=False)
+    else:
+        stream = io.open(filename, 'rb')
+    if stream.peek(2)[:2] == '\x1f\x8b':
+        return io.BufferedReader(gzip.GzipFile(fileobj=stream))
+    return stream
+
+def detect_format(stream):
+    '''
+    Guess whether a buffered stream holds a HAR file or a JSON lines log
+    from the first member of its first object.
+    '''
+    head = stream.peek(4096)
+    if re.match(r'\s*\{\s*"log"\s*:', head):
+        return 'har'
+    return 'jsonl'
+
+# Strings, brackets, and quotes starting a string that is not complete.
+har_token_re = re.compile(r'"(?:[^"\\]|\\.)*"|[\[\]{}]|"')
+har_entries_re = re.compile(r'"entries"\s*:')
+
+def iter_har_entries(stream, read_size=1 << 20):
+    '''
+    Yield the raw JSON text of each entry in the ``log.entries`` array of
+    a HAR stream, without decoding the stream.
+    '''
+    buf = ''
+    pos = 0             # where scanning resumes
+    depth = 0           # nesting depth at pos
+    expect = False      # whether the next array is log.entries
+    entries = False     # whether pos is inside log.entries
+    start = None        # where the current entry starts
+    eof = False
+    while True:
+        for m in har_token_re.finditer(buf, pos):
+            token = m.group(0)
+            if token[0] == '"':
+                if token == '"' and not eof:
+                    break
+                if depth == 2 and token == '"entries"':
+                    if not eof and buf[m.end():].strip() == '':
+                        # Whether this is a key depends on what follows.
+                        break
+                    expect = har_entries_re.match(buf, m.start()) is not None
+            elif token == '[' or token == '{':
+                depth += 1
+                if expect and token == '[':
+                    expect = False
+                    entries = True
+                elif entries and depth == 4:
+                    start = m.start()
+            else:
+                if entries and depth == 4:
+                    yield buf[start:m.end()]
+                    start = None
+                elif entries and depth == 3:
+                    return
+                depth -= 1
+            pos = m.end()
+        else:
+            pos = len(buf)
+        if eof:
+            return
+        # Keep the current entry, or the token that is not complete.
+        keep = pos if start is None else start
+        buf = buf[keep:]
+        pos -= keep
+        if start is not None:
+            start = 0
+        data = stream.read(read_size)
+        eof = not data
+        buf += data
+
+def har_headers(headers):
+    return dict((header['name'], header['value']) for header in headers)
+
+def decode_body(text):
+    '''
+    Decode a JSON body, falling back to the raw text.
+    '''
+    if text is None or text == '':
+        return ''
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+def har_exchange(entry):
+    request = entry['request']
+    url = urlsplit(request['url'])
+    path = url.path
+    if url.query:
+        path += '?' + url.query
+    exchange = {
+        'method' : request['method'],
+        'path' : path,
+        'request' : {
+            'headers' : har_headers(request.get('headers', [])),
+            'body' : decode_body(request.get('postData', {}).get('text')),
+        },
+    }
+    response = entry.get('response')
+    if response and response.get('status'):
+        content = response.get('content', {})
+        text = content.get('text')
+        if text and content.get('encoding') == 'base64':
+            text = base64.b64decode(text)
+        exchange['status'] = response['status']
+        exchange['response'] = {
+            'headers' : har_headers(response.get('headers', [])),
+            'body' : decode_body(text),
+        }
+    return exchange
+
+def log_exchange(line):
+    exchange = json.loads(line)
+    if 'path' not in exchange and 'url' in exchange:
+        url = urlsplit(exchange['url'])
+        exchange['path'] = url.path + ('?' + url.query if url.query else '')
+    for part in ('request', 'response'):
+        message = exchange.get(part)
+        if message is not None and 'body' not in message:
+            message['body'] = decode_body(message.get('text'))
+    return exchange
+
+def exchange_records(exchange):
+    '''
+    Return the request record and, if there is a response, the response
+    record of an exchange.
+    '''
+    request = exchange.get('request') or {}
+    records = [{
+        'method' : exchange['method'],
+        'path' : exchange['path'],
+        'headers' : request.get('headers') or {},
+        'body' : request.get('body', ''),
+    }]
+    response = exchange.get('response')
+    if exchange.get('status') and response is not None:
+        records.append({
+            'method' : exchange['method'],
+            'path' : exchange['path'],
+            'status' : exchange['status'],
+            'headers' : response.get('headers') or {},
+            'body' : response.get('body', ''),
+        })
+    return records
+
+def parse_har_entry(text):
+    return har_exchange(json.loads(text))
+
+def check_exchanges(validator, items, parse, summary, diagnose=False):
+    for item in items:
+        summary.exchanges += 1
+        try:
+            records = exchange_records(parse(item))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            summary.unreadable += 1
+            continue
+        for record in records:
+            result = batch.validate_record(validator, record, diagnose)
+            key = (result.resource_name, record['method'], record.get('status'))
+            summary.add(key, result, record['body'])
+
+def _check_chunk(parse, max_samples, diagnose, items):
+    summary = CheckSummary(max_samples)
+    check_exchanges(batch.worker_validator, items, parse, summary, diagnose)
+    return summary
+
+def check_log(validator, stream, format='auto', workers=None, chunk_size=512,
+              summary=None, progress=None, diagnose=False):
+    '''
+    Check the traffic in ``stream`` against ``validator``, adding the
+    results to ``summary``, or to a new :class:`CheckSummary`, which is
+    returned.  ``progress``, if given, is called with the summary after
+    each chunk of ``chunk_size`` exchanges is checked, with or without
+    workers.  With ``diagnose``, failures of bodies matching none of their
+    schemas list the errors of each schema.
+    '''
+    if summary is None:
+        summary = CheckSummary()
+    if format == 'auto':
+        format = detect_format(stream)
+    if format == 'har':
+        items = iter_har_entries(stream)
+        parse = parse_har_entry
+    else:
+        items = (line for line in stream if line.strip())
+        parse = log_exchange
+    if workers is None:
+        workers = cpu_count()
+    if workers <= 1:
+        items = iter(items)
+        while True:
+            chunk = list(islice(items, chunk_size))
+            if not chunk:
+                return summary
+            check_exchanges(validator, chunk, parse, summary, diagnose)
+            if progress is not None:
+                progress(summary)
+
+    pool = batch.worker_pool(validator, workers)
+    try:
+        check_chunk = partial(_check_chunk, parse, summary.max_samples, diagnose)
+        for chunk_summary in batch.imap_chunks(pool, check_chunk, items, chunk_size, 2 * workers):
+            summary.merge(chunk_summary)
+            if progress is not None:
+                progress(summary)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return summary
+
+def format_key(key):
+    resource, method, status = key
+    return (resource or '(no resource)', method, status is None and 'request' or status)
+
+def print_summary(summary, elapsed, out=sys.stdout):
+    from prettytable import PrettyTable
+    t = PrettyTable(('resource', 'method', 'status', 'checked', 'failed'))
+    for key in sorted(summary.checked, key=format_key):
+        t.add_row(list(format_key(key)) + [summary.checked[key], summary.failed.get(key, 0)])
+    print >>out, t
+    for key in sorted(summary.samples, key=format_key):
+        print >>out
+        print >>out, "%s %s %s:" % format_key(key)
+        for error, body in summary.samples[key]:
+            print >>out, "  error: %s" % error
+            print >>out, "  body:  %s" % body
+    print >>out
+    records = sum(summary.checked.itervalues())
+    print >>out, "%d exchanges (%d unreadable), %d records, %d failed, in %.1fs (%d records/s)" % (
+        summary.exchanges, summary.unreadable, records, sum(summary.failed.itervalues()),
+        elapsed, records / max(elapsed, 0.001))
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(prog='rdc-check',
+        description="Check recorded traffic against a restdoc.")
+    parser.add_argument('restdoc', help="The restdoc JSON file")
+    parser.add_argument('logs', nargs='+', help="HAR files or JSON lines logs, possibly gzipped, or - for stdin")
+    parser.add_argument('--format', choices=('auto', 'har', 'jsonl'), default='auto')
+    parser.add_argument('--workers', type=int, default=cpu_count(),
+                        help="Number of worker processes (default: one per cpu)")
+    parser.add_argument('--chunk-size', type=int, default=512)
+    parser.add_argument('--samples', type=int, default=3,
+                        help="Number of sample failures to show per resource, method and status")
+    parser.add_argument('--cache-size', type=int, default=10000,
+                        help="Number of paths whose resource lookups are cached")
+    parser.add_argument('--diagnose', action='store_true',
+                        help="Show the errors of every schema for bodies matching none, which is slower")
+    parser.add_argument('--quiet', action='store_true', help="Do not report progress")
+    args = parser.parse_args()
+
+    with open(args.restdoc) as f:
+        validator = RestdocValidator(json.load(f), cache_size=args.cache_size)
+
+    start = time.time()
+    reported = [start]
+    def progress(summary):
+        now = time.time()
+        if now - reported[0] >= 2:
+            reported[0] = now
+            records = sum(summary.checked.itervalues())
+            sys.stderr.write("%d exchanges, %d records, %d records/s\n" % (
+                summary.exchanges, records, records / (now - start)))
+
+    summary = CheckSummary(args.samples)
+    for filename in args.logs:
+        stream = open_log(filename)
+        try:
+            check_log(validator, stream, args.format, args.workers, args.chunk_size,
+                      summary, progress=not args.quiet and progress or None, diagnose=args.diagnose)
+        finally:
+            stream.close()
+    print_summary(summary, time.time() - start)
+    return summary.failed and 1 or 0
+
+if __name__ == '__main__': sys.exit(main())
@@ -0,0 +1,555 @@
+'''
+Ahead-of-time compilation of a restdoc into a plain Python module.
+
+The generated module needs nothing but the standard library.  It provides
+``findResource``, ``findResourceByName``, ``validateRequest`` and
+``validateResponse`` functions taking the same arguments and returning the
+same values as the methods of a :class:`RestdocValidator`, so the module
+can be used in place of one.  Bodies must be passed decoded, and errors
+raised for invalid bodies carry only their summary.
+
+Requests are routed by walking a trie of literal path segments, like the
+validator's router, and each resource method gets straight-line functions
+checking the headers and trying the schemas of its requests and responses.
+Schemas are turned into Python code that follows the validator's rules for
+the keywords ``type``, ``properties``, ``patternProperties``,
+``additionalProperties``, ``required``, ``blank``, ``enum``, ``minimum``,
+``maximum``, ``exclusiveMinimum``, ``exclusiveMaximum``, ``minLength``,
+``maxLength``, ``minItems``, ``maxItems``, ``pattern``, ``items``,
+``allOf`` and ``$ref``.  Restdocs with schemas using other validation
+keywords, such as ``format``, cannot be compiled.
+
+Usage::
+
+  python -m restdoc.codegen api.json api_validator.py
+'''
+import sys
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from .schema import inline_schema
+from .validate import RestdocValidator, RestdocError
+
+# Keywords with validation rules the generated code does not implement.
+unsupported_keywords = frozenset(['format', 'uniqueItems', 'dependencies', 'disallow',
+        'divisibleBy', 'additionalItems', 'minProperties', 'maxProperties', 'extends',
+        'anyOf', 'oneOf', 'not'])
+
+type_tests = {
+    'string' : 'isinstance(%s, basestring)',
+    'integer' : '(isinstance(%s, (int, long)) and not isinstance(%s, bool))',
+    'number' : '(isinstance(%s, (int, long, float)) and not isinstance(%s, bool))',
+    'boolean' : 'isinstance(%s, bool)',
+    'object' : 'isinstance(%s, dict)',
+    'array' : 'isinstance(%s, (list, tuple))',
+    'null' : '%s is None',
+}
+
+module_header = '''\
+# Generated from a restdoc by restdoc.codegen.  Do not edit.
+import re
+
+class RestdocError(ValueError):
+    pass
+
+class RestdocBodyError(RestdocError):
+    def __init__(self, message):
+        RestdocError.__init__(self, message)
+        self.summary = message
+
+class _Regex(object):
+    # Compiled when first used, so that importing the module stays cheap.
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.regex = None
+
+    def match(self, string):
+        if self.regex is None:
+            self.regex = re.compile(self.pattern)
+        return self.regex.match(string)
+'''
+
+module_functions = '''
+def _getResourceName(resource):
+    if 'id' in resource:
+        return resource['id']
+    if 'path' in resource:
+        return resource['path']
+    return '(no id)'
+
+def _find(path):
+    if path[-1:] == '\\n':
+        segments = path[:-1].split('/')
+    else:
+        segments = path.split('/')
+    node = _ROUTES
+    i = 0
+    matches = set()
+    found = None
+    while True:
+        for index, regex in node[0]:
+            r = regex.match(path)
+            if r is not None:
+                matches.add(_RESOURCES[index]['path'])
+                found = index
+                last_match = r
+                if index not in _AMBIGUOUS:
+                    break
+        if i == len(segments) or (found is not None and found not in _AMBIGUOUS):
+            break
+        node = node[1].get(segments[i])
+        if node is None:
+            break
+        i += 1
+    if len(matches) > 1:
+        raise RestdocError("Multiple resources match path '%s': %s" % (path, list(matches)))
+    if found is None:
+        raise RestdocError("No resource found matching path '%s'" % path)
+    uri_params = {}
+    for param_idx, value in last_match.groupdict().iteritems():
+        param = '_'.join(param_idx.split('_')[:-1])
+        if param not in uri_params:
+            uri_params[param] = []
+        if value is not None:
+            uri_params[param].append(value)
+    return found, uri_params
+
+def findResource(path):
+    index, uri_params = _find(path)
+    return _RESOURCES[index], uri_params
+
+def _findByName(resource_name):
+    if resource_name in _NAMES:
+        return _NAMES[resource_name]
+    raise RestdocError("Unknown resource name: %s" % resource_name)
+
+def findResourceByName(resource_name):
+    return _RESOURCES[_findByName(resource_name)]
+
+def _findMethodPlan(method, path, resource_name):
+    if resource_name is None:
+        index, uri_params = _find(path)
+        resource_name = _getResourceName(_RESOURCES[index])
+    else:
+        uri_params = {}
+        index = _findByName(resource_name)
+    plan = _PLANS[index].get(method)
+    if plan is None:
+        raise RestdocError("Resource '%s' does not have method '%s'" % (resource_name, method))
+    return index, uri_params, plan
+
+def validateRequest(method, path, body='', headers={}, lazy_schema_matching=False, resource_name=None):
+    index, uri_params, plan = _findMethodPlan(method, path, resource_name)
+    return _RESOURCES[index], uri_params, plan[0](headers, body, lazy_schema_matching)
+
+def validateResponse(method, path, status, body='', headers={}, lazy_schema_matching=False, resource_name=None):
+    index, uri_params, plan = _findMethodPlan(method, path, resource_name)
+    return _RESOURCES[index], uri_params, plan[1](status, headers, body, lazy_schema_matching)
+'''
+
+class ModuleWriter(object):
+    '''
+    Collects the constants and functions of a generated module.  Identical
+    constants and functions are only written once.
+    '''
+
+    def __init__(self):
+        self.constants = {}
+        self.constant_lines = []
+        self.table_lines = []
+        self.functions = {}
+        self.function_sources = []
+
+    def constant(self, source, table=False):
+        '''
+        Return the name of a module constant with the value of the Python
+        expression ``source``.  Tables of functions are defined after the
+        functions.
+        '''
+        if source not in self.constants:
+            name = '_C%d' % len(self.constants)
+            self.constants[source] = name
+            if table:
+                self.table_lines.append('%s = %s' % (name, source))
+            else:
+                self.constant_lines.append('%s = %s' % (name, source))
+        return self.constants[source]
+
+    def literal(self, value):
+        return self.constant(repr(value))
+
+    def regex(self, pattern):
+        return self.constant('_Regex(%r)' % pattern)
+
+    def function(self, prefix, args, body):
+        '''
+        Return the name of a function with the given arguments and body
+        lines.
+        '''
+        key = (args, tuple(body))
+        if key not in self.functions:
+            name = '%s%d' % (prefix, len(self.functions))
+            self.functions[key] = name
+            self.function_sources.append('\ndef %s(%s):\n%s' % (name, args,
+                    '\n'.join('    ' + line for line in body)))
+        return self.functions[key]
+
+class SchemaCodegen(object):
+    '''
+    Turns the inline schemas of a restdoc into functions returning whether
+    a value matches them.  A function is generated for every schema that
+    is used, and one more for each schema used within an ``allOf``, where
+    unknown properties are allowed.
+    '''
+
+    def __init__(self, schemas, writer):
+        self.schemas = schemas
+        self.writer = writer
+        self.names = {}
+        self.pending = []
+        self.variables = 0
+
+    def is_inline(self, name):
+        return isinstance(name, basestring) and name in self.schemas \
+                and inline_schema(self.schemas[name]) is not None
+
+    def function(self, name, in_allof=False):
+        '''
+        Return the name of the function checking schema ``name``.
+        '''
+        key = (name, in_allof)
+        if key not in self.names:
+            self.names[key] = '_schema%d' % len(self.names)
+            self.pending.append(key)
+        return self.names[key]
+
+    def generate(self):
+        while self.pending:
+            name, in_allof = key = self.pending.pop()
+            self.variables = 0
+            lines = ['def %s(x):' % self.names[key]]
+            self.node(inline_schema(self.schemas[name]), 'x', lines, '    ', in_allof, [name])
+            lines.append('    return True')
+            self.writer.function_sources.append('\n' + '\n'.join(lines))
+
+    def variable(self, prefix):
+        self.variables += 1
+        return '%s%d' % (prefix, self.variables)
+
+    def node(self, schema, var, out, indent, in_allof, refs):
+        '''
+        Append to ``out`` the lines returning False if ``var`` does not
+        match ``schema``.
+        '''
+        if not isinstance(schema, dict):
+            raise RestdocError("Schema must be a dictionary: %r" % (schema,))
+        if '$ref' in schema:
+            ref = schema['$ref']
+            if not self.is_inline(ref):
+                # The validator rejects unknown schemas.
+                out.append(indent + 'return False')
+                return
+            if len(schema) == 1:
+                out.append(indent + 'if not %s(%s):' % (self.function(ref, in_allof), var))
+                out.append(indent + '    return False')
+                return
+            if ref in refs:
+                raise RestdocError("Cannot generate code for recursive schema reference "
+                                   "with other keywords: %s" % ref)
+            # The referenced schema, with the other keywords as defaults.
+            merged = dict(inline_schema(self.schemas[ref]))
+            for key, value in schema.iteritems():
+                if key != '$ref':
+                    merged.setdefault(key, value)
+            return self.node(merged, var, out, indent, in_allof, refs + [ref])
+
+        unsupported = unsupported_keywords.intersection(schema)
+        if unsupported:
+            raise RestdocError("Cannot generate code for schema keywords: %s" %
+                               ", ".join(sorted(unsupported)))
+
+        known_type = self.type_check(schema, var, out, indent)
+        blank = schema.get('blank', False)
+        w = self.writer
+
+        def guarded(kinds, test):
+            # Only check values of the given kinds, without testing the
+            # kind when the schema's type already settles it.
+            if known_type is None:
+                lines = []
+                test(lines, indent + '    ')
+                if lines:
+                    out.append(indent + 'if %s:' % ' or '.join(type_tests[kind] % ((var,) * type_tests[kind].count('%s'))
+                                                            for kind in kinds))
+                    out.extend(lines)
+            elif known_type in kinds:
+                test(out, indent)
+
+        def string_checks(out, indent):
+            if not blank:
+                out.append(indent + 'if not %s:' % var)
+                out.append(indent + '    return False')
+            if 'pattern' in schema:
+                out.append(indent + 'if not %s.match(%s):' % (w.regex(schema['pattern']), var))
+                out.append(indent + '    return False')
+        guarded(('string',), string_checks)
+
+        def length_checks(out, indent):
+            for keyword, op in (('minLength', '<'), ('maxLength', '>'),
+                                ('minItems', '<'), ('maxItems', '>')):
+                if keyword in schema:
+                    out.append(indent + 'if len(%s) %s %r:' % (var, op, schema[keyword]))
+                    out.append(indent + '    return False')
+        guarded(('string', 'array'), length_checks)
+
+        def number_checks(out, indent):
+            for keyword, op, exclusive_op in (('minimum', '<', '<='), ('maximum', '>', '>=')):
+                if keyword in schema:
+                    exclusive = schema.get('exclusive' + keyword[0].upper() + keyword[1:], False)
+                    out.append(indent + 'if %s %s %r:' % (var, exclusive and exclusive_op or op,
+                                                          schema[keyword]))
+                    out.append(indent + '    return False')
+        guarded(('number',), number_checks)
+
+        if 'enum' in schema:
+            test = '%s is not None and %s not in %s' % (var, var, w.literal(tuple(schema['enum'])))
+            if blank:
+                test += " and %s != ''" % var
+            out.append(indent + 'if %s:' % test)
+            out.append(indent + '    return False')
+
+        guarded(('object',), lambda out, indent: self.object_checks(schema, var, out, indent,
+                                                                     in_allof, refs))
+
+        if 'items' in schema:
+            if not isinstance(schema['items'], dict):
+                raise RestdocError("Cannot generate code for items given as a list")
+            def item_checks(out, indent):
+                item = self.variable('i')
+                lines = []
+                self.node(schema['items'], item, lines, indent + '    ', False, refs)
+                if lines:
+                    out.append(indent + 'for %s in %s:' % (item, var))
+                    out.extend(lines)
+            guarded(('array',), item_checks)
+
+        for subschema in schema.get('allOf', []):
+            self.node(subschema, var, out, indent, True, refs)
+
+    def type_check(self, schema, var, out, indent):
+        '''
+        Append the check of the ``type`` of ``schema``, returning the type
+        if it is a single one.
+        '''
+        if 'type' not in schema:
+            return None
+        types = schema['type']
+        if not isinstance(types, list):
+            types = [types]
+        tests = []
+        for kind in types:
+            if kind == 'any':
+                return None
+            if kind not in type_tests:
+                raise RestdocError("Cannot generate code for type: %r" % (kind,))
+            tests.append(type_tests[kind] % ((var,) * type_tests[kind].count('%s')))
+        out.append(indent + 'if not (%s):' % ' or '.join(tests))
+        out.append(indent + '    return False')
+        if len(types) == 1:
+            # Integers are numbers too.
+            return types[0] == 'integer' and 'number' or types[0]
+        return None
+
+    def object_checks(self, schema, var, out, indent, in_allof, refs):
+        w = self.writer
+        required = schema.get('required')
+        if not isinstance(required, list):
+            required = []
+        for name in required:
+            out.append(indent + 'if %r not in %s:' % (name, var))
+            out.append(indent + '    return False')
+
+        properties = schema.get('properties', {})
+        for name in sorted(properties):
+            value = self.variable('v')
+            if name in required:
+                # Known to be present.
+                lines = ['%s = %s[%r]' % (value, var, name)]
+                self.node(properties[name], value, lines, indent, False, refs)
+                if len(lines) > 1:
+                    out.append(indent + lines[0])
+                    out.extend(lines[1:])
+                continue
+            lines = []
+            self.node(properties[name], value, lines, indent + '    ', False, refs)
+            property_required = isinstance(properties[name], dict) and properties[name].get('required') is True
+            if lines or property_required:
+                out.append(indent + 'if %r in %s:' % (name, var))
+                out.append(indent + '    %s = %s[%r]' % (value, var, name))
+                out.extend(lines)
+                if property_required:
+                    out.append(indent + 'else:')
+                    out.append(indent + '    return False')
+
+        patterns = schema.get('patternProperties', {})
+        for pattern in sorted(patterns):
+            key, value = self.variable('k'), self.variable('v')
+            lines = []
+            self.node(patterns[pattern], value, lines, indent + '        ', False, refs)
+            if lines:
+                out.append(indent + 'for %s, %s in %s.iteritems():' % (key, value, var))
+                out.append(indent + '    if %s.match(%s):' % (w.regex(pattern), key))
+                out.extend(lines)
+
+        # What to do with properties that are neither listed nor match a
+        # pattern.  The validator disallows unknown properties, except
+        # within and alongside ``allOf``.
+        additional = schema.get('additionalProperties')
+        disallowed = additional is False or (not in_allof and 'allOf' not in schema
+                                             and bool(properties or patterns))
+        key, value = self.variable('k'), self.variable('v')
+        lines = []
+        if disallowed:
+            lines.append(indent + '        return False')
+        elif isinstance(additional, dict):
+            self.node(additional, value, lines, indent + '        ', False, refs)
+        if lines:
+            test = '%s not in %s' % (key, w.literal(frozenset(properties)))
+            for pattern in sorted(patterns):
+                test += ' and not %s.match(%s)' % (w.regex(pattern), key)
+            out.append(indent + 'for %s, %s in %s.iteritems():' % (key, value, var))
+            out.append(indent + '    if %s:' % test)
+            out.extend(lines)
+
+def choice_lines(choices, schemas, writer):
+    '''
+    Return the lines returning the spec of the first of ``choices``
+    matching ``body``.
+    '''
+    lines = []
+    for choice in choices:
+        spec = writer.literal(choice.spec)
+        if choice.schema is None:
+            lines.append('if lazy:')
+        else:
+            lines.append('if %s(body):' % schemas.function(choice.schema.name))
+        lines.append('    return %s' % spec)
+    return lines
+
+def header_lines(headers, message):
+    lines = []
+    for header, lower_header in headers:
+        lines.append('if %r not in headers and %r not in headers:' % (header, lower_header))
+        lines.append('    raise RestdocError(%r)' % (message % header))
+    return lines
+
+def request_function(plan, schemas, writer):
+    body = header_lines(plan.required_headers, "Method '%s' requires header '%%s'" % plan.name)
+    if plan.accepts is None:
+        body.append('return None')
+    else:
+        body.extend(choice_lines(plan.accepts.choices, schemas, writer))
+        body.append('raise RestdocBodyError(%r)' % ("Method '%s' does not accept given body." % plan.name))
+    return writer.function('_request', 'headers, body, lazy', body)
+
+def response_function(plan, schemas, writer):
+    if plan.responses is None:
+        return writer.function('_response', 'status, headers, body, lazy',
+                ['raise RestdocError(%r)' % ("Method '%s' missing statusCodes definition" % plan.name)])
+    statuses = {}
+    for status, response_plan in plan.responses.iteritems():
+        body = header_lines(response_plan.required_headers,
+                            "Method '%s' response requires header '%%s'" % plan.name)
+        # A match against the method's response types takes precedence.
+        body.extend(choice_lines(response_plan.method_types.choices, schemas, writer))
+        body.extend(choice_lines(response_plan.status_types.choices, schemas, writer))
+        attempts = len(response_plan.method_types.choices) + len(response_plan.status_types.choices)
+        body.append('raise RestdocBodyError(%r)' % ("Method '%s' responded with invalid body.  "
+                                                    "Matched against %d schemas." % (plan.name, attempts)))
+        statuses[status] = writer.function('_status', 'headers, body, lazy', body)
+    table = writer.constant('{%s}' % ', '.join('%r : %s' % item for item in sorted(statuses.iteritems())),
+                            table=True)
+    return writer.function('_response', 'status, headers, body, lazy', [
+        'response = %s.get(status)' % table,
+        'if response is None:',
+        '    response = %s.get(str(status))' % table,
+        '    if response is None:',
+        '        raise RestdocError(%r %% status)' % (
+                "Method '%s' responding with invalid status code '%%s'" % plan.name),
+        'return response(headers, body, lazy)',
+    ])
+
+def route_source(node, indexes, writer):
+    '''
+    Return the source of a router trie node as nested tuples of the
+    ``(resource index, regex)`` routes and the dict of children.
+    '''
+    routes = ''.join('(%d, %s), ' % (indexes[id(route.resource)], writer.regex(route.regex.pattern))
+                     for route in node.routes)
+    children = ', '.join('%r : %s' % (segment, route_source(child, indexes, writer))
+                         for segment, child in sorted(node.children.iteritems()))
+    return '((%s), {%s})' % (routes, children)
+
+def generate_module(restdoc):
+    '''
+    Return the source of a Python module validating requests and responses
+    against ``restdoc``.  Raises RestdocError if the restdoc is invalid or
+    uses schema keywords the generated code does not support.
+    '''
+    validator = RestdocValidator(restdoc)
+    writer = ModuleWriter()
+    schemas = SchemaCodegen(validator.schemas, writer)
+
+    resources = validator.resources
+    indexes = dict((id(resource), index) for index, resource in enumerate(resources))
+    names = {}
+    plans = []
+    for index, resource in enumerate(resources):
+        names[validator._getResourceName(resource)] = index
+        methods = []
+        for method, plan in sorted(validator.resource_plans[id(resource)].iteritems()):
+            methods.append('%r : (%s, %s)' % (method, request_function(plan, schemas, writer),
+                                              response_function(plan, schemas, writer)))
+        plans.append('{%s}' % ', '.join(methods))
+    routes = route_source(validator.router.root, indexes, writer)
+    schemas.generate()
+
+    return '\n'.join([
+        module_header,
+    ] + writer.constant_lines + [
+        '',
+        '_RESOURCES = %r' % (resources,),
+        '_NAMES = %r' % (names,),
+        '# Resources that may match the same paths as others.',
+        '_AMBIGUOUS = frozenset(%r)' % (sorted(indexes[resource_id] for resource_id in validator.ambiguous),),
+    ] + writer.function_sources + [
+        '',
+    ] + writer.table_lines + [
+        '_ROUTES = %s' % routes,
+        '_PLANS = [%s]' % ', '.join(plans),
+        module_functions,
+    ])
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m restdoc.codegen',
+        description="Compile a restdoc into a Python module validating requests and responses.")
+    parser.add_argument('restdoc', help="The restdoc JSON file")
+    parser.add_argument('module', help="The Python file to write")
+    args = parser.parse_args()
+
+    with open(args.restdoc) as f:
+        restdoc = json.load(f)
+    try:
+        source = generate_module(restdoc)
+    except RestdocError as e:
+        print >>sys.stderr, "rdc-codegen: %s" % e
+        return 1
+    with open(args.module, 'w') as f:
+        f.write(source)
+    return 0
+
+if __name__ == '__main__': sys.exit(main())
@@ -0,0 +1,53 @@
+'''
+Compact copies of restdocs, for validators that do not keep the restdoc
+they were built from.
+
+JSON decoders create a new string for every key and value they read, so
+a large restdoc holds thousands of copies of ``"type"``, ``"object"`` and
+the like.  The copies made here share a single instance of each string.
+'''
+
+# The parts of a restdoc a validator uses.
+RESTDOC_KEYS = ('resources', 'schemas', 'headers', 'statusCodes')
+
+class StringTable(object):
+    '''
+    One instance of each string seen.  str and unicode strings are kept
+    apart, as equal ones would otherwise be merged.
+    '''
+
+    __slots__ = ('strings',)
+
+    def __init__(self):
+        self.strings = {str : {}, unicode : {}}
+
+    def intern(self, value):
+        strings = self.strings[type(value)]
+        return strings.setdefault(value, value)
+
+def compact_json(node, table):
+    '''
+    Return a copy of the JSON value ``node`` sharing the strings in
+    ``table``.
+    '''
+    if isinstance(node, dict):
+        return dict((compact_json(key, table), compact_json(value, table))
+                    for key, value in node.iteritems())
+    if isinstance(node, list):
+        return [compact_json(value, table) for value in node]
+    if type(node) in (str, unicode):
+        return table.intern(node)
+    return node
+
+def compact_restdoc(restdoc, table):
+    '''
+    Return a compact copy of the parts of ``restdoc`` a validator uses.
+    '''
+    return dict((key, compact_json(restdoc[key], table)) for key in RESTDOC_KEYS if key in restdoc)
+
+def slim_resource(resource):
+    '''
+    Return the parts of a resource kept once its plans are built: the
+    ``id`` and ``path`` naming it.
+    '''
+    return dict((key, resource[key]) for key in ('id', 'path') if key in resource)
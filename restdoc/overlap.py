@@ -0,0 +1,481 @@
+'''
+Which path regexes can match the same path.
+
+A router has to try every route that might match a path, to report paths
+matched by more than one resource.  Whether two path regexes can ever
+match the same path is a question about the regexes alone, so it is
+answered once, here, when routes are added: a lookup whose first match is
+with a route overlapping no other can stop there.
+
+Regexes are turned into automata over ASCII characters plus one symbol
+standing for every other character.  The automata of routes a lookup may
+try together are run side by side on the paths at least two of them
+accept, and the routes whose automata both accept one such path overlap.
+The answer errs on the side of overlapping: conditionals are taken to
+match either of their branches, and regexes using constructs the
+automata cannot express, like backreferences, lookarounds or
+case-insensitive matching, are taken to overlap with every route tried
+along with theirs.
+'''
+import re
+from collections import deque
+from itertools import combinations
+import sre_constants as sre
+import sre_parse
+
+# Characters are ASCII code points; OTHER stands for all other characters.
+OTHER = 128
+ASCII = (1 << OTHER) - 1
+ALL = ASCII | (1 << OTHER)
+NEWLINE = 1 << ord('\n')
+
+# Repeats of more than this many copies are taken as repeating any number
+# of times, which only matches more.
+MAX_COPIES = 32
+
+# The sets of automaton states followed before giving up on telling
+# strings apart, for the first automaton and for each other.
+MAX_STATES = 10000
+STATES_PER_AUTOMATON = 100
+
+# Routes are only split by the node they are on while fewer than this many
+# are above them.
+MAX_SPLIT_ROUTES = 16
+
+# Order in which characters are picked for example paths.
+EXAMPLE_CHARS = [ord(c) for c in
+                 'abcdefghijklmnopqrstuvwxyz0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ-_.~'] + range(128)
+
+# Modes of a regex automaton: what may follow once '$' or '\Z' matched.
+FREE, NEWLINE_ONLY, NOTHING = 0, 1, 2
+
+def category_mask(category, unicode_flag):
+    '''
+    Return the characters of an escape class such as ``\\d``.
+    '''
+    source = {
+        sre.CATEGORY_DIGIT : r'\d', sre.CATEGORY_NOT_DIGIT : r'\D',
+        sre.CATEGORY_SPACE : r'\s', sre.CATEGORY_NOT_SPACE : r'\S',
+        sre.CATEGORY_WORD : r'\w', sre.CATEGORY_NOT_WORD : r'\W',
+    }.get(category)
+    if source is None:
+        return None
+    regex = re.compile(source, re.UNICODE if unicode_flag else 0)
+    mask = 0
+    for i in range(128):
+        if regex.match(chr(i)):
+            mask |= 1 << i
+    # Negated classes, and unicode ones, match some other character.
+    if unicode_flag or source.isupper():
+        mask |= 1 << OTHER
+    return mask
+
+class Unsupported(Exception):
+    '''
+    a regex construct that automata are not made for
+    '''
+
+class RegexAutomaton(object):
+    '''
+    A nondeterministic automaton accepting the strings a regex matches
+    with ``match``, that is the strings starting with a match.
+
+    ``edges`` maps each state to its ``(characters, state)`` transitions,
+    with characters as a bit mask, and ``moves`` to its
+    ``(assertion, state)`` transitions consuming nothing, where the
+    assertion is None, AT_BEGINNING, AT_END or AT_END_STRING.  State 0 is
+    the start state and ``final`` the accepting one.
+    '''
+
+    def __init__(self, pattern, flags=0):
+        if isinstance(pattern, basestring):
+            parsed = sre_parse.parse(pattern, flags)
+            flags = parsed.pattern.flags
+        else:
+            parsed = pattern
+        if flags & (re.IGNORECASE | re.MULTILINE | re.LOCALE):
+            raise Unsupported("flags")
+        self.unicode = bool(flags & re.UNICODE)
+        self.dotall = bool(flags & re.DOTALL)
+        self.edges = []
+        self.moves = []
+        self._closures = {}
+        start = self._state()
+        self.final = self._build(parsed, start)
+        # Anything may follow a match.
+        self.edges[self.final].append((ALL, self.final))
+
+    def _state(self):
+        self.edges.append([])
+        self.moves.append([])
+        return len(self.edges) - 1
+
+    def _move(self, state, assertion=None):
+        target = self._state()
+        self.moves[state].append((assertion, target))
+        return target
+
+    def _build(self, items, state):
+        '''
+        Add the transitions matching the parsed ``items`` from ``state``,
+        returning the state reached.
+        '''
+        for op, av in items:
+            if op in (sre.LITERAL, sre.NOT_LITERAL, sre.ANY, sre.IN):
+                target = self._state()
+                self.edges[state].append((self._mask(op, av), target))
+                state = target
+            elif op is sre.SUBPATTERN:
+                state = self._build(av[-1], state)
+            elif op is sre.BRANCH:
+                end = self._state()
+                for branch in av[1]:
+                    self.moves[self._build(branch, self._move(state))].append((None, end))
+                state = end
+            elif op is sre.GROUPREF_EXISTS:
+                # Either branch, as which one is taken depends on groups
+                # matched before, which only matches more.
+                condgroup, yes, no = av
+                end = self._state()
+                self.moves[self._build(yes, self._move(state))].append((None, end))
+                self.moves[self._build(no or [], self._move(state))].append((None, end))
+                state = end
+            elif op in (sre.MAX_REPEAT, sre.MIN_REPEAT):
+                state = self._repeat(av, state)
+            elif op is sre.AT:
+                if av in (sre.AT_BEGINNING, sre.AT_BEGINNING_STRING):
+                    state = self._move(state, sre.AT_BEGINNING)
+                elif av in (sre.AT_END, sre.AT_END_STRING):
+                    state = self._move(state, av)
+                else:
+                    raise Unsupported(av)
+            else:
+                raise Unsupported(op)
+        return state
+
+    def _repeat(self, repeat, state):
+        low, high, item = repeat
+        if low > MAX_COPIES or (high != sre.MAXREPEAT and high > MAX_COPIES):
+            low, high = 0, sre.MAXREPEAT
+        for i in range(low):
+            state = self._build(item, state)
+        if high == sre.MAXREPEAT:
+            loop = self._move(state)
+            self.moves[self._build(item, loop)].append((None, loop))
+            return loop
+        end = self._state()
+        for i in range(high - low):
+            self.moves[state].append((None, end))
+            state = self._build(item, state)
+        self.moves[state].append((None, end))
+        return end
+
+    def _mask(self, op, av):
+        if op is sre.LITERAL:
+            return 1 << min(av, OTHER)
+        if op is sre.NOT_LITERAL:
+            return ALL & ~(1 << av) if av < OTHER else ALL
+        if op is sre.ANY:
+            return ALL if self.dotall else ALL & ~NEWLINE
+        mask = 0
+        negate = False
+        for item_op, item_av in av:
+            if item_op is sre.NEGATE:
+                negate = True
+            elif item_op is sre.LITERAL:
+                mask |= 1 << min(item_av, OTHER)
+            elif item_op is sre.RANGE:
+                low, high = item_av
+                if low < OTHER:
+                    mask |= ((1 << (min(high, OTHER - 1) + 1)) - 1) & ~((1 << low) - 1)
+                if high >= OTHER:
+                    mask |= 1 << OTHER
+            elif item_op is sre.CATEGORY:
+                category = category_mask(item_av, self.unicode)
+                if category is None:
+                    raise Unsupported(item_av)
+                mask |= category
+            else:
+                raise Unsupported(item_op)
+        if negate:
+            # Whether the class held every other character is not known,
+            # so its negation may hold some.
+            mask = (ALL & ~mask) | (1 << OTHER)
+        return mask
+
+    def closure(self, state, mode, at_start):
+        '''
+        Return the ``(state, mode)`` pairs reached from ``state`` in
+        ``mode`` without consuming a character.
+        '''
+        key = (state, mode, at_start)
+        if key in self._closures:
+            return self._closures[key]
+        reached = set([(state, mode)])
+        pending = [(state, mode)]
+        while pending:
+            state, mode = pending.pop()
+            for assertion, target in self.moves[state]:
+                if assertion is None:
+                    next_mode = mode
+                elif assertion is sre.AT_BEGINNING:
+                    if not at_start:
+                        continue
+                    next_mode = mode
+                elif assertion is sre.AT_END:
+                    # '$' also matches before a final newline.
+                    next_mode = max(mode, NEWLINE_ONLY)
+                else:
+                    next_mode = NOTHING
+                if (target, next_mode) not in reached:
+                    reached.add((target, next_mode))
+                    pending.append((target, next_mode))
+        reached = self._closures[key] = tuple(reached)
+        return reached
+
+def regex_automaton(regex, automata=None):
+    '''
+    Return the automaton of the compiled ``regex``, or None if it cannot
+    be made.  ``automata`` may be a dict caching the automata made.
+    '''
+    key = (regex.pattern, regex.flags)
+    if automata is not None and key in automata:
+        return automata[key]
+    try:
+        automaton = RegexAutomaton(regex.pattern, regex.flags)
+    except (Unsupported, sre.error):
+        automaton = None
+    if automata is not None:
+        automata[key] = automaton
+    return automaton
+
+def example_char(characters):
+    for i in EXAMPLE_CHARS:
+        if characters & (1 << i):
+            return chr(i)
+    return u'\xe9'
+
+def overlapping(automata, focus=None):
+    '''
+    Return a dict of each pair ``(i, j)``, with ``i < j``, of the indexes
+    of automata in ``automata`` accepting a common string to such a string.
+    Only pairs including the automaton at index ``focus`` are looked for
+    if it is given.  Returns None if there are too many strings to tell
+    apart.
+
+    The automata are run together, on sets of their states, so strings
+    are followed only as far as at least two automata accept them.
+    '''
+    # The state of the automata is a set of (index, state, mode).
+    start = frozenset((i, state, mode) for i, automaton in enumerate(automata)
+                      for state, mode in automaton.closure(0, FREE, True))
+    parents = {start : None}
+    pending = deque([start])
+    pairs = {}
+    limit = MAX_STATES + STATES_PER_AUTOMATON * len(automata)
+    while pending:
+        states = pending.popleft()
+        finals = sorted(set(i for i, state, mode in states if state == automata[i].final))
+        if len(finals) > 1:
+            example = None
+            for i, j in combinations(finals, 2):
+                if (i, j) not in pairs and (focus is None or focus in (i, j)):
+                    if example is None:
+                        example = path_to(states, parents)
+                    pairs[i, j] = example
+
+        # Transitions by the characters they consume.
+        targets = {}
+        for i, state, mode in states:
+            for characters, target in automata[i].edges[state]:
+                if mode == FREE:
+                    targets.setdefault(characters, []).append((i, target, FREE))
+                elif mode == NEWLINE_ONLY and characters & NEWLINE:
+                    targets.setdefault(NEWLINE, []).append((i, target, NOTHING))
+        # Characters consumed by the same transitions.
+        blocks = [ALL]
+        for characters in targets:
+            blocks = [block for parent in blocks
+                      for block in (parent & characters, parent & ~characters) if block]
+        for block in blocks:
+            next_states = set()
+            for characters, block_targets in targets.iteritems():
+                if characters & block:
+                    for i, target, mode in block_targets:
+                        for state, next_mode in automata[i].closure(target, mode, False):
+                            next_states.add((i, state, next_mode))
+            # Strings are only followed while two automata accept them
+            # that are not known to overlap yet.
+            alive = set(i for i, state, mode in next_states)
+            if focus is not None:
+                if focus not in alive or all((min(i, focus), max(i, focus)) in pairs
+                                             for i in alive if i != focus):
+                    continue
+            elif not unknown_pairs(alive, pairs):
+                continue
+            next_states = frozenset(next_states)
+            if next_states not in parents:
+                if len(parents) >= limit:
+                    return None
+                parents[next_states] = (states, example_char(block))
+                pending.append(next_states)
+    return pairs
+
+def unknown_pairs(alive, pairs):
+    '''
+    Return whether some pair of the indexes in ``alive`` is not in
+    ``pairs``.
+    '''
+    count = len(alive) * (len(alive) - 1) // 2
+    if count > len(pairs):
+        return True
+    return sum(1 for i, j in pairs if i in alive and j in alive) < count
+
+def path_to(states, parents):
+    example = []
+    while parents[states] is not None:
+        states, char = parents[states]
+        example.append(char)
+    return ''.join(reversed(example))
+
+def regex_overlap(regex1, regex2):
+    '''
+    Return ``(overlapping, example)``: whether some string may match both
+    compiled regexes, and one such string if it is known.
+    '''
+    pairs = overlapping_regexes([regex1, regex2])
+    if (0, 1) not in pairs:
+        return False, None
+    return True, pairs[0, 1]
+
+def overlapping_regexes(regexes, focus=None, related=None, cache=None):
+    '''
+    Return a dict of each pair ``(i, j)``, with ``i < j``, of the indexes
+    of compiled regexes in ``regexes`` that may match the same string to
+    such a string, or None if none is known.  See :func:`overlapping` for
+    ``focus``, and :func:`regex_automaton` for ``cache``.
+
+    Regexes there are no automata for are taken to overlap with the
+    regexes whose indexes ``related`` returns for their index, and with
+    all others if ``related`` is None.
+    '''
+    automata = []
+    indexes = []
+    unknown = []
+    for i, regex in enumerate(regexes):
+        automaton = regex_automaton(regex, cache)
+        if automaton is None:
+            unknown.append(i)
+        else:
+            indexes.append(i)
+            automata.append(automaton)
+    if focus is not None and focus in unknown:
+        unknown = [focus]
+        automata = []
+    found = None
+    if len(automata) > 1:
+        found = overlapping(automata, indexes.index(focus) if focus in indexes else None)
+    pairs = {}
+    if found is None:
+        # Too many strings: check each pair on its own.
+        for i, j in combinations(range(len(automata)), 2):
+            if focus is None or focus in (indexes[i], indexes[j]):
+                found_pair = overlapping([automata[i], automata[j]])
+                if found_pair is None:
+                    pairs[indexes[i], indexes[j]] = None
+                elif found_pair:
+                    pairs[indexes[i], indexes[j]] = found_pair[0, 1]
+    else:
+        for (i, j), example in found.iteritems():
+            pairs[indexes[i], indexes[j]] = example
+    for i in unknown:
+        others = range(len(regexes)) if related is None else related(i)
+        for j in others:
+            if j != i and (focus is None or focus in (i, j)):
+                pairs.setdefault((min(i, j), max(i, j)), None)
+    # Examples are only guesses where automata match more than their
+    # regexes.
+    for (i, j), example in pairs.items():
+        if example is not None and (regexes[i].match(example) is None or regexes[j].match(example) is None):
+            pairs[i, j] = None
+    return pairs
+
+def route_groups(router):
+    '''
+    Yield tuples of routes of ``router``, such that any two routes a lookup
+    may try together are in one of them.
+
+    Lookups only try the routes along the literal segments of a path, so
+    the routes of a node are grouped with those above it, and only with
+    those below it once there are enough of them that splitting the
+    routes below by node would not save much.
+    '''
+    nodes = [(router.root, ())]
+    while nodes:
+        node, above = nodes.pop()
+        above = above + tuple(node.routes)
+        if len(above) > MAX_SPLIT_ROUTES or not node.children:
+            below = [node]
+            group = list(above)
+            while below:
+                child = below.pop()
+                if child is not node:
+                    group.extend(child.routes)
+                below.extend(child.children.itervalues())
+            yield tuple(group)
+            continue
+        if node.routes:
+            yield above
+        nodes.extend((child, above) for child in node.children.itervalues())
+
+def overlapping_routes(router, resource=None):
+    '''
+    Return a list of ``(resource, resource, path)`` for each pair of
+    resources of ``router`` a lookup may find together, with a path both
+    may match, or None if none is known.  Only pairs including
+    ``resource`` are returned if it is given.
+    '''
+    if resource is None:
+        groups = route_groups(router)
+    else:
+        groups = [tuple(router.related(resource['path']))]
+    cache = {}
+    found = {}
+    for routes in groups:
+        if len(routes) < 2:
+            continue
+        indexes = dict((id(route), i) for i, route in enumerate(routes))
+        def related(i):
+            return [indexes[id(route)] for route in router.related(routes[i].resource['path'])
+                    if id(route) in indexes]
+        focus = None
+        if resource is not None:
+            focus = [i for i, route in enumerate(routes) if route.resource is resource][0]
+        pairs = overlapping_regexes([route.regex for route in routes], focus, related, cache)
+        for (i, j), example in pairs.iteritems():
+            key = frozenset((id(routes[i]), id(routes[j])))
+            if key not in found:
+                found[key] = (routes[i], routes[j], example)
+    order = dict((id(route), i) for i, route in enumerate(router.routes()))
+    return [(route1.resource, route2.resource, example) for route1, route2, example in
+            sorted(found.itervalues(), key=lambda pair: (order[id(pair[0])], order[id(pair[1])]))]
+
+def route_overlaps(router):
+    '''
+    Return a dict of the id of each resource of ``router`` whose path regex
+    may match the same path as the regex of another resource to a tuple
+    of those resources.
+    '''
+    overlaps = {}
+    for resource1, resource2, example in overlapping_routes(router):
+        overlaps[id(resource1)] = overlaps.get(id(resource1), ()) + (resource2,)
+        overlaps[id(resource2)] = overlaps.get(id(resource2), ()) + (resource1,)
+    return overlaps
+
+def resource_overlaps(router, resource):
+    '''
+    Return a tuple of the resources of ``router`` whose path regexes may
+    match the same path as that of ``resource``, one of its resources.
+    '''
+    return tuple(resource2 if resource1 is resource else resource1
+                 for resource1, resource2, example in overlapping_routes(router, resource))
@@ -0,0 +1,171 @@
+'''
+Validation plans: the parts of a restdoc consulted for each request and
+response to a resource method, gathered once when the validator is built.
+'''
+from .schema import SchemaSelector
+
+class PlanTables(object):
+    '''
+    Parts shared between the plans built with the same compiled schemas:
+    equal header tuples and schema name sets are stored once, and the
+    plans of restdoc wide status codes are shared by every method that
+    does not override them.
+    '''
+
+    __slots__ = ('values', 'status_plans')
+
+    def __init__(self):
+        self.values = {}
+        self.status_plans = {}
+
+    def shared(self, value):
+        return self.values.setdefault(value, value)
+
+def required_headers(*header_specs):
+    '''
+    Return the ``(header, lowercased header)`` pairs of the headers marked
+    required in the given header spec dicts, in order.
+    '''
+    required = []
+    for specs in header_specs:
+        for header, header_spec in specs.iteritems():
+            if 'required' in header_spec and header_spec['required']:
+                required.append((header, header.lower()))
+    return tuple(required)
+
+class SchemaChoice(object):
+    '''
+    An ``accepts`` or response ``types`` entry.  ``schema`` is the compiled
+    inline schema it names, or None if the schema is unknown or not inline.
+    '''
+
+    __slots__ = ('spec', 'schema')
+
+    def __init__(self, spec, schemas):
+        self.spec = spec
+        self.schema = None
+        if 'schema' in spec:
+            self.schema = schemas.get(spec['schema'])
+
+# Selectors are never changed, so all selectors without choices are one.
+NO_CHOICES = SchemaSelector(())
+
+def schema_choices(specs, schemas):
+    if not specs:
+        return NO_CHOICES
+    return SchemaSelector(tuple([SchemaChoice(spec, schemas) for spec in specs]))
+
+def rebound_choices(selector, schemas):
+    return schema_choices([choice.spec for choice in selector.choices], schemas)
+
+class ResponsePlan(object):
+    '''
+    What a response with one status code must contain.  Bodies are tried
+    against ``status_types`` and then ``method_types``; a match in the
+    latter takes precedence.
+    '''
+
+    __slots__ = ('status_types', 'method_types', 'required_headers')
+
+    def __init__(self, status_spec, method_spec, restdoc, schemas, tables=None):
+        header_specs = []
+        if isinstance(status_spec, dict) and 'response' in status_spec:
+            self.status_types = schema_choices(status_spec['response'].get('types', []), schemas)
+            header_specs.append(status_spec['response'].get('headers', {}))
+        else:
+            self.status_types = NO_CHOICES
+        if 'response' in method_spec:
+            self.method_types = schema_choices(method_spec['response'].get('types', []), schemas)
+            header_specs.append(method_spec['response'].get('headers', {}))
+        else:
+            self.method_types = NO_CHOICES
+        header_specs.append(restdoc.get('headers', {}).get('response', {}))
+        self.required_headers = required_headers(*header_specs)
+        if tables is not None:
+            self.required_headers = tables.shared(self.required_headers)
+
+    def rebound(self, schemas):
+        '''
+        Return a copy of this plan using the compiled ``schemas``.
+        '''
+        plan = ResponsePlan.__new__(ResponsePlan)
+        plan.status_types = rebound_choices(self.status_types, schemas)
+        plan.method_types = rebound_choices(self.method_types, schemas)
+        plan.required_headers = self.required_headers
+        return plan
+
+class MethodPlan(object):
+    '''
+    Everything needed to validate requests to and responses from one
+    method of a resource.  ``responses`` maps status codes, as strings and
+    integers, to a :class:`ResponsePlan`; it is None if the method has no
+    ``statusCodes``.  ``schema_names`` holds the names of every schema the
+    plan refers to.
+
+    Plans built with the same ``tables`` share the parts they have in
+    common.
+    '''
+
+    __slots__ = ('name', 'required_headers', 'accepts', 'responses', 'schema_names')
+
+    def __init__(self, name, method_spec, restdoc, schemas, tables=None):
+        if tables is None:
+            tables = PlanTables()
+        self.name = name
+        self.required_headers = tables.shared(required_headers(method_spec.get('headers', {}),
+                restdoc.get('headers', {}).get('request', {})))
+        if 'accepts' in method_spec:
+            self.accepts = schema_choices(method_spec['accepts'], schemas)
+        else:
+            self.accepts = None
+
+        if 'statusCodes' in method_spec:
+            # Method status codes override the restdoc wide ones.
+            status_codes = dict(restdoc.get('statusCodes', {}))
+            status_codes.update(method_spec['statusCodes'])
+            self.responses = {}
+            for key, status_spec in status_codes.iteritems():
+                status = str(key)
+                if 'response' in method_spec or key in method_spec['statusCodes']:
+                    plan = ResponsePlan(status_spec, method_spec, restdoc, schemas, tables)
+                else:
+                    plan = tables.status_plans.get(status)
+                    if plan is None:
+                        plan = tables.status_plans[status] = ResponsePlan(status_spec, method_spec,
+                                                                          restdoc, schemas, tables)
+                self.responses[tables.shared(status)] = plan
+                if status.isdigit():
+                    self.responses[int(status)] = plan
+        else:
+            self.responses = None
+
+        selectors = [self.accepts]
+        for plan in (self.responses or {}).itervalues():
+            selectors.extend((plan.status_types, plan.method_types))
+        self.schema_names = tables.shared(frozenset(choice.spec['schema'] for selector in selectors
+                if selector is not None for choice in selector.choices if 'schema' in choice.spec))
+
+    def rebound(self, schemas, rebound_plans=None):
+        '''
+        Return a copy of this plan using the compiled ``schemas``.  Response
+        plans shared between plans stay shared between plans rebound with
+        the same ``rebound_plans`` dict.
+        '''
+        if rebound_plans is None:
+            rebound_plans = {}
+        plan = MethodPlan.__new__(MethodPlan)
+        plan.name = self.name
+        plan.required_headers = self.required_headers
+        plan.schema_names = self.schema_names
+        plan.accepts = None
+        if self.accepts is not None:
+            plan.accepts = rebound_choices(self.accepts, schemas)
+        plan.responses = None
+        if self.responses is not None:
+            plan.responses = {}
+            for status, response_plan in self.responses.iteritems():
+                rebound = rebound_plans.get(id(response_plan))
+                if rebound is None:
+                    rebound = rebound_plans[id(response_plan)] = response_plan.rebound(schemas)
+                plan.responses[status] = rebound
+        return plan
@@ -0,0 +1,166 @@
+'''
+Validators for many restdocs at once.
+
+A :class:`ValidatorRegistry` holds one RestdocValidator per restdoc, keyed
+by tenant, API version or anything else hashable.  Restdocs served side by
+side tend to repeat the same definitions: error envelopes, paging
+wrappers, ``/{id}`` segments.  The validators of a registry share one
+compiled copy of each path regex and of each schema, found by content, so
+the memory and time taken by the registry grow with the number of distinct
+definitions rather than with the number of restdocs.
+'''
+import hashlib
+import json
+import re
+from threading import Lock
+from weakref import WeakValueDictionary
+
+from .schema import CompiledSchema
+from .validate import RestdocValidator, RestdocError
+
+class SharedSchemas(object):
+    '''
+    Compiled schemas shared by content between validators of the same
+    schema validator class and format validators.
+
+    Only schemas without references are shared; the others depend on the
+    schemas of their restdoc.  Shared schemas are validated by
+    ``validator``, which knows no schemas, and are dropped once no
+    validator uses them.
+    '''
+
+    def __init__(self, validator):
+        self.validator = validator
+        self.schemas = WeakValueDictionary()
+        self._lock = Lock()
+
+    def __getstate__(self):
+        # Copies start out sharing nothing.
+        return self.validator
+
+    def __setstate__(self, validator):
+        self.__init__(validator)
+
+    def share(self, name, schema):
+        '''
+        Return the shared compiled schema with the content of the JSON
+        schema ``schema``, named ``name`` if it is compiled now, or None if
+        the schema cannot be shared.
+        '''
+        # Keys are not sorted, which would take the encoder's slow path, so
+        # equal schemas whose keys are ordered differently are not shared.
+        try:
+            text = json.dumps(schema)
+        except (TypeError, ValueError):
+            return None
+        if '"$ref"' in text:
+            return None
+        key = hashlib.sha1(text).digest()
+        with self._lock:
+            compiled = self.schemas.get(key)
+            if compiled is None:
+                compiled = self.schemas[key] = CompiledSchema(name, schema, self.validator)
+        return compiled
+
+class SharedDefinitions(object):
+    '''
+    Compiled path regexes, keyed by their source, and compiled schemas,
+    keyed by the validator settings they are checked with, for validators
+    to share.  Regexes are dropped once no validator uses them.
+    '''
+
+    def __init__(self):
+        self.regexes = WeakValueDictionary()
+        # (validator class, id of format validators) ->
+        #     (format validators, SharedSchemas)
+        self.schemas = {}
+        self._lock = Lock()
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def regex(self, source):
+        '''
+        Return the compiled regex of ``source``.  Raises re.error if it is
+        invalid.
+        '''
+        with self._lock:
+            regex = self.regexes.get(source)
+        if regex is None:
+            regex = re.compile(source)
+            with self._lock:
+                regex = self.regexes.setdefault(source, regex)
+        return regex
+
+    def sharedSchemas(self, validator_cls, format_validators, make_validator):
+        '''
+        Return the SharedSchemas for validators using ``validator_cls``
+        and ``format_validators``, making its schema validator with
+        ``make_validator`` if there is none yet.
+        '''
+        key = (validator_cls, id(format_validators))
+        with self._lock:
+            if key not in self.schemas:
+                self.schemas[key] = (format_validators, SharedSchemas(make_validator()))
+            return self.schemas[key][1]
+
+class ValidatorRegistry(object):
+    '''
+    RestdocValidators keyed by tenant, version or any other hashable key.
+
+    ``options`` are passed to every validator built, along with those
+    given to :meth:`add`.  Lookups take no lock, and a validator being
+    replaced serves requests until its successor is in place.
+    '''
+
+    def __init__(self, **options):
+        self.options = options
+        self.shared = SharedDefinitions()
+        self._validators = {}
+        self._lock = Lock()
+
+    def add(self, key, restdoc, **options):
+        '''
+        Build a validator for ``restdoc`` and register it under ``key``,
+        replacing any registered there before.  Returns the validator.
+        '''
+        validator = RestdocValidator(restdoc, shared=self.shared, **dict(self.options, **options))
+        with self._lock:
+            self._validators[key] = validator
+        return validator
+
+    def remove(self, key):
+        with self._lock:
+            if key not in self._validators:
+                raise RestdocError("Unknown restdoc: %r" % (key,))
+            del self._validators[key]
+
+    def __getitem__(self, key):
+        try:
+            return self._validators[key]
+        except KeyError:
+            raise RestdocError("Unknown restdoc: %r" % (key,))
+
+    def get(self, key, default=None):
+        return self._validators.get(key, default)
+
+    def __contains__(self, key):
+        return key in self._validators
+
+    def __len__(self):
+        return len(self._validators)
+
+    def keys(self):
+        return self._validators.keys()
+
+    def findResource(self, key, path):
+        return self[key].findResource(path)
+
+    def validateRequest(self, key, *args, **kwargs):
+        return self[key].validateRequest(*args, **kwargs)
+
+    def validateResponse(self, key, *args, **kwargs):
+        return self[key].validateResponse(*args, **kwargs)
@@ -0,0 +1,288 @@
+import re
+from collections import OrderedDict
+from threading import Lock
+
+# The part of a uri template that expand_regex copies into its regex
+# verbatim and that also matches only itself: everything up to the first
+# expression or regex metacharacter.
+literal_prefix_re = re.compile(r"[^{}.^$*+?()\[\]\\|]*")
+
+class RouteNode(object):
+    '''
+    A node in the router's segment trie.  ``routes`` holds the resources
+    whose literal path prefix ends at this node; ``children`` maps the next
+    literal path segment to the child node.
+    '''
+
+    __slots__ = ('children', 'routes')
+
+    def __init__(self):
+        self.children = {}
+        self.routes = []
+
+    def copy(self):
+        node = RouteNode()
+        node.children = dict(self.children)
+        node.routes = list(self.routes)
+        return node
+
+class Route(object):
+    '''
+    A resource together with the compiled regex matching its path.
+
+    Routes are pickled with the source of their regex, which is only
+    compiled again once a route loaded from a pickle is first tried.
+    '''
+
+    __slots__ = ('resource', 'regex')
+
+    def __init__(self, resource, regex):
+        self.resource = resource
+        self.regex = regex
+
+    def __getstate__(self):
+        regex = self.regex
+        if not isinstance(regex, LazyRegex):
+            regex = LazyRegex(regex.pattern, regex.flags)
+        return self.resource, regex
+
+    def __setstate__(self, state):
+        self.resource, self.regex = state
+
+class LazyRegex(object):
+    '''
+    A regex that is compiled, once, when it is first used.
+    '''
+
+    __slots__ = ('pattern', 'flags', '_lock', '_regex', 'match')
+
+    def __init__(self, pattern, flags=0):
+        self.pattern = pattern
+        self.flags = flags
+        self._lock = Lock()
+
+    def _compile(self):
+        return re.compile(self.pattern, self.flags)
+
+    def compiled(self):
+        '''
+        Return the compiled regex, compiling it if it is not yet.
+        '''
+        regex = getattr(self, '_regex', None)
+        if regex is None:
+            with self._lock:
+                regex = getattr(self, '_regex', None)
+                if regex is None:
+                    regex = self._regex = self._compile()
+                    # Later calls of match skip __getattr__.
+                    self.match = regex.match
+        return regex
+
+    def __getstate__(self):
+        # Pickled without the compiled regex.  Slots are read directly, as
+        # getattr would compile the regex to look up unset ones.
+        attributes = {}
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if name not in ('_lock', '_regex', 'match'):
+                    try:
+                        attributes[name] = cls.__dict__[name].__get__(self, cls)
+                    except AttributeError:
+                        pass
+        return attributes
+
+    def __setstate__(self, attributes):
+        for name, value in attributes.iteritems():
+            setattr(self, name, value)
+        self._lock = Lock()
+
+    def __getattr__(self, name):
+        # Only called for attributes not set; private ones stay unset
+        # rather than being looked up on the regex.
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.compiled(), name)
+
+def literal_segments(template):
+    '''
+    Return the path segments of ``template`` that are known literally,
+    before any expression or regex metacharacter is reached.
+    '''
+    prefix = literal_prefix_re.match(template).group(0)
+    segments = prefix.split('/')
+    if len(prefix) < len(template):
+        # The last segment continues into the variable part of the
+        # template, so only the segments before it are known.
+        segments.pop()
+    return segments
+
+class ResourceRouter(object):
+    '''
+    Maps request paths to resources.
+
+    Resources are kept in a trie keyed on the literal segments of their
+    path templates, so a lookup only walks the segments of the requested
+    path and tries the regexes of the resources found along the way,
+    instead of the regex of every resource.
+
+    :meth:`add` changes the router in place and is meant for building it.
+    A router that may be in use is changed with :meth:`added` and
+    :meth:`removed` instead, which leave it untouched and return a new
+    router sharing all but the nodes along the changed path.
+    '''
+
+    def __init__(self, root=None):
+        if root is None:
+            root = RouteNode()
+        self.root = root
+
+    def add(self, resource, regex):
+        node = self.root
+        for segment in literal_segments(resource['path']):
+            child = node.children.get(segment)
+            if child is None:
+                child = node.children[segment] = RouteNode()
+            node = child
+        node.routes.append(Route(resource, regex))
+
+    def added(self, resource, regex):
+        '''
+        Return a copy of this router also routing to ``resource``.
+        '''
+        root = node = self.root.copy()
+        for segment in literal_segments(resource['path']):
+            child = node.children.get(segment)
+            if child is None:
+                child = RouteNode()
+            else:
+                child = child.copy()
+            node.children[segment] = child
+            node = child
+        node.routes.append(Route(resource, regex))
+        return ResourceRouter(root)
+
+    def removed(self, resource):
+        '''
+        Return a copy of this router no longer routing to ``resource``.
+        '''
+        segments = literal_segments(resource['path'])
+        path = [self.root]
+        for segment in segments:
+            child = path[-1].children.get(segment)
+            if child is None:
+                return self
+            path.append(child)
+        routes = [route for route in path[-1].routes if route.resource is not resource]
+        if len(routes) == len(path[-1].routes):
+            return self
+        # Copy the path bottom up, dropping nodes left empty.
+        node = path[-1].copy()
+        node.routes = routes
+        for parent, segment in reversed(zip(path[:-1], segments)):
+            parent = parent.copy()
+            if node.routes or node.children:
+                parent.children[segment] = node
+            else:
+                del parent.children[segment]
+            node = parent
+        return ResourceRouter(node)
+
+    def routes(self):
+        '''
+        Yield every route of the router.
+        '''
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            for route in node.routes:
+                yield route
+            nodes.extend(node.children.itervalues())
+
+    def related(self, template):
+        '''
+        Yield the routes a lookup may try along with a route to a resource
+        with path ``template``: those of the nodes on its literal path,
+        its own node included, and those of the nodes below it.
+        '''
+        node = self.root
+        for segment in literal_segments(template):
+            for route in node.routes:
+                yield route
+            node = node.children.get(segment)
+            if node is None:
+                return
+        nodes = [node]
+        while nodes:
+            node = nodes.pop()
+            for route in node.routes:
+                yield route
+            nodes.extend(node.children.itervalues())
+
+    def match(self, path):
+        '''
+        Yield a ``(resource, match)`` pair for every resource whose path
+        regex matches ``path``.
+        '''
+        # '$' also matches before a trailing newline, which must not
+        # leave the last segment unrecognized.
+        if path[-1:] == '\n':
+            segments = path[:-1].split('/')
+        else:
+            segments = path.split('/')
+        node = self.root
+        i = 0
+        while True:
+            for route in node.routes:
+                r = route.regex.match(path)
+                if r is not None:
+                    yield route.resource, r
+            if i == len(segments):
+                return
+            node = node.children.get(segments[i])
+            if node is None:
+                return
+            i += 1
+
+class PathCache(object):
+    '''
+    A bounded, least-recently-used cache of path lookups.
+
+    Values are stored as given, so callers must only store values they
+    never mutate.  ``hits`` and ``misses`` count the lookups made with
+    :meth:`get`.
+    '''
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError("Cache size must be positive.")
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, path):
+        with self._lock:
+            try:
+                value = self._entries.pop(path)
+            except KeyError:
+                self.misses += 1
+                return None
+            # Re-insert to mark as most recently used.
+            self._entries[path] = value
+            self.hits += 1
+            return value
+
+    def put(self, path, value):
+        with self._lock:
+            self._entries.pop(path, None)
+            self._entries[path] = value
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,378 @@
+'''
+Compilation of the inline JSON schemas of a restdoc.
+
+Each inline schema in ``restdoc['schemas']`` is compiled once into a
+:class:`CompiledSchema`.  References of the form ``{"$ref": name}`` to
+other inline schemas are replaced by the referenced schema, so the schema
+validator does not have to look them up for every body.  References that
+recurse through a schema's own structure are left for the validator to
+follow; references that only alias each other in a loop can never be
+resolved and are rejected.
+
+Schemas checked by validictory's own SchemaValidator are also turned into
+Python functions by :class:`restdoc.codegen.SchemaCodegen`, which return
+whether a body matches without interpreting the schema.  Bodies these
+functions reject, and schemas using keywords they do not implement, are
+left to the validator, which reports why a body does not match.
+'''
+from validictory import SchemaValidator
+
+class SchemaCycleError(ValueError):
+    '''
+    a chain of schema references that refers back to itself
+    '''
+
+class CompiledSchema(object):
+    '''
+    A callable validating a body against a named inline schema.  Raises
+    ValueError if the body does not match.  ``required`` is the set of
+    properties the schema requires, as returned by required_properties.
+    ``schemas`` are the restdoc schemas ``schema`` may still refer to.
+    '''
+
+    __slots__ = ('name', 'schema', 'validator', 'required', 'check_source', 'check',
+                 '__weakref__')
+
+    def __init__(self, name, schema, validator, schemas=None):
+        self.name = name
+        self.schema = schema
+        self.validator = validator
+        self.required = required_properties(schema)
+        # Subclasses may check keywords differently, so their schemas are
+        # only ever checked by the validator.
+        self.check_source = None
+        if type(validator) is SchemaValidator:
+            self.check_source = schema_check(name, schema, schemas or {})
+        self.check = define_check(self.check_source)
+
+    def __getstate__(self):
+        # Generated functions cannot be pickled; they are defined again
+        # from their source.
+        return self.name, self.schema, self.validator, self.required, self.check_source
+
+    def __setstate__(self, state):
+        self.name, self.schema, self.validator, self.required, self.check_source = state
+        self.check = define_check(self.check_source)
+
+    def __call__(self, body):
+        if self.check is not None and self.check(body):
+            return
+        self.validator.validate(body, self.schema)
+
+def schema_check(name, schema, schemas):
+    '''
+    Return the source of a function ``check`` returning whether a body
+    matches ``schema``, the inline schema ``name`` of ``schemas``, or None
+    if code cannot be generated for it.
+    '''
+    # restdoc.codegen builds on the validator, which builds on this module.
+    from .codegen import ModuleWriter, SchemaCodegen, RestdocError
+    if name not in schemas:
+        schemas = {name : {"type" : "inline", "schema" : schema}}
+    writer = ModuleWriter()
+    codegen = SchemaCodegen(schemas, writer)
+    function = codegen.function(name)
+    try:
+        codegen.generate()
+    except (RestdocError, RuntimeError):
+        # Unsupported keywords, or schemas nested too deeply.
+        return None
+    return '\n'.join(writer.constant_lines + writer.function_sources + ['', 'check = %s' % function])
+
+# The globals of generated checks, defined from restdoc.codegen's module
+# header when the first check is.
+_check_globals = {}
+
+def define_check(source):
+    '''
+    Return the function defined by the source returned by schema_check,
+    or None if there is none or Python cannot compile it.
+    '''
+    if source is None:
+        return None
+    if not _check_globals:
+        from .codegen import module_header
+        header = {}
+        exec module_header in header
+        _check_globals.update(header)
+    namespace = dict(_check_globals)
+    try:
+        exec source in namespace
+    except (SyntaxError, RuntimeError, MemoryError):
+        # Python limits how deeply blocks may be nested.
+        return None
+    return namespace['check']
+
+def inline_schema(schema_spec):
+    '''
+    Return the JSON schema of an inline restdoc schema spec, or None for
+    other schema types.
+    '''
+    if isinstance(schema_spec, dict) and schema_spec.get('type', 'url') == 'inline' \
+            and 'schema' in schema_spec:
+        return schema_spec['schema']
+    return None
+
+class SchemaCompiler(object):
+    '''
+    Resolves the references between the inline schemas of a restdoc.
+    '''
+
+    def __init__(self, schemas):
+        self.schemas = schemas
+        self.resolved = {}
+        # Names of the schemas being resolved, outermost first.
+        self.stack = []
+
+    def resolve(self, name):
+        if name not in self.resolved:
+            self.stack.append(name)
+            self.resolved[name] = self._resolve(inline_schema(self.schemas[name]), [name])
+            self.stack.pop()
+        return self.resolved[name]
+
+    def _resolve(self, node, aliases):
+        # ``aliases`` holds the schemas reached from the current one by
+        # plain references only, without descending into any structure.
+        if isinstance(node, dict):
+            ref = node.get('$ref')
+            if len(node) == 1 and self._is_inline(ref):
+                if ref in aliases:
+                    raise SchemaCycleError("Schema reference cycle: %s" %
+                                           " -> ".join(aliases + [ref]))
+                if ref in self.stack:
+                    # Recursive schema; leave it to the validator.
+                    return node
+                if ref in self.resolved:
+                    return self.resolved[ref]
+                self.stack.append(ref)
+                resolved = self._resolve(inline_schema(self.schemas[ref]), aliases + [ref])
+                self.stack.pop()
+                self.resolved[ref] = resolved
+                return resolved
+            resolved = dict((key, self._resolve(value, [])) for key, value in node.iteritems())
+            changed = any(resolved[key] is not value for key, value in node.iteritems())
+        elif isinstance(node, list):
+            resolved = [self._resolve(value, []) for value in node]
+            changed = any(new is not old for new, old in zip(resolved, node))
+        else:
+            return node
+        # Share the parts of the schema that contain no references.
+        if changed:
+            return resolved
+        return node
+
+    def _is_inline(self, name):
+        return isinstance(name, basestring) and name in self.schemas \
+                and inline_schema(self.schemas[name]) is not None
+
+def compile_schemas(schemas, validator, unchanged=None, shared=None):
+    '''
+    Compile every inline schema in ``schemas``, returning a dict of schema
+    name to :class:`CompiledSchema`.  Raises :class:`SchemaCycleError` if
+    schemas reference each other in a loop.
+
+    ``unchanged`` may map the names of schemas that, along with every
+    schema they refer to, are the same as when they were last compiled to
+    their compiled schemas, which are reused rather than compiled again.
+
+    ``shared``, if given, is a :class:`restdoc.registry.SharedSchemas`
+    whose copy of a schema, if it has one, is used instead of compiling it.
+    '''
+    compiler = SchemaCompiler(schemas)
+    compiled = {}
+    if unchanged:
+        for name, schema in unchanged.iteritems():
+            compiler.resolved[name] = schema.schema
+    for name, schema_spec in schemas.iteritems():
+        if inline_schema(schema_spec) is None:
+            continue
+        if unchanged and name in unchanged:
+            compiled[name] = unchanged[name]
+        else:
+            schema = None
+            if shared is not None:
+                schema = shared.share(name, inline_schema(schema_spec))
+            if schema is None:
+                schema = CompiledSchema(name, compiler.resolve(name), validator, schemas)
+            compiled[name] = schema
+    return compiled
+
+class LazySchemas(dict):
+    '''
+    A dict of schema name to :class:`CompiledSchema` like the one returned
+    by :func:`compile_schemas`, except that schemas are compiled when they
+    are first looked up, so it only holds the schemas compiled so far.
+    Lookups must not be made from several threads at once.
+    '''
+
+    def __init__(self, schemas, validator, unchanged=None, shared=None):
+        dict.__init__(self)
+        self.compiler = SchemaCompiler(schemas)
+        self.validator = validator
+        self.shared = shared
+        if unchanged:
+            for name, schema in unchanged.iteritems():
+                self.compiler.resolved[name] = schema.schema
+                self[name] = schema
+
+    def __missing__(self, name):
+        if not self.compiler._is_inline(name):
+            raise KeyError(name)
+        schema = None
+        if self.shared is not None:
+            schema = self.shared.share(name, inline_schema(self.compiler.schemas[name]))
+        if schema is None:
+            try:
+                schema = CompiledSchema(name, self.compiler.resolve(name), self.validator,
+                                        self.compiler.schemas)
+            except SchemaCycleError:
+                self.compiler.stack = []
+                raise
+        self[name] = schema
+        return schema
+
+    def __contains__(self, name):
+        return self.compiler._is_inline(name)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def compile_all(self):
+        for name in self.compiler.schemas:
+            self.get(name)
+
+def schema_references(node, refs=None):
+    '''
+    Return the set of every ``$ref`` made anywhere in a JSON schema.
+    '''
+    if refs is None:
+        refs = set()
+    if isinstance(node, dict):
+        if isinstance(node.get('$ref'), basestring):
+            refs.add(node['$ref'])
+        for value in node.itervalues():
+            schema_references(value, refs)
+    elif isinstance(node, list):
+        for value in node:
+            schema_references(value, refs)
+    return refs
+
+def dependent_schemas(schemas, names):
+    '''
+    Return the set of ``names`` along with the names of every schema in
+    ``schemas`` referring to one of them, directly or through others.
+    '''
+    referrers = {}
+    for name, schema_spec in schemas.iteritems():
+        for ref in schema_references(inline_schema(schema_spec)):
+            referrers.setdefault(ref, set()).add(name)
+    dependent = set(names)
+    pending = list(dependent)
+    while pending:
+        for name in referrers.get(pending.pop(), ()):
+            if name not in dependent:
+                dependent.add(name)
+                pending.append(name)
+    return dependent
+
+def required_properties(schema):
+    '''
+    Return the set of properties an object schema requires, or None if
+    ``schema`` does not describe an object.
+    '''
+    if not isinstance(schema, dict) or schema.get('type') != 'object':
+        return None
+    required = set()
+    if isinstance(schema.get('required'), list):
+        required.update(schema['required'])
+    properties = schema.get('properties', {})
+    for name, spec in properties.iteritems():
+        if isinstance(spec, dict) and spec.get('required') is True:
+            required.add(name)
+    return frozenset(required)
+
+def property_enum(schema, name):
+    '''
+    Return the set of values allowed for property ``name`` of ``schema``,
+    or None if they are not restricted to a hashable enum.  Properties
+    allowing blank strings are not restricted, as the enum check accepts
+    '' for them.
+    '''
+    spec = schema.get('properties', {}).get(name)
+    if not isinstance(spec, dict) or not isinstance(spec.get('enum'), list):
+        return None
+    if spec.get('blank', False):
+        return None
+    try:
+        return frozenset(spec['enum'])
+    except TypeError:
+        return None
+
+class SchemaSelector(object):
+    '''
+    Narrows down the ``accepts`` or response ``types`` choices a body can
+    match before any of them is tried.
+
+    If every choice is an object schema requiring a property restricted to
+    an enum, that property discriminates between them and the candidates
+    are found with one dict lookup, unless the property is null, which the
+    enum check lets through.  Otherwise choices requiring properties the
+    body lacks are skipped.  Candidates keep their original order, and
+    only choices that would certainly reject the body are left out.
+    '''
+
+    __slots__ = ('choices', 'required', 'discriminator', 'index', 'filtered')
+
+    def __init__(self, choices):
+        self.choices = choices
+        required = []
+        for choice in choices:
+            if choice.schema is None:
+                required.append(None)
+            else:
+                required.append(choice.schema.required)
+        self.required = tuple(required)
+        self.discriminator = None
+        self.index = None
+        if len(choices) > 1 and None not in self.required:
+            self._index_discriminator()
+        self.filtered = any(self.required)
+
+    def _index_discriminator(self):
+        common = reduce(frozenset.intersection, self.required)
+        best_size = None
+        for name in sorted(common):
+            enums = [property_enum(choice.schema.schema, name) for choice in self.choices]
+            if None in enums:
+                continue
+            index = {}
+            for choice, values in zip(self.choices, enums):
+                for value in values:
+                    index.setdefault(value, []).append(choice)
+            size = max(len(bucket) for bucket in index.itervalues())
+            if best_size is None or size < best_size:
+                best_size = size
+                self.discriminator = name
+                self.index = dict((value, tuple(bucket)) for value, bucket in index.iteritems())
+
+    def select(self, body):
+        if not isinstance(body, dict):
+            return self.choices
+        if self.discriminator is not None:
+            if self.discriminator not in body:
+                return ()
+            value = body[self.discriminator]
+            if value is not None:
+                try:
+                    return self.index.get(value, ())
+                except TypeError:
+                    # Unhashable values match no enum.
+                    return ()
+        if not self.filtered:
+            return self.choices
+        return tuple([choice for choice, required in zip(self.choices, self.required)
+                      if not required or required.issubset(body)])
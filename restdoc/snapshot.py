@@ -0,0 +1,64 @@
+'''
+Snapshots of fully built validators.
+
+Building a :class:`RestdocValidator` expands the path template of every
+resource and resolves every schema and method plan.  :func:`save_snapshot`
+writes a built validator to a file from which :func:`load_snapshot` reads
+it back without redoing that work; only the path regexes are compiled
+again.  Snapshots are pickles, so only load snapshots you wrote yourself.
+
+Pre-fork servers should build or load the validator once before forking
+and call :func:`freeze` just before they fork.
+'''
+import cPickle as pickle
+import gc
+
+from .validate import RestdocError
+
+# The first line of every snapshot, changed whenever the pickled
+# validator internals change.
+SNAPSHOT_HEADER = 'restdoc snapshot 5\n'
+
+def save_snapshot(validator, stream):
+    '''
+    Write ``validator`` to the binary stream ``stream``.  Raises
+    RestdocError if it cannot be pickled, e.g. because it was given
+    lambdas as format validators.
+    '''
+    try:
+        data = pickle.dumps(validator, pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError) as e:
+        raise RestdocError("Validator cannot be saved: %s" % e)
+    stream.write(SNAPSHOT_HEADER)
+    stream.write(data)
+
+def load_snapshot(stream):
+    '''
+    Read a validator written by :func:`save_snapshot` from the binary
+    stream ``stream``.
+    '''
+    if stream.readline() != SNAPSHOT_HEADER:
+        raise RestdocError("Not a restdoc snapshot, or one from another version of restdoc.")
+    # Nothing allocated while loading is garbage, so do not look for any.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return pickle.load(stream)
+    finally:
+        if enabled:
+            gc.enable()
+
+def freeze():
+    '''
+    Get the objects allocated so far, such as validators, ready to be
+    shared with forked processes.
+
+    Garbage is collected first, so that the surviving objects are not
+    examined again until a full collection.  Where the interpreter has
+    ``gc.freeze``, they are then left out of collections altogether, so
+    collections in forked processes no longer write to, and so copy, the
+    memory pages they share with the parent.
+    '''
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
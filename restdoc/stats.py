@@ -0,0 +1,204 @@
+'''
+Optional instrumentation of RestdocValidator.
+
+Instrumentation is turned on with :meth:`RestdocValidator.enableStats`,
+which shadows the validator's methods on the hot path with timed versions
+of them.  While it is off, those instance attributes do not exist, so
+validation runs the plain methods and pays nothing for instrumentation.
+
+Each validation is split into phases:
+
+``routing``
+    finding the resource and the plan of its method
+``body``
+    reading raw bodies
+``schemas``
+    validating the body against schemas
+``headers``
+    the rest: checking required headers and status codes
+'''
+from threading import Lock, local
+from timeit import default_timer
+
+from .validate import RestdocError
+
+PHASES = ('routing', 'headers', 'body', 'schemas')
+KINDS = ('request', 'response')
+
+class ValidatorStats(object):
+    '''
+    Totals of the validations made while instrumentation is on.  Use
+    :meth:`snapshot` to read them.
+    '''
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def __getstate__(self):
+        attributes = dict(self.__dict__)
+        del attributes['_lock']
+        return attributes
+
+    def __setstate__(self, attributes):
+        self.__dict__.update(attributes)
+        self._lock = Lock()
+
+    def reset(self):
+        with self._lock:
+            self.validations = dict.fromkeys(KINDS, 0)
+            self.failures = dict.fromkeys(KINDS, 0)
+            self.seconds = dict.fromkeys(PHASES, 0.0)
+            # Resource name -> validations.
+            self.resources = {}
+            # Schema name -> [attempts, matches].
+            self.schemas = {}
+            # Attempts made by each match -> number of matches.
+            self.attempts = {}
+
+    def record(self, call, error):
+        with self._lock:
+            self.validations[call.kind] += 1
+            if error is not None:
+                self.failures[call.kind] += 1
+            for phase, seconds in call.phases.iteritems():
+                self.seconds[phase] += seconds
+            if call.resource_name is not None:
+                self.resources[call.resource_name] = self.resources.get(call.resource_name, 0) + 1
+            for name, matched in call.schemas:
+                counts = self.schemas.get(name)
+                if counts is None:
+                    counts = self.schemas[name] = [0, 0]
+                counts[0] += 1
+                if matched:
+                    counts[1] += 1
+            for attempts in call.matches:
+                self.attempts[attempts] = self.attempts.get(attempts, 0) + 1
+
+    def snapshot(self, path_cache=None):
+        '''
+        Return a copy of the totals as plain dicts, with the hit and miss
+        counts of ``path_cache``, if given.
+        '''
+        with self._lock:
+            snapshot = {
+                'validations' : dict(self.validations),
+                'failures' : dict(self.failures),
+                'seconds' : dict(self.seconds),
+                'resources' : dict(self.resources),
+                'schemas' : dict((name, {'attempts' : attempts, 'matches' : matches})
+                                 for name, (attempts, matches) in self.schemas.iteritems()),
+                'attempts' : dict(self.attempts),
+            }
+        if path_cache is not None:
+            snapshot['path_cache'] = {'hits' : path_cache.hits, 'misses' : path_cache.misses,
+                                      'size' : len(path_cache)}
+        return snapshot
+
+class Call(object):
+    '''
+    What one validation spent its time on.
+    '''
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.resource_name = None
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        # (schema name, matched) for each schema tried.
+        self.schemas = []
+        # The attempts made by each schema match.
+        self.matches = []
+
+class Instrumentation(object):
+    '''
+    The timed methods installed on a validator by enableStats.  They run
+    the class's own methods, recording into ``stats`` and passing each
+    call to ``callback``, if given, as ``(kind, resource_name, phases,
+    error)``, where phases maps each phase to the seconds spent on it.
+    '''
+
+    # The methods shadowed on the validator.
+    methods = ('validateRequest', 'validateResponse', '_findMethodPlan', '_matchSchema', '_readBody')
+
+    def __init__(self, validator, stats, callback=None):
+        self.validator = validator
+        self.stats = stats
+        self.callback = callback
+        self.local = local()
+
+    def install(self):
+        for name in self.methods:
+            setattr(self.validator, name, getattr(self, name))
+
+    def uninstall(self):
+        for name in self.methods:
+            self.validator.__dict__.pop(name, None)
+
+    def _validate(self, kind, method, args, kwargs):
+        call = self.local.call = Call(kind)
+        start = default_timer()
+        try:
+            result = method(self.validator, *args, **kwargs)
+        except RestdocError as e:
+            self._done(call, start, e)
+            raise
+        self._done(call, start, None)
+        return result
+
+    def _done(self, call, start, error):
+        self.local.call = None
+        phases = call.phases
+        phases['headers'] = max(0.0, default_timer() - start - phases['routing'] - phases['body']
+                                - phases['schemas'])
+        self.stats.record(call, error)
+        if self.callback is not None:
+            self.callback(call.kind, call.resource_name, phases, error)
+
+    def validateRequest(self, *args, **kwargs):
+        return self._validate('request', type(self.validator).validateRequest, args, kwargs)
+
+    def validateResponse(self, *args, **kwargs):
+        return self._validate('response', type(self.validator).validateResponse, args, kwargs)
+
+    def _findMethodPlan(self, method, path, resource_name):
+        validator = self.validator
+        call = getattr(self.local, 'call', None)
+        start = default_timer()
+        try:
+            resource, uri_params, plan = type(validator)._findMethodPlan(validator, method, path, resource_name)
+        finally:
+            if call is not None:
+                call.phases['routing'] += default_timer() - start
+        if call is not None:
+            call.resource_name = validator._getResourceName(resource)
+        return resource, uri_params, plan
+
+    def _readBody(self, body):
+        call = getattr(self.local, 'call', None)
+        start = default_timer()
+        try:
+            return type(self.validator)._readBody(self.validator, body)
+        finally:
+            if call is not None:
+                call.phases['body'] += default_timer() - start
+
+    def _matchSchema(self, selector, body, lazy_schema_matching):
+        # The loop of RestdocValidator._matchSchema, noting each attempt.
+        call = getattr(self.local, 'call', None)
+        if call is None:
+            return type(self.validator)._matchSchema(self.validator, selector, body, lazy_schema_matching)
+        start = default_timer()
+        attempts = 0
+        matching_spec = None
+        try:
+            for choice in selector.select(body):
+                attempts += 1
+                matched = self.validator._validate_schema(choice, body, None, lazy_schema_matching)
+                call.schemas.append((choice.spec.get('schema'), matched))
+                if matched:
+                    matching_spec = choice.spec
+                    call.matches.append(attempts)
+                    break
+        finally:
+            call.phases['schemas'] += default_timer() - start
+        return matching_spec
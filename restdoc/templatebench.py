@@ -0,0 +1,171 @@
+'''
+The URI template corpus, as conformance tests and as a benchmark.
+
+The corpus is a set of JSON files in the format of the uritemplate-test
+suites: groups of test cases, each with the variables it expands and a
+list of ``[template, expected]`` pairs, where expected is the expansion,
+a list of the expansions allowed, or false if the template is invalid.
+The files of restdoc/tests/uritemplate are written from the examples of
+RFC 6570; other suites in that format can be given on the command line.
+
+Run as a benchmark, every case that expands as expected is timed, and
+expansions per second are reported by operator and by the shape of the
+values expanded::
+
+  python -m restdoc.templatebench
+  python -m restdoc.templatebench --output templates.json
+'''
+import glob
+import json
+import os
+import sys
+from collections import defaultdict
+from timeit import default_timer
+
+from .uritemplate import expand_template, compile_template, URITemplateError
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests', 'uritemplate')
+
+def load_corpus(paths=None):
+    '''
+    Return the test cases of the corpus files ``paths``, by default those
+    of CORPUS_DIR, as ``(name, template, variables, expected)`` tuples,
+    with expected a list of the expansions allowed, or False.
+    '''
+    if paths is None:
+        paths = sorted(glob.glob(os.path.join(CORPUS_DIR, '*.json')))
+    cases = []
+    for path in paths:
+        with open(path) as f:
+            groups = json.load(f)
+        for group_name in sorted(groups):
+            group = groups[group_name]
+            name = '%s: %s' % (os.path.basename(path), group_name)
+            for template, expected in group['testcases']:
+                if isinstance(expected, basestring):
+                    expected = [expected]
+                cases.append((name, template, group['variables'], expected))
+    return cases
+
+def check_case(template, variables, expected):
+    '''
+    Expand ``template`` and return None if the result is one of
+    ``expected``, or else what went wrong.  An invalid template, with
+    expected False, must raise URITemplateError.
+    '''
+    try:
+        expanded = expand_template(template, variables)
+    except URITemplateError as e:
+        if expected is False:
+            return None
+        return "raised URITemplateError: %s" % e
+    except Exception as e:
+        return "raised %s: %s" % (type(e).__name__, e)
+    if expected is False:
+        return "expanded an invalid template to %r" % expanded
+    if expanded not in expected:
+        return "expanded to %r" % expanded
+    return None
+
+def value_shape(value, explode):
+    if isinstance(value, dict):
+        shape = 'dict'
+    elif isinstance(value, list):
+        shape = 'list'
+    else:
+        return 'scalar'
+    if explode:
+        return 'exploded ' + shape
+    return shape
+
+def case_kind(template, variables):
+    '''
+    Return the expression class of ``template``, or 'mixed' if it has
+    expressions of several, and the shape of the values it expands:
+    'scalar', 'list', 'dict' or 'exploded list' or 'exploded dict', the
+    most complex found.
+    '''
+    shapes = ['scalar', 'list', 'dict', 'exploded list', 'exploded dict']
+    expr_types = set()
+    shape = 0
+    for expr_type, value in compile_template(template).parts:
+        if expr_type is None:
+            continue
+        expr_types.add(expr_type.__name__)
+        for name, explode, max_length in value:
+            if variables.get(name) is not None:
+                shape = max(shape, shapes.index(value_shape(variables[name], explode)))
+    if len(expr_types) == 1:
+        return expr_types.pop(), shapes[shape]
+    return 'mixed', shapes[shape]
+
+def run_corpus(cases):
+    '''
+    Return a list of ``(name, template, problem)`` for the cases that do
+    not expand as expected.
+    '''
+    failures = []
+    for name, template, variables, expected in cases:
+        problem = check_case(template, variables, expected)
+        if problem is not None:
+            failures.append((name, template, problem))
+    return failures
+
+def time_expansions(cases, min_time=0.2):
+    '''
+    Time the expansion of each valid case that expands as expected, and
+    return a dict of ``(expression class, value shape)`` to the number of
+    cases and expansions per second.
+    '''
+    kinds = defaultdict(list)
+    for name, template, variables, expected in cases:
+        if expected is not False and check_case(template, variables, expected) is None:
+            kinds[case_kind(template, variables)].append((template, variables))
+    results = {}
+    for kind, kind_cases in kinds.iteritems():
+        count = 0
+        start = default_timer()
+        while True:
+            for template, variables in kind_cases:
+                expand_template(template, variables)
+            count += len(kind_cases)
+            elapsed = default_timer() - start
+            if elapsed >= min_time:
+                break
+        results[kind] = (len(kind_cases), count / elapsed)
+    return results
+
+def print_results(failures, rates, out=sys.stdout):
+    from prettytable import PrettyTable
+    for name, template, problem in failures:
+        print >>out, "FAIL %s: %s %s" % (name, template, problem)
+    t = PrettyTable(('expression', 'values', 'cases', 'expansions/s'))
+    for (expr_type, shape), (cases, rate) in sorted(rates.iteritems()):
+        t.add_row([expr_type, shape, cases, '%.0f' % rate])
+    print >>out, t
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m restdoc.templatebench',
+        description="Check and benchmark URI template expansion on a corpus of test cases.")
+    parser.add_argument('corpus', nargs='*',
+                        help="Corpus JSON files (default: those in %s)" % CORPUS_DIR)
+    parser.add_argument('--time', type=float, default=0.2,
+                        help="Seconds to spend timing each kind of case (default: 0.2)")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    cases = load_corpus(args.corpus or None)
+    failures = run_corpus(cases)
+    rates = time_expansions(cases, args.time)
+    print_results(failures, rates)
+    print "%d cases, %d failed" % (len(cases), len(failures))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'failures' : [list(failure) for failure in failures],
+                'expansions_per_s' : dict(('%s %s' % kind, rate) for kind, (count, rate) in rates.iteritems()),
+            }, f, indent=2, sort_keys=True)
+    return 0
+
+if __name__ == '__main__': sys.exit(main())
@@ -0,0 +1,54 @@
+from copy import deepcopy
+from unittest import TestCase
+
+from restdoc import bench, templatebench
+from restdoc.batch import validate_many
+from restdoc.validate import RestdocValidator
+
+
+class TestBench(TestCase):
+    def test_synthetic_restdoc(self):
+        restdoc = bench.synthetic_restdoc(resources=20, depth=4, params=2, validations=2, nesting=2, accepts=3)
+        self.assertEqual(restdoc, bench.synthetic_restdoc(resources=20, depth=4, params=2, validations=2,
+                                                          nesting=2, accepts=3))
+        self.assertEqual(len(restdoc['resources']), 20)
+        self.assertEqual(len(restdoc['schemas']), 60)
+        self.assertEqual(restdoc['resources'][0]['path'].count('/'), 6)
+        validator = RestdocValidator(restdoc)
+        requests, responses = bench.synthetic_traffic(restdoc, 50)
+        for result in validate_many(validator, requests + responses):
+            self.assertTrue(result.valid, result.error)
+
+    def test_run_scenario(self):
+        metrics = bench.run_scenario(dict(resources=5), traffic=200, builds=1)
+        self.assertEqual(sorted(metrics), sorted(metric for metric, higher_is_better in bench.METRICS))
+
+    def test_compare(self):
+        baseline = {'scenarios' : {
+            'a' : {'params' : {'resources' : 1}, 'metrics' : {'build_s' : 1.0, 'requests_per_s' : 100.0}},
+            'b' : {'params' : {'resources' : 2}, 'metrics' : {'build_s' : 1.0}},
+        }}
+        current = deepcopy(baseline)
+        current['scenarios']['a']['metrics'] = {'build_s' : 1.05, 'requests_per_s' : 50.0}
+        current['scenarios']['b']['params']['resources'] = 3
+        rows, regressions = bench.compare_results(baseline, current)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(regressions, [('a', 'requests_per_s', 100.0, 50.0, 0.5)])
+
+
+class TestTemplateBench(TestCase):
+    def test_case_kind(self):
+        variables = {'x' : '1', 'list' : ['a'], 'keys' : {'a' : 'b'}}
+        self.assertEqual(templatebench.case_kind('/a/{x}', variables), ('SimpleExpr', 'scalar'))
+        self.assertEqual(templatebench.case_kind('{?x,list}', variables), ('QueryExpr', 'list'))
+        self.assertEqual(templatebench.case_kind('{/keys*}', variables), ('PathSegmentExpr', 'exploded dict'))
+        self.assertEqual(templatebench.case_kind('{x}{+keys}', variables), ('mixed', 'dict'))
+
+    def test_time_expansions(self):
+        cases = templatebench.load_corpus()
+        rates = templatebench.time_expansions(cases, min_time=0.001)
+        self.assertTrue(('QueryExpr', 'exploded list') in rates)
+        # Only cases expanding as expected are timed.
+        passing = [case for case in cases
+                   if case[3] is not False and templatebench.check_case(*case[1:]) is None]
+        self.assertEqual(sum(count for count, rate in rates.itervalues()), len(passing))
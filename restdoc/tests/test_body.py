@@ -0,0 +1,72 @@
+import json
+from io import BytesIO
+from unittest import TestCase
+
+from restdoc.body import JSONScanner, BodyError, read_body
+
+
+class CountingReader(BytesIO):
+    def __init__(self, data):
+        BytesIO.__init__(self, data)
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return BytesIO.read(self, size)
+
+
+class TestJSONScanner(TestCase):
+    valid = [
+        '{}', '[]', '0', '-1.5e+3', 'true', ' null ', '"a\\"b\\u00e9"',
+        '{"a" : [1, 2, {"b" : null}], "c" : {"d" : "e"}}',
+        '[[[]], [{}], "x", -0, 1E9]',
+    ]
+    invalid = [
+        ('', None), ('{', None), ('[1,]', 3), ('{"a" 1}', 5), ('{1 : 2}', 1),
+        ('[1 2]', 3), ('tru', None), ('01', 1), ('{"a" : 1}}', 9), ('"\\x"', 0),
+        ('[-]', 1), ('{"a" : 1,}', 9), ('nul1', 0),
+    ]
+
+    def _scan(self, text, size):
+        scanner = JSONScanner()
+        for i in range(0, len(text), size):
+            scanner.feed(text[i:i + size])
+        scanner.feed('', final=True)
+
+    def test_valid(self):
+        for text in self.valid:
+            for size in range(1, len(text) + 1):
+                self._scan(text, size)
+
+    def test_invalid(self):
+        for text, offset in self.invalid:
+            for size in range(1, len(text) + 2):
+                try:
+                    self._scan(text, size)
+                except BodyError as e:
+                    if offset is not None:
+                        self.assertEqual(str(e), "Malformed JSON body at byte %d" % offset, text)
+                else:
+                    raise AssertionError("%r was accepted" % text)
+
+
+class TestReadBody(TestCase):
+    body = {"items" : [{"id" : i, "name" : "item %d" % i} for i in range(1000)]}
+
+    def test_read(self):
+        text = json.dumps(self.body)
+        self.assertEqual(read_body(text), self.body)
+        self.assertEqual(read_body(BytesIO(text), chunk_size=100, scan_size=1000), self.body)
+        self.assertEqual(read_body(BytesIO('  ')), '')
+        self.assertEqual(read_body(u'{"a" : "caf\xe9"}'), {"a" : u"caf\xe9"})
+        self.assertEqual(read_body(bytearray('{"a" : "caf\xc3\xa9"}')), {"a" : u"caf\xe9"})
+
+    def test_early_rejection(self):
+        text = json.dumps(self.body)
+        reader = CountingReader(text)
+        self.assertRaises(BodyError, read_body, reader, max_size=1000, chunk_size=100)
+        self.assertEqual(reader.reads, 11)
+
+        reader = CountingReader('{"items" : [1, 2,, 3' + text)
+        self.assertRaises(BodyError, read_body, reader, chunk_size=10, scan_size=10)
+        self.assertEqual(reader.reads, 2)
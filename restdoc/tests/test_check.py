@@ -0,0 +1,121 @@
+import json
+from io import BytesIO, BufferedReader
+from unittest import TestCase
+
+from restdoc.check import iter_har_entries, check_log
+from restdoc.validate import RestdocValidator
+
+
+class TestCheck(TestCase):
+    spec = {
+        "schemas" : {
+            "agent" : {
+                "type" : "inline",
+                "schema" : {
+                    "type" : "object",
+                    "required" : ["name"],
+                    "properties" : {
+                        "name" : { "type" : "string" },
+                    }
+                }
+            },
+        },
+        "resources" : [{
+            "id" : "agent",
+            "path" : "/agents/{agent_id}",
+            "methods" : {
+                "GET" : {
+                    "statusCodes" : {
+                        "200" : {
+                            "response" : {
+                                "types" : [{ "schema" : "agent" }],
+                            }
+                        }
+                    }
+                }
+            }
+        }]
+    }
+
+    def _har_entry(self, path, status, body):
+        return {
+            "request" : {
+                "method" : "GET",
+                "url" : "http://localhost" + path,
+                "headers" : [{ "name" : "Accept", "value" : "application/json" }],
+            },
+            "response" : {
+                "status" : status,
+                "headers" : [],
+                "content" : { "mimeType" : "application/json", "text" : json.dumps(body) },
+            },
+        }
+
+    def _har(self):
+        entries = [
+            self._har_entry('/agents/1', 200, { "name" : "a \\\"quoted\\\" {name}" }),
+            self._har_entry('/agents/2', 200, { "nom" : "b" }),
+            self._har_entry('/agents/3', 404, {}),
+            self._har_entry('/unknown', 200, {}),
+        ]
+        har = {
+            "log" : {
+                "version" : "1.2",
+                "creator" : { "name" : "entries", "comment" : "[{\"entries\": []}]" },
+                "pages" : [{ "title" : "entries" }],
+                "entries" : entries,
+            }
+        }
+        return json.dumps(har, indent=2), entries
+
+    def test_iter_har_entries(self):
+        text, entries = self._har()
+        for read_size in (1, 7, 64, 1 << 20):
+            found = [json.loads(entry) for entry in iter_har_entries(BytesIO(text), read_size)]
+            self.assertEqual(found, entries)
+
+    def _check(self, text, workers, exchanges=4, diagnose=False):
+        validator = RestdocValidator(self.spec)
+        progress = []
+        summary = check_log(validator, BufferedReader(BytesIO(text)), workers=workers, chunk_size=2,
+                            progress=lambda summary: progress.append(summary.exchanges),
+                            diagnose=diagnose)
+        self.assertEqual(summary.exchanges, exchanges)
+        # Progress is reported after each chunk, with or without workers.
+        self.assertEqual(progress, [min(n, exchanges) for n in range(2, exchanges + 2, 2)])
+        self.assertEqual(summary.checked, {
+            ('agent', 'GET', None) : 3,
+            ('agent', 'GET', 200) : 2,
+            ('agent', 'GET', 404) : 1,
+            (None, 'GET', None) : 1,
+            (None, 'GET', 200) : 1,
+        })
+        self.assertEqual(summary.failed, {
+            ('agent', 'GET', 200) : 1,
+            ('agent', 'GET', 404) : 1,
+            (None, 'GET', None) : 1,
+            (None, 'GET', 200) : 1,
+        })
+        self.assertEqual(summary.samples[('agent', 'GET', 200)][0][1], '{"nom": "b"}')
+        return summary
+
+    def test_check_har(self):
+        text, entries = self._har()
+        summary = self._check(text, 1)
+        self.assertFalse('Errors:' in summary.samples[('agent', 'GET', 200)][0][0])
+        summary = self._check(text, 2, diagnose=True)
+        self.assertTrue('Errors:' in summary.samples[('agent', 'GET', 200)][0][0])
+
+    def test_check_jsonl(self):
+        lines = []
+        text, entries = self._har()
+        for entry in entries:
+            lines.append(json.dumps({
+                "method" : "GET",
+                "url" : entry["request"]["url"],
+                "status" : entry["response"]["status"],
+                "response" : { "text" : entry["response"]["content"]["text"] },
+            }))
+        lines.insert(2, "not json")
+        summary = self._check('\n'.join(lines) + '\n', 2, exchanges=5)
+        self.assertEqual(summary.unreadable, 1)
@@ -0,0 +1,176 @@
+import imp
+from copy import deepcopy
+from unittest import TestCase
+
+from restdoc.codegen import generate_module
+from restdoc.validate import RestdocValidator, RestdocError
+from restdoc.tests import test_validate
+
+# Paths, headers and bodies valid for test_validate.TestValidate.spec.
+VALID_RESOURCE1_PATH = "/resource1/4f71b22f-e7ea-4afe-b822-a83bce4c248f"
+VALID_RESOURCE2_PATH = "/resource1/4f71b22f-e7ea-4afe-b822-a83bce4c248f/34f7bc1c-8240-42ff-8d36-442da6d3531b"
+VALID_RESPONSE_HEADERS = {
+    'ETag' : '1',
+    'Vary' : 'Accept',
+    'Content-Type' : 'application/json',
+    'Cache-Control' : 'no-cache',
+}
+VALID_OBJECT_1 = {
+    'prop1' : 0,
+    'prop2' : 'test',
+}
+VALID_OBJECT_2 = {
+    'prop4' : 1,
+}
+VALID_OBJECT_PATTERN = {
+    '0cc311ce-9ca7-44ef-9ec8-f19b445387a5' : {
+        'prop1' : 1,
+        'prop2' : 'test2',
+    }
+}
+VALID_OBJECT_REF = {
+    'prop5' : {'prop1' : 0, 'prop2' : 'test'},
+    'prop6' : {'prop4' : 1},
+    'prop7' : True,
+}
+
+
+def load_module(source):
+    module = imp.new_module('generated_restdoc')
+    exec compile(source, '<generated>', 'exec') in module.__dict__
+    return module
+
+def outcome(func, *args, **kwargs):
+    try:
+        return 'valid', func(*args, **kwargs)
+    except ValueError as e:
+        if type(e).__name__ == 'RestdocBodyError':
+            return 'RestdocBodyError', e.summary
+        return type(e).__name__, str(e)
+
+SAMPLES = [None, True, 0, 1, -2, 52, 1.5, '', 'x', 'abcdefg', u'\xe9', [], [1], {}, {'prop4' : 1}]
+
+def mutations(value, depth=2):
+    '''
+    Yield ``value`` along with copies of it with one member dropped,
+    replaced or added.
+    '''
+    yield value
+    if not isinstance(value, dict) or depth == 0:
+        return
+    for key in sorted(value):
+        changed = dict(value)
+        del changed[key]
+        yield changed
+        for sample in SAMPLES:
+            changed = dict(value)
+            changed[key] = sample
+            yield changed
+        for mutation in list(mutations(value[key], depth - 1))[1:]:
+            changed = dict(value)
+            changed[key] = mutation
+            yield changed
+    for key in ('prop1', 'prop4', 'unknown', '0cc311ce-9ca7-44ef-9ec8-f19b445387a5'):
+        if key not in value:
+            changed = dict(value)
+            changed[key] = 1
+            yield changed
+
+def shape_schema(kind_spec, prop):
+    return {
+        "type" : "inline",
+        "schema" : {
+            "type" : "object",
+            "required" : ["kind", prop],
+            "properties" : {"kind" : kind_spec, prop : {"type" : "integer"}},
+        }
+    }
+
+
+class TestCodegen(TestCase):
+    def setUp(self):
+        self.validator = RestdocValidator(test_validate.TestValidate.spec)
+        self.module = load_module(generate_module(test_validate.TestValidate.spec))
+
+    def _bodies(self):
+        seeds = [VALID_OBJECT_1, VALID_OBJECT_2, VALID_OBJECT_PATTERN, VALID_OBJECT_REF,
+                 dict(VALID_OBJECT_1, **VALID_OBJECT_2),
+                 dict(VALID_OBJECT_2, prop8=deepcopy(VALID_OBJECT_1))]
+        bodies = list(SAMPLES)
+        for seed in seeds:
+            bodies.extend(mutations(seed))
+        return bodies
+
+    def _compare(self, name, *args, **kwargs):
+        expected = outcome(getattr(self.validator, name), *args, **kwargs)
+        actual = outcome(getattr(self.module, name), *args, **kwargs)
+        self.assertEqual(actual, expected, "%s%r %r" % (name, args, kwargs))
+        return expected
+
+    def test_requests(self):
+        paths = [VALID_RESOURCE1_PATH, VALID_RESOURCE2_PATH, '/resource1/alt1?param2=12',
+                 '/resource1/alt1?param2=x', '/resource1', '/resource1/', '/other', '']
+        for path in paths:
+            for method in ('GET', 'POST', 'PUT'):
+                self._compare('validateRequest', method, path)
+                self._compare('validateRequest', method, None, resource_name='resource2')
+        for body in self._bodies():
+            self._compare('validateRequest', 'POST', VALID_RESOURCE1_PATH, body)
+            self._compare('validateRequest', 'POST', VALID_RESOURCE1_PATH, body,
+                          lazy_schema_matching=True)
+
+    def test_responses(self):
+        headers = VALID_RESPONSE_HEADERS
+        bodies = self._bodies()
+        results = set()
+        for method, path in (('GET', VALID_RESOURCE1_PATH), ('POST', VALID_RESOURCE1_PATH),
+                             ('GET', VALID_RESOURCE2_PATH)):
+            for status in (200, '200', 201, 304, 400, 404, 409, 412, 500, 999):
+                self._compare('validateResponse', method, path, status, VALID_OBJECT_1, {})
+                for body in bodies:
+                    result = self._compare('validateResponse', method, path, status, body, headers)
+                    results.add(result[0])
+        # Valid and invalid bodies were tried.
+        self.assertEqual(results, set(['valid', 'RestdocError', 'RestdocBodyError']))
+
+    def test_discriminator(self):
+        kinds = [None, '', 'circle', 'square', 'hexagon', 1, ['circle']]
+        bodies = [[], {"kind" : "circle"}]
+        for kind in kinds:
+            for prop in ("radius", "side", "unknown"):
+                bodies.append({"kind" : kind, prop : 1})
+        for kind_spec in ({"enum" : ["circle"]}, {"type" : "string", "enum" : ["circle"]},
+                          {"enum" : ["circle"], "blank" : True}):
+            schemas = {
+                "a_circle" : shape_schema(kind_spec, "radius"),
+                "b_square" : shape_schema({"enum" : ["square"]}, "side"),
+            }
+            spec = {"schemas" : schemas,
+                    "resources" : [{"path" : "/shapes", "methods" : {"POST" : {
+                        "accepts" : [{"schema" : "a_circle"}, {"schema" : "b_square"}]}}}]}
+            validator = RestdocValidator(spec)
+            module = load_module(generate_module(spec))
+            for body in bodies:
+                self.assertEqual(outcome(module.validateRequest, 'POST', '/shapes', body),
+                                 outcome(validator.validateRequest, 'POST', '/shapes', body),
+                                 "%r %r" % (kind_spec, body))
+
+    def test_routing(self):
+        validator = RestdocValidator(test_validate.TestFindResource.spec)
+        module = load_module(generate_module(test_validate.TestFindResource.spec))
+        for path in ('/agents', '/agents/42', '/agents/x', '/agents/files/a', '/agents/42/groups?limit=5',
+                     '/agents/files/groups', '/regions/eu', '/regions/EU', '/v1.0/regions', '/v1x0/regions',
+                     '/v2', '/', '', '/agents/\n', '/nothing/here'):
+            self.assertEqual(outcome(module.findResource, path), outcome(validator.findResource, path))
+        self.assertEqual(module.findResourceByName('region')['path'], '/regions/{region}')
+        self.assertRaises(module.RestdocError, module.findResourceByName, 'unknown')
+
+    def test_standalone(self):
+        source = generate_module(test_validate.TestValidate.spec)
+        self.assertFalse('validictory' in source)
+        self.assertFalse('restdoc.' in source.replace('restdoc.codegen', ''))
+
+    def test_unsupported(self):
+        spec = {"schemas" : {"date" : {"type" : "inline", "schema" : {"type" : "string", "format" : "date"}}},
+                "resources" : [{"path" : "/", "methods" : {"PUT" : {"accepts" : [{"schema" : "date"}]}}}]}
+        self.assertRaises(RestdocError, generate_module, spec)
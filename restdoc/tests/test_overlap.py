@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import re
+from unittest import TestCase
+
+from restdoc.overlap import regex_overlap, overlapping_regexes
+
+
+class TestOverlap(TestCase):
+    def _overlap(self, pattern1, pattern2):
+        return regex_overlap(re.compile(pattern1), re.compile(pattern2))
+
+    def test_disjoint(self):
+        self.assertEqual(self._overlap('^/a$', '^/ab$'), (False, None))
+        self.assertEqual(self._overlap('^[a-c]{2}$', '^[c-z]{3}$'), (False, None))
+        self.assertEqual(self._overlap(r'\d+$', '[^0-9]$'), (False, None))
+        self.assertEqual(self._overlap('^/x/(?P<id>[0-9]+)$', '^/x/(?:list|all)$'), (False, None))
+
+    def test_overlapping(self):
+        self.assertEqual(self._overlap('^[a-c]{2,3}$', '^[c-z]{3}$'), (True, 'ccc'))
+        self.assertEqual(self._overlap('^x(?:ab|cd)*$', '^x(?:abc)+d$'), (True, 'xabcd'))
+        self.assertEqual(self._overlap(u'^é$', u'^[^a]$'), (True, u'é'))
+        # Regexes match prefixes of the strings they are tried on.
+        self.assertEqual(self._overlap('^/a', '^/ab$'), (True, '/ab'))
+
+    def test_end(self):
+        # '$' also matches before a final newline.
+        self.assertEqual(self._overlap('^/a[^/]+$', '^/a$'), (True, '/a\n'))
+        self.assertEqual(self._overlap('^/a[^/\n]+$', '^/a$'), (False, None))
+        self.assertEqual(self._overlap('^ab$', '^a$b'), (False, None))
+
+    def test_conditional(self):
+        # Either branch may be taken.
+        self.assertEqual(self._overlap('^(a)?(?(1)b|c)$', '^c$'), (True, 'c'))
+        self.assertEqual(self._overlap('^(a)?(?(1)b|c)$', '^ab$'), (True, 'ab'))
+        # Whatever the groups matched, though no example is known then.
+        self.assertEqual(self._overlap('^(a)?(?(1)b|c)$', '^b$'), (True, None))
+        self.assertEqual(self._overlap('^(a)?(?(1)b)$', '^d$'), (False, None))
+
+    def test_unsupported(self):
+        # Backreferences and case-insensitive matching are taken to
+        # overlap with anything.
+        self.assertEqual(self._overlap(r'^(a)\1$', '^b$'), (True, None))
+        self.assertEqual(self._overlap('(?i)^A$', '^b$'), (True, None))
+
+    def test_many(self):
+        regexes = [re.compile(pattern) for pattern in
+                   ('^/[a-z]+/r1$', '^/[a-z]+/r2$', '^/acme/r[0-9]$', '^/b', r'^/acme/(.)\1$')]
+        pairs = {(0, 2) : '/acme/r1', (1, 2) : '/acme/r2', (0, 3) : '/b/r1', (1, 3) : '/b/r2'}
+        self.assertEqual(overlapping_regexes(regexes[:4]), pairs)
+        self.assertEqual(overlapping_regexes(regexes[:4], focus=0), {(0, 2) : '/acme/r1', (0, 3) : '/b/r1'})
+        # Regexes without automata overlap with the related ones.
+        self.assertEqual(overlapping_regexes(regexes, related=lambda i: [1, 2]),
+                         dict(pairs.items() + [((1, 4), None), ((2, 4), None)]))
+        self.assertEqual(len(overlapping_regexes(regexes)), 8)
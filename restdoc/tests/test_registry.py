@@ -0,0 +1,105 @@
+import cPickle as pickle
+import gc
+import json
+import re
+from unittest import TestCase
+
+from restdoc.registry import ValidatorRegistry
+from restdoc.validate import RestdocError
+from restdoc.tests import test_validate
+
+# Paths, headers and bodies valid for test_validate.TestValidate.spec.
+VALID_RESOURCE1_PATH = "/resource1/4f71b22f-e7ea-4afe-b822-a83bce4c248f"
+VALID_RESPONSE_HEADERS = {
+    'ETag' : '1',
+    'Vary' : 'Accept',
+    'Content-Type' : 'application/json',
+    'Cache-Control' : 'no-cache',
+}
+VALID_OBJECT_1 = {
+    'prop1' : 0,
+    'prop2' : 'test',
+}
+VALID_OBJECT_2 = {
+    'prop4' : 1,
+}
+
+
+class TestRegistry(TestCase):
+    def setUp(self):
+        self.registry = ValidatorRegistry(cache_size=10)
+        # Separate copies, as restdocs loaded from separate files would be.
+        self.first = self.registry.add('first', json.loads(json.dumps(test_validate.TestValidate.spec)))
+        self.second = self.registry.add('second', json.loads(json.dumps(test_validate.TestValidate.spec)))
+
+    def test_shared(self):
+        first, second = self.first, self.second
+        for route1, route2 in zip(first.router.routes(), second.router.routes()):
+            self.assertTrue(route1.regex is route2.regex)
+        schemas1, schemas2 = first.compiled_schemas, second.compiled_schemas
+        self.assertTrue(schemas1['inline_object_1'] is schemas2['inline_object_1'])
+        # Schemas with references depend on their restdoc.
+        self.assertFalse(schemas1['inline_object_ref'] is schemas2['inline_object_ref'])
+
+    def test_validate(self):
+        self.registry.validateRequest('first', 'POST', VALID_RESOURCE1_PATH, VALID_OBJECT_2)
+        self.registry.validateResponse('second', 'GET', VALID_RESOURCE1_PATH, 200,
+                                       VALID_OBJECT_1, VALID_RESPONSE_HEADERS)
+        self.assertRaises(RestdocError, self.registry.validateRequest, 'first', 'POST',
+                          VALID_RESOURCE1_PATH, {"prop4" : 0})
+        self.assertEqual(self.registry.findResource('second', VALID_RESOURCE1_PATH)[0]['id'],
+                         'resource1')
+
+    def test_keys(self):
+        self.assertEqual(sorted(self.registry.keys()), ['first', 'second'])
+        self.assertEqual(len(self.registry), 2)
+        self.assertTrue('first' in self.registry)
+        self.assertTrue(self.registry['first'] is self.first)
+        self.assertEqual(self.registry.get('third'), None)
+        self.assertRaises(RestdocError, self.registry.__getitem__, 'third')
+        self.assertRaises(RestdocError, self.registry.validateRequest, 'third', 'GET', '/')
+        self.assertRaises(RestdocError, self.registry.remove, 'third')
+
+    def test_replace_remove(self):
+        spec = json.loads(json.dumps(test_validate.TestValidate.spec))
+        spec['schemas']['inline_object_2']['schema']['properties']['prop4']['minimum'] = 2
+        replaced = self.registry.add('second', spec)
+        self.assertTrue(self.registry['second'] is replaced)
+        self.assertFalse(replaced.compiled_schemas['inline_object_2']
+                         is self.first.compiled_schemas['inline_object_2'])
+        self.assertTrue(replaced.compiled_schemas['inline_object_1']
+                        is self.first.compiled_schemas['inline_object_1'])
+        del replaced
+        self.registry.remove('first')
+        self.registry.remove('second')
+        self.assertEqual(len(self.registry), 0)
+
+    def test_released(self):
+        registry = ValidatorRegistry()
+        spec = json.loads(json.dumps(test_validate.TestValidate.spec))
+        # Paths no other test uses, as re module caches regexes by source.
+        for resource in spec['resources']:
+            resource['path'] = '/released' + resource['path']
+        registry.add('first', spec)
+        shared = registry.shared
+        self.assertEqual(len(shared.regexes), 2)
+        registry.remove('first')
+        # Nothing is kept once no validator uses it.
+        gc.collect()
+        re.purge()
+        self.assertEqual(len(shared.regexes), 0)
+        for format_validators, schemas in shared.schemas.itervalues():
+            self.assertEqual(len(schemas.schemas), 0)
+
+    def test_lazy(self):
+        registry = ValidatorRegistry(lazy=True)
+        first = registry.add('first', json.loads(json.dumps(test_validate.TestValidate.spec)))
+        second = registry.add('second', json.loads(json.dumps(test_validate.TestValidate.spec)))
+        first.warm()
+        second.warm()
+        self.assertTrue(first.compiled_schemas['inline_object_1'] is second.compiled_schemas['inline_object_1'])
+
+    def test_pickle(self):
+        copy = pickle.loads(pickle.dumps(self.first, pickle.HIGHEST_PROTOCOL))
+        copy.validateRequest('POST', VALID_RESOURCE1_PATH, VALID_OBJECT_2)
+        self.assertFalse(copy.compiled_schemas['inline_object_1'] is self.first.compiled_schemas['inline_object_1'])
@@ -0,0 +1,80 @@
+import gc
+from io import BytesIO
+from unittest import TestCase
+
+from restdoc.validate import RestdocValidator, RestdocError
+from restdoc.router import LazyRegex
+from restdoc.snapshot import save_snapshot, load_snapshot, freeze
+from restdoc.tests import test_validate
+
+# Paths, headers and bodies valid for test_validate.TestValidate.spec.
+VALID_RESOURCE1_PATH = "/resource1/4f71b22f-e7ea-4afe-b822-a83bce4c248f"
+VALID_RESPONSE_HEADERS = {
+    'ETag' : '1',
+    'Vary' : 'Accept',
+    'Content-Type' : 'application/json',
+    'Cache-Control' : 'no-cache',
+}
+VALID_OBJECT_1 = {
+    'prop1' : 0,
+    'prop2' : 'test',
+}
+VALID_OBJECT_2 = {
+    'prop4' : 1,
+}
+
+
+class TestSnapshot(TestCase):
+    def _roundtrip(self, validator):
+        stream = BytesIO()
+        save_snapshot(validator, stream)
+        stream.seek(0)
+        return load_snapshot(stream)
+
+    def test_validate(self):
+        validator = self._roundtrip(RestdocValidator(test_validate.TestValidate.spec))
+        path = VALID_RESOURCE1_PATH
+        validator.validateResponse('GET', path, 200, VALID_OBJECT_1, VALID_RESPONSE_HEADERS)
+        self.assertRaises(RestdocError, validator.validateResponse, 'GET', path, 200,
+                          {"prop1" : "1"}, VALID_RESPONSE_HEADERS)
+        # Plans are found by the identity of the loaded resources.
+        for resource in validator.resources:
+            self.assertTrue(id(resource) in validator.resource_plans)
+        # Compiled schemas shared by plans stay shared.
+        for plans in validator.resource_plans.itervalues():
+            for plan in plans.itervalues():
+                for choice in plan.accepts and plan.accepts.choices or ():
+                    self.assertTrue(choice.schema is validator.compiled_schemas[choice.spec['schema']])
+
+    def test_routing_and_updates(self):
+        validator = self._roundtrip(RestdocValidator(test_validate.TestFindResource.spec, cache_size=10))
+        # Path regexes are only compiled once they are used.
+        self.assertTrue(all(isinstance(regex, LazyRegex) for regex in validator.resource_patterns))
+        self.assertEqual(len(validator.resource_patterns), len(validator.resources))
+        self.assertEqual(validator.findResource('/agents/42')[0]['id'], 'agent')
+        self.assertEqual(len(validator.path_cache), 1)
+        # Overlapping resources are found by the identity of the loaded ones.
+        self.assertEqual(sorted(resource['id'] for resource in validator.resources
+                                if id(resource) in validator.ambiguous), ['agent_file', 'agent_groups'])
+        self.assertRaises(RestdocError, validator.findResource, '/agents/files/groups')
+        validator.removeResource('agent')
+        self.assertEqual(validator.findResource('/agents/files/x')[0]['id'], 'agent_file')
+
+    def test_bad_snapshot(self):
+        self.assertRaises(RestdocError, load_snapshot, BytesIO('{"resources" : []}'))
+        self.assertRaises(RestdocError, save_snapshot,
+                          RestdocValidator(test_validate.TestFindResource.spec, format_validators={'x' : lambda v: v}),
+                          BytesIO())
+
+    def test_freeze(self):
+        validator = self._roundtrip(RestdocValidator(test_validate.TestValidate.spec))
+        freeze()
+        try:
+            if hasattr(gc, 'get_freeze_count'):
+                self.assertTrue(gc.get_freeze_count() > 0)
+            # Validators loaded before freezing keep working.
+            validator.validateRequest('POST', VALID_RESOURCE1_PATH, VALID_OBJECT_2)
+            self.assertRaises(RestdocError, validator.validateRequest, 'POST', VALID_RESOURCE1_PATH, {"prop4" : 0})
+        finally:
+            if hasattr(gc, 'unfreeze'):
+                gc.unfreeze()
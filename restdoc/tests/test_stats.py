@@ -0,0 +1,88 @@
+import cPickle as pickle
+from unittest import TestCase
+
+from restdoc.stats import PHASES
+from restdoc.validate import RestdocValidator, RestdocError
+from restdoc.tests import test_validate
+
+# Paths, headers and bodies valid for test_validate.TestValidate.spec.
+VALID_RESOURCE1_PATH = "/resource1/4f71b22f-e7ea-4afe-b822-a83bce4c248f"
+VALID_RESPONSE_HEADERS = {
+    'ETag' : '1',
+    'Vary' : 'Accept',
+    'Content-Type' : 'application/json',
+    'Cache-Control' : 'no-cache',
+}
+VALID_OBJECT_1 = {
+    'prop1' : 0,
+    'prop2' : 'test',
+}
+VALID_OBJECT_2 = {
+    'prop4' : 1,
+}
+
+
+class TestStats(TestCase):
+    def setUp(self):
+        self.validator = RestdocValidator(test_validate.TestValidate.spec, cache_size=10)
+
+    def _exercise(self):
+        self.validator.validateRequest('POST', VALID_RESOURCE1_PATH, VALID_OBJECT_2)
+        self.validator.validateRequest('POST', VALID_RESOURCE1_PATH, '{"prop4" : 1}', raw_body=True)
+        self.validator.validateResponse('GET', VALID_RESOURCE1_PATH, 200, VALID_OBJECT_1,
+                                        VALID_RESPONSE_HEADERS)
+        self.assertRaises(RestdocError, self.validator.validateRequest, 'POST', VALID_RESOURCE1_PATH, [])
+        self.assertRaises(RestdocError, self.validator.validateRequest, 'GET', '/unknown')
+
+    def test_disabled(self):
+        self.assertEqual(self.validator.statsSnapshot(), None)
+        # Nothing is shadowed on the hot path.
+        self.assertFalse('validateRequest' in self.validator.__dict__)
+        self._exercise()
+
+    def test_enabled(self):
+        calls = []
+        stats = self.validator.enableStats(lambda *args: calls.append(args))
+        self._exercise()
+        snapshot = self.validator.statsSnapshot()
+        self.assertEqual(snapshot['validations'], {'request' : 4, 'response' : 1})
+        self.assertEqual(snapshot['failures'], {'request' : 2, 'response' : 0})
+        self.assertEqual(snapshot['resources'], {'resource1' : 4})
+        self.assertEqual(snapshot['schemas'], {
+            'inline_object_1' : {'attempts' : 2, 'matches' : 1},
+            'inline_object_2' : {'attempts' : 3, 'matches' : 2},
+        })
+        # Schemas the body lacks required properties of are not tried.
+        self.assertEqual(snapshot['attempts'], {1 : 3})
+        self.assertEqual(snapshot['path_cache'], {'hits' : 3, 'misses' : 2, 'size' : 1})
+        self.assertEqual(sorted(snapshot['seconds']), sorted(PHASES))
+        self.assertTrue(snapshot['seconds']['body'] > 0)
+
+        self.assertEqual(len(calls), 5)
+        kind, resource_name, phases, error = calls[-1]
+        self.assertEqual((kind, resource_name), ('request', None))
+        self.assertTrue(isinstance(error, RestdocError))
+        self.assertEqual(calls[2][:2], ('response', 'resource1'))
+
+        # The snapshot is a copy.
+        self._exercise()
+        self.assertEqual(snapshot['validations'], {'request' : 4, 'response' : 1})
+        stats.reset()
+        self.assertEqual(self.validator.statsSnapshot()['validations'], {'request' : 0, 'response' : 0})
+
+    def test_disable(self):
+        stats = self.validator.enableStats()
+        self._exercise()
+        self.validator.disableStats()
+        self.assertFalse('validateRequest' in self.validator.__dict__)
+        self._exercise()
+        self.assertTrue(self.validator.stats is stats)
+        self.assertEqual(stats.snapshot()['validations'], {'request' : 4, 'response' : 1})
+
+    def test_pickle(self):
+        self.validator.enableStats()
+        copy = pickle.loads(pickle.dumps(self.validator, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(copy.stats, None)
+        self.assertFalse('validateRequest' in copy.__dict__)
+        self.assertEqual(pickle.loads(pickle.dumps(self.validator.stats)).snapshot(),
+                         self.validator.stats.snapshot())
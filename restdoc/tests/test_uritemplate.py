@@ -1,6 +1,9 @@
+import re
 from unittest import TestCase
 
-from restdoc.uritemplate import expand_template
+from restdoc import uritemplate
+from restdoc.templatebench import load_corpus, run_corpus
+from restdoc.uritemplate import expand_template, expand_all, expand_regex, compile_template, URITemplate, URITemplateError, TemplateMatcher
 
 
 class TestExpandTemplate(TestCase):
@@ -230,3 +233,207 @@ class TestExpandTemplate(TestCase):
     def test_query_continuation(self):
         for source, expected in self.validations["query-continuation"].iteritems():
             self._test_expand(source, expected)
+
+
+class TestCorpus(TestCase):
+    '''
+    Test expansion against the corpus of restdoc/tests/uritemplate.
+    '''
+
+    # Cases known to fail: values must be strings, '~' is encoded and
+    # templates are not checked for invalid expressions.
+    known_failures = set([
+        '{number}', '{?lat,long}', '{word}', '{tilde}',
+        '/id*}', '{var:prefix}', '{hello:2*}', '{??hello}', '{!hello}', '{with space}',
+        '{=path}', '{$var}', '{keys:1}', '{var:0}', '{var:10000}',
+    ])
+
+    def test_corpus(self):
+        cases = load_corpus()
+        self.assertTrue(len(cases) > 200)
+        failures = run_corpus(cases)
+        unexpected = ['%s: %s %s' % failure for failure in failures if failure[1] not in self.known_failures]
+        self.assertEqual(unexpected, [])
+        # Known failures that pass now should be taken off the list.
+        self.assertEqual(set(template for name, template, problem in failures), self.known_failures)
+
+
+class TestURITemplate(TestCase):
+    def test_expand(self):
+        for validations in TestExpandTemplate.validations.itervalues():
+            for source, expected in validations.iteritems():
+                template = URITemplate(source)
+                # A template expands the same way every time.
+                self.assertEqual(template.expand(TestExpandTemplate.context), expected)
+                self.assertEqual(template.expand(TestExpandTemplate.context), expected)
+
+    def test_parts(self):
+        template = URITemplate('/a/{b}{?c*,d:3}#')
+        self.assertEqual(template.parts, [(None, '/a/'), (uritemplate.SimpleExpr, (('b', False, None),)),
+                                          (uritemplate.QueryExpr, (('c', True, None), ('d', False, 3))),
+                                          (None, '#')])
+        self.assertEqual(template.expand({'b' : 'x y', 'd' : 'abcd'}), '/a/x%20y?d=abc#')
+        self.assertRaises(URITemplateError, URITemplate, '/a/{b')
+
+    def test_cache(self):
+        template = compile_template('/cached/{x}')
+        self.assertTrue(compile_template('/cached/{x}') is template)
+        for i in range(uritemplate.TEMPLATE_CACHE_SIZE):
+            compile_template('/filler/%d' % i)
+        self.assertTrue(len(uritemplate._templates) <= uritemplate.TEMPLATE_CACHE_SIZE)
+        self.assertFalse(compile_template('/cached/{x}') is template)
+
+    def test_expand_all(self):
+        context = TestExpandTemplate.context
+        for validations in TestExpandTemplate.validations.itervalues():
+            for source, expected in validations.iteritems():
+                empty = expand_template(source, {})
+                self.assertEqual(list(expand_all(source, [context, {}, context])),
+                                 [expected, empty, expected])
+                columns = dict((name, [value, None, value]) for name, value in context.iteritems())
+                self.assertEqual(list(expand_all(source, columns)), [expected, empty, expected])
+
+    def test_expand_all_values(self):
+        template = URITemplate('/regions/{region}/objects{?fields,limit}')
+        contexts = [{'region' : region, 'fields' : 'id,name', 'limit' : limit}
+                    for region in ('us', 'eu west', u'us') for limit in ('10', None)]
+        self.assertEqual(list(template.expand_all(contexts)),
+                         [template.expand(context) for context in contexts])
+        self.assertEqual(list(template.expand_all({'region' : ['a', 'b'], 'limit' : ['1', '2']})),
+                         ['/regions/a/objects?limit=1', '/regions/b/objects?limit=2'])
+        self.assertEqual(list(template.expand_all({})), [])
+        self.assertRaises(ValueError, template.expand_all, {'region' : ['a'], 'limit' : []})
+
+
+class TestEscape(TestCase):
+    def test_escape(self):
+        escape = uritemplate.SimpleExpr.escape
+        self.assertEqual(escape('a-b_c.d~e', None), 'a-b_c.d%7Ee')
+        self.assertEqual(escape('%41 /\xc3', None), '%2541%20%2F%C3')
+        self.assertEqual(escape('abcd', 2), 'ab')
+        value = 'nothing-to-escape'
+        self.assertTrue(escape(value, None) is value)
+
+    def test_escape_reserved(self):
+        escape = uritemplate.ReservedExpr.escape
+        self.assertEqual(escape("/a?b=c&d#e[f]@!$'()*+,;=", None), "/a?b=c&d#e[f]@!$'()*+,;=")
+        self.assertEqual(escape('%41%4g%%z %', None), '%41%254g%25%25z%20%25')
+        # Kept as they were before the table-driven encoder.
+        self.assertEqual(escape('%a %+a%-1', None), '%a%20%+a%-1')
+        value = '/already%20encoded'
+        self.assertTrue(escape(value, None) is value)
+
+
+class TestTemplateMatcher(TestCase):
+    def _test_match(self, source, uri, expected):
+        self.assertEqual(TemplateMatcher(source).match(uri), expected)
+
+    def test_match(self):
+        self._test_match('/regions/{region}/objects/{id}', '/regions/us%20east/objects/12',
+                         {'region' : 'us east', 'id' : '12'})
+        self._test_match('/regions/{region}/objects/{id}', '/regions/us/east/objects/12', None)
+        self._test_match('/regions/{region}/objects/{id}', '/regions/us/objects/12\n', None)
+        self._test_match('/objects/{id}', '/objects/', {})
+        self._test_match('{x,hello,y}', '1024,Hello%20World%21,768',
+                         {'x' : '1024', 'hello' : 'Hello World!', 'y' : '768'})
+        self._test_match('{+path:6}/here', '/foo/b/here', {'path' : '/foo/b'})
+        self._test_match('X{.empty}', 'X.', {'empty' : ''})
+        self._test_match('X{.undef}', 'X', {})
+
+    def test_match_lists(self):
+        expected = {'list' : ['red', 'green', 'blue', 'Hello World!']}
+        self._test_match('{list}', 'red,green,blue,Hello%20World%21', expected)
+        self._test_match('{/list*}', '/red/green/blue/Hello%20World%21', expected)
+        self._test_match('{;list*}', ';list=red;list=green;list=blue;list=Hello%20World%21', expected)
+        self._test_match('{?list}', '?list=red,green,blue,Hello%20World%21', expected)
+        # Reserved values may hold commas.
+        self._test_match('{+list}', 'red,green', {'list' : 'red,green'})
+        self._test_match('{/list*,path:4}', '/red/green/%2Ffoo',
+                         {'list' : ['red', 'green'], 'path' : '/foo'})
+
+    def test_match_pairs(self):
+        expected = {'keys' : {'comma' : ',', 'dot' : '.', 'empty' : '', 'semi' : ';'}}
+        self._test_match('{keys*}', 'comma=%2C,dot=.,empty,semi=%3B', expected)
+        self._test_match('{;keys*}', ';comma=%2C;dot=.;empty;semi=%3B', expected)
+        self._test_match('{?keys*}', '?comma=%2C&dot=.&empty=&semi=%3B', expected)
+        # A key named after the variable makes a pair like any other.
+        for uri in ('/l?c=p&z=1', '/l?z=1&c=p'):
+            self._test_match('/l{?c*}', uri, {'c' : {'c' : 'p', 'z' : '1'}})
+        self._test_match('{;c*}', ';c=p;z', {'c' : {'c' : 'p', 'z' : ''}})
+        self._test_match('{;c*}', ';c=p;c=q', {'c' : ['p', 'q']})
+        # Repeated keys fit neither a list nor a dict.
+        self._test_match('/l{?c*}', '/l?z=1&z=2', None)
+        self._test_match('{keys*}', 'a=1,a=2', None)
+
+    def test_match_names(self):
+        source = '/objects{?fields,limit}'
+        self._test_match(source, '/objects?limit=10&fields=id,name',
+                         {'fields' : ['id', 'name'], 'limit' : '10'})
+        self._test_match(source, '/objects', {})
+        self._test_match(source, '/objects?offset=10', None)
+        self._test_match('{;x,y,empty}', ';x=1024;y=768;empty', {'x' : '1024', 'y' : '768', 'empty' : ''})
+
+
+class TestExpandRegex(TestCase):
+    '''
+    Test the path regex expansion used by RestdocValidator.
+    '''
+
+    alternatives = ["^(a|b)$", "^[0-9]+$", "^x-[a-z]+$"]
+
+    def _params(self, count):
+        params = {}
+        for i in range(count):
+            params['p%d' % i] = {
+                'validations' : [{'type' : 'match', 'pattern' : p} for p in self.alternatives]
+            }
+        return params
+
+    def _template(self, count):
+        return ''.join(['/{p%d}' % i for i in range(count)])
+
+    def test_pattern_count_is_linear(self):
+        sizes = []
+        for count in (1, 2, 4, 8):
+            regexes = expand_regex(self._template(count), self._params(count))
+            self.assertEqual(len(regexes), 1)
+            sizes.append(len(regexes[0]))
+        # Each parameter adds the same amount of regex source.
+        per_param = sizes[1] - sizes[0]
+        self.assertEqual(sizes[2] - sizes[1], 2 * per_param)
+        self.assertEqual(sizes[3] - sizes[2], 4 * per_param)
+
+    def test_combinations(self):
+        regex = re.compile(expand_regex(self._template(3), self._params(3))[0])
+        for path in ['/a/1/x-y', '/x-abc/b/42', '/7/7/7', '/b/a/x-z']:
+            self.assertTrue(regex.match(path), path)
+        for path in ['/a/1/c', '/x-1/b/1', '/a/b', '/a/b/c/d']:
+            self.assertFalse(regex.match(path), path)
+
+    def test_repeated_param(self):
+        # Every value of a parameter must pass the same validation.
+        params = {
+            'a' : {'validations' : [{'type' : 'match', 'pattern' : '^1$'}, {'type' : 'match', 'pattern' : '^2$'}]},
+            'b' : {'validations' : [{'type' : 'match', 'pattern' : '^z$'}]},
+        }
+        for template, matching, other in [
+                ('/x/{a,b}', ['/x/1', '/x/2,z', '/x/1,1', '/x/2,2', '/x/z,2'], ['/x/1,2', '/x/2,1', '/x/z,1,2']),
+                ('/x{?a,b}', ['/x?a=1&a=1', '/x?a=2&b=z', '/x?b=z&a=2'], ['/x?a=1&a=2', '/x?a=2&a=1&b=z']),
+                ('/x/{a,b}/{a,b}', ['/x/1,1/2,z'], ['/x/1,2/z'])]:
+            regexes = expand_regex(template, params)
+            self.assertEqual(len(regexes), 1)
+            regex = re.compile(regexes[0])
+            for path in matching:
+                self.assertTrue(regex.match(path), path)
+            for path in other:
+                self.assertFalse(regex.match(path), path)
+        # Only the parameters are named groups.
+        self.assertEqual(sorted(re.compile(expand_regex('/x/{a,b}', params)[0]).groupindex), ['a_0', 'b_0'])
+
+    def test_literal_template(self):
+        # Templates without expressions expand to the literal path.
+        self.assertEqual(expand_regex('/agents', {}), ['^/agents$'])
+        self.assertEqual(expand_regex('', {}), ['^$'])
+        regex = re.compile(expand_regex('/v1.0/regions', {})[0])
+        self.assertTrue(regex.match('/v1.0/regions'))
+        self.assertFalse(regex.match('/v1.0/regions/1'))
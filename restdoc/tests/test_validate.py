@@ -1,7 +1,13 @@
 from unittest import TestCase
 from copy import deepcopy
+from io import BytesIO
+from threading import Thread
+import time
+import json
 
-from restdoc.validate import RestdocValidator, RestdocError
+import validictory
+
+from restdoc.validate import RestdocValidator, RestdocError, RestdocBodyError
 
 
 class TestValidate(TestCase):
@@ -673,4 +679,614 @@ class TestValidate(TestCase):
         body = self.VALID_OBJECT_1
         self._test_response('GET', self.path, 404, 'resource2', self.params, 'inline_object_1', body, self.headers)
 
+    def test_method_status_codes_are_not_shared(self):
+        status_codes = sorted(self.spec['statusCodes'].keys())
+        self.headers['Location'] = 'foo'
+        self._test_response('POST', self.path, 201, 'resource1', self.params, 'inline_object_ref',
+                            deepcopy(self.VALID_OBJECT_REF), self.headers)
+        self.assertEqual(sorted(self.spec['statusCodes'].keys()), status_codes)
+        self.assertRaises(RestdocError, self.validator.validateResponse,
+                          'GET', self.path, 201, deepcopy(self.VALID_OBJECT_REF), self.headers)
+
+    def test_status_code_types(self):
+        body = deepcopy(self.VALID_OBJECT_1)
+        self._test_response('GET', self.path, '200', 'resource1', self.params, 'inline_object_1', body, self.headers)
+        self._test_response('GET', self.path, 500, 'resource1', self.params, 'inline_object_2',
+                            deepcopy(self.VALID_OBJECT_2), self.headers)
+        self._test_response_fail('GET', self.path, 501, 'resource1', self.params, None, body, self.headers)
+
+    def _records(self):
+        headers = dict(self.VALID_RESPONSE_HEADERS)
+        for i in xrange(100):
+            yield {'method' : 'GET', 'path' : self.VALID_RESOURCE1_PATH}
+            yield {'method' : 'GET', 'path' : '/resource1'}
+            yield {'method' : 'GET', 'path' : self.VALID_RESOURCE1_PATH, 'status' : 200,
+                   'body' : self.VALID_OBJECT_1, 'headers' : headers}
+            yield {'method' : 'GET', 'path' : self.VALID_RESOURCE2_PATH, 'status' : 200,
+                   'body' : self.VALID_OBJECT_1, 'headers' : headers}
+
+    def _check(self, results):
+        results = list(results)
+        self.assertEqual(len(results), 400)
+        for i in xrange(0, 400, 4):
+            self.assertEqual(results[i].resource_name, 'resource1')
+            self.assertEqual(results[i].uri_params['resource_id'], [self.VALID_RESOURCE1_PATH.split('/')[-1]])
+            self.assertFalse(results[i + 1].valid)
+            self.assertEqual(results[i + 2].schema['schema'], 'inline_object_1')
+            self.assertTrue(results[i + 3].error.startswith("Method 'GET resource2' responded with invalid body."))
+
+    def test_validate_many(self):
+        self._check(self.validator.validateMany(self._records()))
+
+    def test_validate_many_workers(self):
+        self._check(self.validator.validateMany(self._records(), workers=2, chunk_size=16))
+
+    def test_validate_many_malformed(self):
+        records = [
+            {'path' : self.VALID_RESOURCE1_PATH},
+            {'method' : 'GET', 'path' : self.VALID_RESOURCE2_PATH, 'status' : 200,
+             'body' : self.VALID_OBJECT_1, 'headers' : self.VALID_RESPONSE_HEADERS},
+            {'method' : 'GET', 'path' : self.VALID_RESOURCE1_PATH},
+        ]
+        for workers in (1, 2):
+            missing, invalid, valid = self.validator.validateMany(records, workers=workers)
+            self.assertEqual(missing.error, "Invalid record: KeyError: 'method'")
+            self.assertEqual(missing.resource_name, None)
+            # Failed records name the resource they were routed to.
+            self.assertEqual(invalid.resource_name, 'resource2')
+            self.assertTrue(valid.valid)
+
+    def test_validate_many_diagnose(self):
+        record = {'method' : 'POST', 'path' : self.VALID_RESOURCE1_PATH, 'body' : []}
+        result, = self.validator.validateMany([record])
+        # The errors of each schema are only collected when asked for.
+        self.assertEqual(result.error, "Method 'POST resource1' does not accept given body.")
+        result, = self.validator.validateMany([record], diagnose=True)
+        self.assertTrue(result.error.startswith("Method 'POST resource1' does not accept given body.  Errors: ["))
+
+    def test_raw_body(self):
+        path = self.VALID_RESOURCE1_PATH
+        self.validator.validateResponse('GET', path, 200, json.dumps(self.VALID_OBJECT_1),
+                                        self.headers, raw_body=True)
+        self.validator.validateResponse('GET', path, 200, u'{"prop1" : 0, "prop2" : "caf\xe9"}',
+                                        self.headers, raw_body=True)
+        self.validator.validateResponse('GET', path, 200, BytesIO(json.dumps(self.VALID_OBJECT_2)), self.headers)
+        self.validator.validateResponse('GET', path, 304, BytesIO(''), self.headers)
+        self.assertRaises(RestdocError, self.validator.validateResponse,
+                          'GET', path, 200, BytesIO('{"prop4" : 1'), self.headers)
+        self.assertRaises(RestdocError, self.validator.validateResponse,
+                          'GET', path, 200, '"prop4"', self.headers, raw_body=True)
+        validator = RestdocValidator(self.spec, max_body_size=10)
+        self.assertRaises(RestdocError, validator.validateResponse,
+                          'GET', path, 200, BytesIO(json.dumps(self.VALID_OBJECT_1)), self.headers)
+
+
+class TestFindResource(TestCase):
+    spec = {
+        "resources" : [{
+                "id" : "agents",
+                "path" : "/agents",
+                "methods" : { "GET" : {} },
+            }, {
+                "id" : "agent",
+                "path" : "/agents/{agent_id}",
+                "params" : {
+                    "agent_id" : {
+                        "validations" : [{
+                            "type" : "match",
+                            "pattern" : "^[0-9]+$",
+                        }]
+                    }
+                },
+                "methods" : { "GET" : {} },
+            }, {
+                "id" : "agent_file",
+                "path" : "/agents/files/{file}",
+                "methods" : { "GET" : {} },
+            }, {
+                "id" : "agent_groups",
+                "path" : "/agents/{agent_id}/groups{?limit}",
+                "methods" : { "GET" : {} },
+            }, {
+                "id" : "region",
+                "path" : "/regions/{region}",
+                "params" : {
+                    "region" : {
+                        "validations" : [{
+                            "type" : "match",
+                            "pattern" : "^[a-z]+$",
+                        }]
+                    }
+                },
+                "methods" : { "GET" : {} },
+            }, {
+                "id" : "region_v1",
+                "path" : "/v1.0/regions",
+                "methods" : { "GET" : {} },
+            }, {
+                "id" : "root",
+                "path" : "{/version}",
+                "params" : {
+                    "version" : {
+                        "validations" : [{
+                            "type" : "match",
+                            "pattern" : "^v[0-9]+$",
+                        }]
+                    }
+                },
+                "methods" : { "GET" : {} },
+            }
+        ]
+    }
+
+    def setUp(self):
+        self.validator = RestdocValidator(self.spec)
+
+    def _find(self, path):
+        resource, uri_params = self.validator.findResource(path)
+        return resource['id'], uri_params
+
+    def test_literal_path(self):
+        self.assertEqual(self._find('/agents'), ('agents', {}))
+        self.assertEqual(self._find('/v1.0/regions'), ('region_v1', {}))
+        # Literal template characters are used as regex source.
+        self.assertEqual(self._find('/v1x0/regions'), ('region_v1', {}))
+
+    def test_variable_path(self):
+        self.assertEqual(self._find('/agents/42'), ('agent', {'agent_id' : ['42']}))
+        self.assertEqual(self._find('/agents/42/groups?limit=5'),
+                         ('agent_groups', {'agent_id' : ['42'], 'limit' : ['5']}))
+        self.assertEqual(self._find('/regions/eu'), ('region', {'region' : ['eu']}))
+        self.assertEqual(self._find('/v2'), ('root', {'version' : ['v2']}))
+
+    def test_no_match(self):
+        self.assertRaises(RestdocError, self._find, '/regions/EU')
+        self.assertRaises(RestdocError, self._find, '/unknown/path')
+
+    def test_ambiguous(self):
+        # Unvalidated expressions also match across '/'.
+        self.assertRaises(RestdocError, self._find, '/agents/files/groups')
+
+    def test_ambiguities(self):
+        self.assertEqual(self.validator.ambiguities(),
+                         [('agent_file', 'agent_groups', '/agents/files/groups')])
+        self.assertEqual(sorted(self.validator.ambiguous), sorted(id(resource) for resource in
+                         self.validator.resources if resource['id'] in ('agent_file', 'agent_groups')))
+        self.assertRaises(RestdocError, RestdocValidator, self.spec, allow_ambiguous=False)
+        self.assertRaises(RestdocError, RestdocValidator, self.spec, allow_ambiguous=False, lazy=True)
+
+    def test_first_match(self):
+        # Lookups matching a resource no other overlaps stop there.
+        groups = [route for route in self.validator.router.routes() if route.resource['id'] == 'agent_groups'][0]
+        groups.regex = None
+        self.assertEqual(self._find('/agents/42'), ('agent', {'agent_id' : ['42']}))
+
+    def test_ambiguous_updates(self):
+        spec = deepcopy(self.spec)
+        groups = spec['resources'].pop(3)
+        validator = RestdocValidator(spec, allow_ambiguous=False)
+        self.assertEqual(validator.ambiguities(), [])
+        self.assertRaises(RestdocError, validator.addResource, groups)
+        self.assertEqual(len(validator.resources), 6)
+
+        validator = RestdocValidator(spec)
+        validator.addResource(groups)
+        self.assertRaises(RestdocError, validator.findResource, '/agents/files/groups')
+        validator.replaceResource('agent_file', {"id" : "agent_file", "path" : "/files/{file}",
+                                                 "methods" : { "GET" : {} }})
+        self.assertEqual(validator.ambiguous, {})
+        self.assertEqual(validator.findResource('/agents/files/groups')[0]['id'], 'agent_groups')
+        validator.addResource({"id" : "agent_logs", "path" : "/agents/{agent_id}/groups/logs",
+                               "methods" : { "GET" : {} }})
+        self.assertEqual(validator.ambiguities(), [('agent_groups', 'agent_logs', '/agents//groupslimit/groups/logs')])
+        validator.removeResource('agent_logs')
+        self.assertEqual(validator.ambiguous, {})
+
+    def test_path_cache(self):
+        validator = RestdocValidator(self.spec, cache_size=2)
+        cache = validator.path_cache
+
+        resource, uri_params = validator.findResource('/agents/42')
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        uri_params['agent_id'].append('corrupt')
+
+        resource, uri_params = validator.findResource('/agents/42')
+        self.assertEqual(resource['id'], 'agent')
+        self.assertEqual(uri_params, {'agent_id' : ['42']})
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # The least recently used path is evicted.
+        validator.findResource('/regions/eu')
+        validator.findResource('/agents/42')
+        validator.findResource('/v2')
+        self.assertEqual(len(cache), 2)
+        validator.findResource('/agents/42')
+        validator.findResource('/regions/eu')
+        self.assertEqual((cache.hits, cache.misses), (3, 4))
+
+        # Lookups that fail are not cached.
+        self.assertRaises(RestdocError, validator.findResource, '/unknown/path')
+        self.assertRaises(RestdocError, validator.findResource, '/unknown/path')
+        self.assertEqual(cache.misses, 6)
+
+
+def object_schema(prop):
+    return {"type" : "inline", "schema" : {
+        "type" : "object",
+        "required" : [prop],
+        "properties" : { prop : { "type" : "integer" } },
+    }}
+
+def updates_spec():
+    '''
+    Return a copy of TestFindResource.spec with schemas for the agents.
+    '''
+    spec = deepcopy(TestFindResource.spec)
+    spec['schemas'] = {
+        "a" : object_schema("a"),
+        "b" : object_schema("b"),
+        "wrap_a" : {"type" : "inline", "schema" : {
+            "type" : "object",
+            "required" : ["item"],
+            "properties" : { "item" : { "$ref" : "a" } },
+        }},
+    }
+    spec['resources'][0]['methods']['POST'] = {"accepts" : [{"schema" : "wrap_a"}]}
+    spec['resources'][1]['methods']['POST'] = {"accepts" : [{"schema" : "b"}]}
+    return spec
+
+
+class TestUpdates(TestCase):
+    def setUp(self):
+        self.spec = updates_spec()
+        self.validator = RestdocValidator(self.spec, cache_size=10)
+
+    def _find(self, path):
+        resource, uri_params = self.validator.findResource(path)
+        return resource['id']
+
+    def test_add_resource(self):
+        state = self.validator._state
+        self.validator.addResource({"id" : "agent_status", "path" : "/agents/{agent_id}/status",
+                                    "methods" : { "GET" : {} }})
+        self.assertEqual(self._find('/agents/42/status'), 'agent_status')
+        self.assertEqual(self._find('/agents/42'), 'agent')
+        self.assertEqual(self.validator.resources[-1]['id'], 'agent_status')
+        self.assertRaises(RestdocError, self.validator.addResource, {"id" : "agent",
+                          "path" : "/other", "methods" : {}})
+        # The previous state and the restdoc given are left as they were.
+        self.assertEqual([route.resource['id'] for route in
+                          state.router.root.children[''].children['agents'].routes],
+                         ['agents', 'agent', 'agent_groups'])
+        self.assertEqual(len(self.spec['resources']), 7)
+
+    def test_remove_resource(self):
+        self.assertEqual(self._find('/regions/eu'), 'region')
+        self.validator.removeResource('region')
+        self.assertRaises(RestdocError, self.validator.findResource, '/regions/eu')
+        self.assertRaises(RestdocError, self.validator.findResourceByName, 'region')
+        self.assertFalse('regions' in self.validator.router.root.children[''].children)
+        self.assertRaises(RestdocError, self.validator.removeResource, 'region')
+        self.assertEqual(len(self.validator.resource_plans), 6)
+        self.assertEqual(len(self.validator.resource_patterns), 6)
+
+    def test_replace_resource(self):
+        self.validator.replaceResource('agent_file', {"id" : "agent_file", "path" : "/agents/logs/{file}",
+                                                      "methods" : { "GET" : {} }})
+        self.assertEqual(self._find('/agents/logs/x'), 'agent_file')
+        self.assertRaises(RestdocError, self.validator.findResource, '/agents/files/x')
+        self.assertEqual([r['id'] for r in self.validator.resources],
+                         [r['id'] for r in self.spec['resources']])
+        self.assertRaises(RestdocError, self.validator.replaceResource, 'agent_file',
+                          {"id" : "agents", "path" : "/x", "methods" : {}})
+
+    def test_update_schemas(self):
+        plans = dict(self.validator.resource_plans)
+        compiled = self.validator.compiled_schemas
+        self.validator.validateRequest('POST', '/agents', {"item" : {"a" : 1}})
+        self.validator.validateRequest('POST', '/agents/1', {"b" : 1})
+
+        self.validator.updateSchemas({"a" : object_schema("c")})
+        self.assertRaises(RestdocError, self.validator.validateRequest, 'POST', '/agents', {"item" : {"a" : 1}})
+        self.validator.validateRequest('POST', '/agents', {"item" : {"c" : 1}})
+        self.validator.validateRequest('POST', '/agents/1', {"b" : 1})
+        # Only the schemas and plans depending on the change are rebuilt.
+        self.assertTrue(self.validator.compiled_schemas['b'] is compiled['b'])
+        self.assertFalse(self.validator.compiled_schemas['wrap_a'] is compiled['wrap_a'])
+        agents, agent = self.validator.resources[:2]
+        self.assertTrue(self.validator.resource_plans[id(agent)] is plans[id(agent)])
+        self.assertFalse(self.validator.resource_plans[id(agents)] is plans[id(agents)])
+
+        self.validator.updateSchemas({"b" : None})
+        self.assertFalse('b' in self.validator.schemas)
+        self.assertRaises(RestdocError, self.validator.validateRequest, 'POST', '/agents/1', {"b" : 1})
+        self.assertRaises(RestdocError, self.validator.updateSchemas, {"a" : {"type" : "inline",
+                          "schema" : {"$ref" : "wrap_a"}}, "wrap_a" : {"type" : "inline", "schema" : {"$ref" : "a"}}})
+        self.validator.validateRequest('POST', '/agents', {"item" : {"c" : 1}})
+
+
+class TestCompileSchemas(TestCase):
+    def _restdoc(self, schemas):
+        return {
+            "schemas" : dict((name, {"type" : "inline", "schema" : schema})
+                             for name, schema in schemas.iteritems()),
+            "resources" : [],
+        }
+
+    def test_refs_resolved(self):
+        validator = RestdocValidator(TestValidate.spec)
+        compiled = validator.compiled_schemas
+        schemas = TestValidate.spec['schemas']
+        self.assertTrue(compiled['inline_object_ref'].schema['properties']['prop5']
+                        is schemas['inline_object_1']['schema'])
+        self.assertTrue(compiled['inline_object_allof'].schema['allOf'][1]
+                        is schemas['inline_object_2']['schema'])
+        # Schemas without references are used as they are.
+        self.assertTrue(compiled['inline_object_1'].schema is schemas['inline_object_1']['schema'])
+        # References with sibling keys are left to the schema validator.
+        pattern = compiled['inline_object_pattern'].schema['patternProperties'].values()[0]
+        self.assertEqual(pattern['$ref'], 'inline_object_1')
+
+    def test_recursive_schema(self):
+        validator = RestdocValidator(self._restdoc({
+            "alias" : { "$ref" : "node" },
+            "node" : {
+                "type" : "object",
+                "properties" : {
+                    "children" : { "type" : "array", "items" : { "$ref" : "node" } },
+                },
+            },
+        }))
+        node = validator.compiled_schemas['node'].schema
+        self.assertEqual(node['properties']['children']['items'], { "$ref" : "node" })
+        self.assertTrue(validator.compiled_schemas['alias'].schema is node)
+
+    def test_reference_cycle(self):
+        self.assertRaises(RestdocError, RestdocValidator, self._restdoc({
+            "a" : { "$ref" : "b" },
+            "b" : { "$ref" : "c" },
+            "c" : { "$ref" : "a" },
+        }))
+        self.assertRaises(RestdocError, RestdocValidator, self._restdoc({
+            "a" : { "type" : "object", "properties" : { "b" : { "$ref" : "b" } } },
+            "b" : { "$ref" : "b" },
+        }))
+
+    def test_generated_checks(self):
+        validator = RestdocValidator(TestValidate.spec)
+        schema = validator.compiled_schemas['inline_object_1']
+        self.assertTrue(schema.check({"prop1" : 1, "prop2" : "ab"}))
+        self.assertFalse(schema.check({"prop1" : 1, "prop2" : "abcdefg"}))
+        # Bodies the check rejects are left to the validator, which says why.
+        self.assertRaises(ValueError, schema, {"prop1" : 1, "prop2" : "abcdefg"})
+        schema = validator.compiled_schemas['inline_object_ref']
+        body = {"prop5" : {"prop1" : 1, "prop2" : "ab"}, "prop6" : {"prop4" : 1}, "prop7" : True}
+        self.assertTrue(schema.check(body))
+        body['prop6'] = {"prop4" : 0}
+        self.assertFalse(schema.check(body))
+
+    def test_validator_checks(self):
+        restdoc = self._restdoc({
+            "date" : { "type" : "string", "format" : "date-time" },
+            "name" : { "type" : "string" },
+        })
+        validator = RestdocValidator(restdoc)
+        # No code is generated for keywords SchemaCodegen does not know.
+        self.assertTrue(validator.compiled_schemas['date'].check is None)
+        self.assertTrue(validator.compiled_schemas['name'].check is not None)
+        # Nor for validator classes that may check keywords differently.
+        validator = RestdocValidator(restdoc, validator_cls=CountingValidator)
+        self.assertTrue(validator.compiled_schemas['name'].check is None)
+        CountingValidator.calls = 0
+        validator.compiled_schemas['name']("a")
+        self.assertEqual(CountingValidator.calls, 1)
+
+
+class CountingValidator(validictory.SchemaValidator):
+    calls = 0
+
+    def validate(self, data, schema):
+        CountingValidator.calls += 1
+        return super(CountingValidator, self).validate(data, schema)
+
+
+class TestSchemaSelection(TestCase):
+    def _shape(self, kinds, prop):
+        return {
+            "type" : "inline",
+            "schema" : {
+                "type" : "object",
+                "required" : ["kind", prop],
+                "properties" : {
+                    "kind" : { "type" : "string", "enum" : kinds },
+                    prop : { "type" : "integer" },
+                },
+            }
+        }
 
+    def _restdoc(self, schemas):
+        return {
+            "schemas" : schemas,
+            "resources" : [{
+                "id" : "shapes",
+                "path" : "/shapes",
+                "methods" : {
+                    "POST" : {
+                        "accepts" : [{ "schema" : name } for name in sorted(schemas)],
+                    },
+                },
+            }],
+        }
+
+    def _validate(self, validator, body):
+        CountingValidator.calls = 0
+        resource, uri_params, schema = validator.validateRequest('POST', '/shapes', body=body)
+        return schema['schema'], CountingValidator.calls
+
+    def test_discriminator(self):
+        validator = RestdocValidator(self._restdoc({
+            "a_circle" : self._shape(["circle"], "radius"),
+            "b_square" : self._shape(["square"], "side"),
+            "c_rect" : self._shape(["rect", "rectangle"], "width"),
+        }), validator_cls=CountingValidator)
+        self.assertEqual(validator.resource_plans.values()[0]['POST'].accepts.discriminator, 'kind')
+
+        self.assertEqual(self._validate(validator, {"kind" : "circle", "radius" : 1}), ("a_circle", 1))
+        self.assertEqual(self._validate(validator, {"kind" : "rectangle", "width" : 1}), ("c_rect", 1))
+        # Rejected bodies report the errors of every schema once asked.
+        for body, attempts in [({"kind" : "square", "radius" : 1}, 1), ({"kind" : "hexagon"}, 0),
+                               ({"side" : 1}, 0), ([], 3)]:
+            try:
+                self._validate(validator, body)
+            except RestdocBodyError as e:
+                self.assertEqual(CountingValidator.calls, attempts)
+                self.assertEqual(len(e.errors), 3)
+                self.assertTrue(str(e).startswith("Method 'POST shapes' does not accept given body.  Errors: ["))
+                self.assertEqual(CountingValidator.calls, attempts + 3)
+            else:
+                raise AssertionError("%s was accepted" % body)
+
+    def test_discriminator_null_or_blank(self):
+        schemas = {
+            "a_circle" : self._shape(["circle"], "radius"),
+            "b_square" : self._shape(["square"], "side"),
+        }
+        for name in schemas:
+            del schemas[name]["schema"]["properties"]["kind"]["type"]
+        validator = RestdocValidator(self._restdoc(schemas), validator_cls=CountingValidator)
+        self.assertEqual(validator.resource_plans.values()[0]['POST'].accepts.discriminator, 'kind')
+        # The enum check lets null through, so the index cannot rule out any schema.
+        self.assertEqual(self._validate(validator, {"kind" : None, "side" : 1}), ("b_square", 1))
+
+        schemas["b_square"]["schema"]["properties"]["kind"]["blank"] = True
+        validator = RestdocValidator(self._restdoc(schemas), validator_cls=CountingValidator)
+        self.assertEqual(validator.resource_plans.values()[0]['POST'].accepts.discriminator, None)
+        self.assertEqual(self._validate(validator, {"kind" : "", "side" : 1}), ("b_square", 1))
+
+    def test_shared_discriminator_values(self):
+        validator = RestdocValidator(self._restdoc({
+            "a_circle" : self._shape(["circle", "round"], "radius"),
+            "b_round" : self._shape(["round"], "diameter"),
+            "c_square" : self._shape(["square"], "side"),
+        }), validator_cls=CountingValidator)
+        self.assertEqual(self._validate(validator, {"kind" : "round", "radius" : 1}), ("a_circle", 1))
+        self.assertEqual(self._validate(validator, {"kind" : "round", "diameter" : 1}), ("b_round", 2))
+
+    def test_required_properties(self):
+        schemas = {
+            "a_circle" : self._shape(["circle"], "radius"),
+            "b_round" : self._shape(["round"], "diameter"),
+            "c_square" : self._shape(["square"], "side"),
+        }
+        del schemas["a_circle"]["schema"]["properties"]["kind"]["enum"]
+        validator = RestdocValidator(self._restdoc(schemas), validator_cls=CountingValidator)
+        self.assertEqual(validator.resource_plans.values()[0]['POST'].accepts.discriminator, None)
+        self.assertEqual(self._validate(validator, {"kind" : "round", "diameter" : 1}), ("b_round", 1))
+        self.assertEqual(self._validate(validator, {"kind" : "square", "side" : 1}), ("c_square", 1))
+
+
+class TestLazyValidate(TestValidate):
+    def setUp(self):
+        super(TestLazyValidate, self).setUp()
+        self.validator = RestdocValidator(self.spec, lazy=True)
+
+
+class TestLazy(TestCase):
+    def setUp(self):
+        self.spec = updates_spec()
+        self.validator = RestdocValidator(self.spec, lazy=True)
+
+    def _compiled_regexes(self):
+        return [route.resource['id'] for route in self.validator.router.routes()
+                if getattr(route.regex, '_regex', None) is not None]
+
+    def test_compiled_on_use(self):
+        validator = self.validator
+        self.assertEqual(self._compiled_regexes(), [])
+        self.assertEqual(validator.resource_plans, {})
+        self.assertEqual(len(validator.compiled_schemas), 0)
+
+        validator.validateRequest('POST', '/agents', {"item" : {"a" : 1}})
+        # Only the routes tried and the schemas used are compiled.
+        self.assertTrue('agents' in self._compiled_regexes())
+        self.assertFalse('region' in self._compiled_regexes())
+        self.assertEqual(len(validator.resource_plans), 1)
+        self.assertEqual(sorted(validator.compiled_schemas), ['wrap_a'])
+        self.assertRaises(RestdocError, validator.validateRequest, 'POST', '/agents/1', {"a" : 1})
+        self.assertEqual(sorted(validator.compiled_schemas), ['b', 'wrap_a'])
+
+        validator.updateSchemas({"a" : object_schema("c")})
+        validator.validateRequest('POST', '/agents', {"item" : {"c" : 1}})
+        validator.validateRequest('POST', '/agents/1', {"b" : 1})
+
+    def test_compiled_once(self):
+        calls = []
+        methodPlans = self.validator._methodPlans
+        def counting(state, resource):
+            calls.append(resource['id'])
+            time.sleep(0.01)
+            return methodPlans(state, resource)
+        self.validator._methodPlans = counting
+        threads = [Thread(target=self.validator.validateRequest, args=('POST', '/agents', {"item" : {"a" : 1}}))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, ['agents'])
+
+    def test_warm(self):
+        self.validator.warm()
+        self.assertEqual(len(self._compiled_regexes()), 7)
+        self.assertEqual(len(self.validator.resource_plans), 7)
+        self.assertEqual(sorted(self.validator.compiled_schemas), ['a', 'b', 'wrap_a'])
+
+    def test_errors_on_use(self):
+        spec = deepcopy(self.spec)
+        spec['resources'][4]['params']['region']['validations'][0]['pattern'] = '('
+        spec['schemas']['b'] = {"type" : "inline", "schema" : {"$ref" : "b"}}
+        validator = RestdocValidator(spec, lazy=True)
+        validator.validateRequest('POST', '/agents', {"item" : {"a" : 1}})
+        self.assertRaises(RestdocError, validator.findResource, '/regions/eu')
+        self.assertRaises(RestdocError, validator.validateRequest, 'POST', '/agents/1', {"b" : 1})
+        self.assertRaises(RestdocError, validator.warm)
+        del spec['resources'][4]
+        validator = RestdocValidator(spec, lazy=True)
+        self.assertRaises(RestdocError, validator.warm)
+
+
+class TestCompactValidate(TestValidate):
+    def setUp(self):
+        super(TestCompactValidate, self).setUp()
+        self.validator = RestdocValidator(self.spec, keep_restdoc=False)
+
+
+class TestCompactUpdates(TestUpdates):
+    def setUp(self):
+        super(TestCompactUpdates, self).setUp()
+        self.validator = RestdocValidator(self.spec, cache_size=10, keep_restdoc=False)
+
+
+class TestCompact(TestCase):
+    def test_compact(self):
+        spec = json.loads(json.dumps(TestValidate.spec))
+        validator = RestdocValidator(spec, keep_restdoc=False)
+        self.assertEqual(validator.resources, [{'id' : 'resource1', 'path' : '/resource1/{resource_id}{?param1,param2}'},
+                {'id' : 'resource2', 'path' : '/resource1/{resource_id1}/{resource_id2}{?param1,param2}'}])
+        self.assertEqual(validator.schemas, spec['schemas'])
+        # Equal strings are stored once.
+        schemas = validator.schemas
+        self.assertTrue(schemas['inline_object_1']['schema']['type'] is schemas['inline_object_2']['schema']['type'])
+        self.assertFalse(spec['schemas']['inline_object_1']['schema']['type']
+                         is spec['schemas']['inline_object_2']['schema']['type'])
+        self.assertRaises(RestdocError, RestdocValidator, spec, keep_restdoc=False, lazy=True)
+
+    def test_shared_plans(self):
+        validator = RestdocValidator(TestValidate.spec)
+        plans = [validator.resource_plans[id(resource)] for resource in validator.resources]
+        get, post = plans[0]['GET'], plans[0]['POST']
+        # Restdoc wide status codes not overridden share a plan.
+        self.assertTrue(get.responses['400'] is post.responses['400'])
+        self.assertTrue(get.responses[500] is post.responses['500'])
+        self.assertFalse(get.responses['404'] is post.responses['404'])
+        self.assertTrue(get.responses['400'].required_headers is post.responses['400'].required_headers)
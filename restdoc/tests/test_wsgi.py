@@ -0,0 +1,152 @@
+import json
+from io import BytesIO
+from unittest import TestCase
+from wsgiref.util import setup_testing_defaults
+
+from restdoc.validate import RestdocValidator, RestdocBodyError
+from restdoc.wsgi import ValidationMiddleware
+
+
+class TestValidationMiddleware(TestCase):
+    spec = {
+        "schemas" : {
+            "agent" : {
+                "type" : "inline",
+                "schema" : {
+                    "type" : "object",
+                    "required" : ["name"],
+                    "properties" : {
+                        "name" : { "type" : "string" },
+                    }
+                }
+            },
+        },
+        "resources" : [{
+            "id" : "agent",
+            "path" : "/agents/{agent_id}",
+            "methods" : {
+                "PUT" : {
+                    "accepts" : [{ "schema" : "agent" }],
+                    "statusCodes" : {
+                        "200" : {
+                            "response" : {
+                                "types" : [{ "schema" : "agent" }],
+                                "headers" : { "ETag" : { "required" : True } },
+                            }
+                        }
+                    }
+                }
+            }
+        }]
+    }
+
+    def _app(self, environ, start_response):
+        body = environ['wsgi.input'].read(int(environ.get('CONTENT_LENGTH') or 0))
+        start_response('200 OK', [('Content-Type', 'application/json'), ('ETag', self.etag)])
+        return [body[:5], body[5:]]
+
+    def _call(self, middleware, path, body, **environ):
+        data = json.dumps(body)
+        environ = dict({
+            'REQUEST_METHOD' : 'PUT',
+            'PATH_INFO' : path,
+            'CONTENT_TYPE' : 'application/json',
+            'CONTENT_LENGTH' : str(len(data)),
+            'wsgi.input' : BytesIO(data),
+        }, **environ)
+        setup_testing_defaults(environ)
+        statuses = []
+        result = middleware(environ, lambda status, headers, exc_info=None: statuses.append(status))
+        try:
+            response = ''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return statuses[0], response
+
+    def _middleware(self, **kw):
+        self.failures = []
+        self.errors = []
+        self.etag = '1'
+        def on_failure(kind, method, path, error):
+            self.failures.append((kind, method))
+            self.errors.append(error)
+        return ValidationMiddleware(self._app, RestdocValidator(self.spec), on_failure=on_failure, **kw)
+
+    def _counts(self, middleware):
+        return middleware.validated, middleware.failed, middleware.dropped, middleware.skipped
+
+    def test_inline(self):
+        middleware = self._middleware(async_responses=False)
+        self.assertEqual(self._call(middleware, '/agents/1', {"name" : "a"}), ('200 OK', '{"name": "a"}'))
+        self.assertEqual(self._counts(middleware), (2, 0, 0, 0))
+        self.assertEqual(self._call(middleware, '/agents/1', {"nom" : "a"})[0], '200 OK')
+        self.assertEqual(self._counts(middleware), (4, 2, 0, 0))
+        self.assertEqual(self.failures, [('request', 'PUT'), ('response', 'PUT')])
+
+        self._call(middleware, '/unknown', {})
+        self.assertEqual(self._counts(middleware), (5, 3, 0, 0))
+
+    def test_async(self):
+        middleware = self._middleware()
+        for i in range(10):
+            self._call(middleware, '/agents/%d' % i, {"name" : "a"})
+        middleware.join()
+        self.assertEqual(self._counts(middleware), (20, 0, 0, 0))
+        middleware.close()
+
+    def test_forked(self):
+        middleware = self._middleware()
+        # Nothing is started until the first request.
+        self.assertEqual(middleware.thread, None)
+        self._call(middleware, '/agents/1', {"name" : "a"})
+        thread, queue = middleware.thread, middleware.queue
+        self.assertTrue(thread.is_alive())
+        # As seen from a process forked from this one.
+        middleware._pid = -1
+        self._call(middleware, '/agents/2', {"name" : "a"})
+        self.assertFalse(middleware.thread is thread)
+        self.assertFalse(middleware.queue is queue)
+        middleware.join()
+        queue.join()
+        self.assertEqual(self._counts(middleware), (4, 0, 0, 0))
+        middleware.close()
+        queue.put(None)
+        thread.join()
+
+    def test_dropped(self):
+        middleware = self._middleware(queue_size=1)
+        # Stop the worker so the queue fills up.
+        middleware.close()
+        for i in range(3):
+            self._call(middleware, '/agents/%d' % i, {"name" : "a"})
+        self.assertEqual(self._counts(middleware), (3, 0, 2, 0))
+
+    def test_sampling(self):
+        middleware = self._middleware(async_responses=False, sample_rates={"agent" : 0})
+        self._call(middleware, '/agents/1', {"nom" : "a"})
+        self.assertEqual(self._counts(middleware), (0, 0, 0, 1))
+
+    def test_reject_invalid(self):
+        middleware = self._middleware(async_responses=False, reject_invalid=True)
+        status, body = self._call(middleware, '/agents/1', {"nom" : "a"})
+        self.assertEqual(status, '400 Bad Request')
+        # Only the summary is sent back; the errors of each schema are
+        # left to on_failure.
+        self.assertEqual(body, "Method 'PUT agent' does not accept given body.")
+        self.assertTrue(isinstance(self.errors[0], RestdocBodyError))
+        self.assertEqual(len(self.errors[0].errors), 1)
+
+    def test_unread_body(self):
+        middleware = self._middleware(async_responses=False, reject_invalid=True, max_body_size=20)
+        # Chunked, so of unknown length.
+        status, body = self._call(middleware, '/agents/1', {"name" : "a"}, CONTENT_LENGTH='',
+                                  HTTP_TRANSFER_ENCODING='chunked')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(self._counts(middleware), (1, 1, 0, 1))
+        # Too large to be checked.
+        self._call(middleware, '/agents/1', {"name" : "a" * 20})
+        self.assertEqual(self._counts(middleware), (1, 1, 0, 2))
+        status, body = self._call(middleware, '/agents/1', {"name" : "a"})
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(self._counts(middleware), (3, 1, 0, 2))
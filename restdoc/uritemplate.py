@@ -1,15 +1,27 @@
-from urllib import quote
+from itertools import izip, repeat
+from operator import itemgetter
+from types import FunctionType
+from urllib import unquote
 import re
+import sre_parse
 op_table = {}
 
 DEBUG=False
 
+# The number of compiled templates kept by compile_template.
+TEMPLATE_CACHE_SIZE = 1024
+
+# The number of expansions of distinct values each expression keeps during
+# URITemplate.expand_all.
+EXPANSION_CACHE_SIZE = 4096
+
 ALPHA               =  "A-Za-z"
 DIGIT               =  "0-9"
 HEXDIG              =  "%sA-Fa-f" % DIGIT
 
 pct_encoded         =  "%%[%s]{2}" % HEXDIG
 unreserved          =  "%s%s-._~" % (ALPHA, DIGIT)
+unreserved_escaped  =  "%s%s\\-._~" % (ALPHA, DIGIT)
 gen_delims          =  ":/?#[]@"
 gen_delims_escaped  =  ":/?#\[\]@"
 sub_delims          =  "!$&'()*+,;="
@@ -25,6 +37,61 @@ reserved_escaped    =  "%s%s" % (gen_delims_escaped, sub_delims)
 #
 #iprivate       =  %xE000-F8FF / %xF0000-FFFFD / %x100000-10FFFD
 
+# The characters urllib.quote never encodes, as a regex character class.
+always_safe_escaped =  "%s%s_.\\-" % (ALPHA, DIGIT)
+
+def percent_encoder(safe, triplets=False):
+    '''
+    Return a function percent-encoding the bytes of a str but those in
+    ``safe``, the contents of a regex character class, as urllib.quote
+    does.  With ``triplets``, a '%' starting a pct-encoded triplet is left
+    as it is too.
+
+    Strings with nothing to encode are returned as they are, not copied.
+    '''
+    encoded = dict((chr(i), '%%%02X' % i) for i in range(256))
+    unsafe = re.compile('[^%s]' % safe)
+    # Each byte to its encoding, or to itself if it is safe.
+    table = dict((c, unsafe.match(c) and encoded[c] or c) for c in encoded)
+    search = unsafe.search
+    if triplets:
+        # Triplets used to be told by int(..., 16) accepting the two
+        # characters up to the next '%', so a hex digit followed by a
+        # character to encode, and a sign followed by a hex digit, count too.
+        unsafe = re.compile('%%(?![%s](?:[%s]|(?![%s]))|[+-][%s])|[^%s%%]'
+                            % (HEXDIG, HEXDIG, safe, HEXDIG, safe))
+        search = unsafe.search
+        sub = unsafe.sub
+
+        def encode_match(match):
+            return encoded[match.group()]
+
+    def encode(value):
+        if search(value) is None:
+            return value
+        if triplets and '%' in value:
+            return sub(encode_match, value)
+        return ''.join(map(table.__getitem__, value))
+    return encode
+
+encode_unreserved = percent_encoder(always_safe_escaped)
+encode_reserved = percent_encoder(always_safe_escaped + reserved_escaped, triplets=True)
+
+def percent_decode(value):
+    if '%' in value:
+        return unquote(value)
+    return value
+
+def decode_pairs(pairs):
+    '''
+    Return a dict of the percent-decoded ``(key, value)`` pairs.  Raises
+    ValueError if a key repeats, as no dict expands to the pairs.
+    '''
+    decoded = dict((percent_decode(key), percent_decode(value)) for key, value in pairs)
+    if len(decoded) < len(pairs):
+        raise ValueError("Repeated key")
+    return decoded
+
 def debug(mesg, params=None):
     if DEBUG:
         if params is not None:
@@ -33,36 +100,304 @@ def debug(mesg, params=None):
             print mesg
 
 def expand_template(source, context):
-    debug("expand_template: expanding: %s", source)
-    end = len(source)
-    ret = ""
-    i = 0
-    while i < end:
-        c = source[i]
-        if c == '{':
-            j = i
-            try:
-                while source[j] != '}':
-                    j += 1
-            except IndexError:
-                raise URITemplateError("Mismatched {}: %s" % source[i:])
-            ret += expand_expression(source[i + 1:j], context)
-            i = j
-        else:
-            ret += c
-        i += 1
-    return ret
+    if DEBUG:
+        debug("expand_template: expanding: %s", source)
+    return compile_template(source).expand(context)
+
+def expand_all(source, contexts):
+    '''
+    Return a generator of the expansions of the template ``source`` with
+    each of ``contexts``.  See :meth:`URITemplate.expand_all`.
+    '''
+    return compile_template(source).expand_all(contexts)
 
 def expand_expression(expr, context):
+    expr_type, expr = expression_type(expr)
+    if DEBUG:
+        debug("expand_expression: expr_type %s", expr_type)
+    return expr_type.expand(expr.split(','), context)
+
+def expression_type(expr):
+    '''
+    Return the expression class of the expression ``expr``, the text
+    between braces, and the rest of the expression after its operator.
+    '''
     if expr[0] in op_table:
-        expr_type = op_table[expr[0]]
-        expr = expr[1:]
-    else:
-        expr_type = SimpleExpr
+        return op_table[expr[0]], expr[1:]
+    return SimpleExpr, expr
 
-    debug("expand_expression: expr_type %s", expr_type)
-    
-    return expr_type.expand(expr.split(','), context)
+class URITemplate(object):
+    '''
+    A URI template parsed once, for expanding with any number of contexts.
+
+    ``parts`` holds ``(None, text)`` for literal text and ``(expression
+    class, variables)`` for each expression, with the variables as parsed
+    by :meth:`SimpleExpr.parse_names`.
+    '''
+
+    __slots__ = ('source', 'parts')
+
+    def __init__(self, source):
+        self.source = source
+        self.parts = []
+        end = len(source)
+        i = 0
+        while i < end:
+            j = source.find('{', i)
+            if j == -1:
+                j = end
+            if j > i:
+                self.parts.append((None, source[i:j]))
+            if j == end:
+                break
+            k = source.find('}', j)
+            if k == -1:
+                raise URITemplateError("Mismatched {}: %s" % source[j:])
+            expr_type, expr = expression_type(source[j + 1:k])
+            self.parts.append((expr_type, expr_type.parse_names(expr.split(','))))
+            i = k + 1
+
+    def __repr__(self):
+        return 'URITemplate(%r)' % (self.source,)
+
+    def expand(self, context):
+        expanded = []
+        for expr_type, value in self.parts:
+            if expr_type is None:
+                expanded.append(value)
+            else:
+                expanded.append(expr_type.expand_variables(value, context))
+        return ''.join(expanded)
+
+    def names(self):
+        '''
+        Return the names of the variables of the template, in order and
+        without repeats.
+        '''
+        names = []
+        for expr_type, value in self.parts:
+            if expr_type is not None:
+                for name, explode, max_length in value:
+                    if name not in names:
+                        names.append(name)
+        return names
+
+    def expand_all(self, contexts):
+        '''
+        Return a generator of the expansions of the template with each of
+        ``contexts``, which is either an iterable of context dicts or a dict
+        mapping variable names to sequences of equal length, the nth
+        expansion using the nth item of each sequence.
+
+        The literal text and expressions of the template are looked up
+        once, and each expression keeps its expansions of the values it had
+        before, so values equal to earlier ones are not escaped again.  The
+        expansions are the same as those of :meth:`expand`.
+        '''
+        names = self.names()
+        if hasattr(contexts, 'items'):
+            rows = column_rows(names, contexts)
+            keys = dict((name, i) for i, name in enumerate(names))
+        else:
+            # Context dicts are rows keyed by name.
+            rows = contexts
+            keys = dict((name, name) for name in names)
+        steps = []
+        for expr_type, value in self.parts:
+            if expr_type is None:
+                steps.append(value)
+            else:
+                steps.append(expression_expander(expr_type, value, keys))
+        return expand_rows(steps, rows)
+
+# Source -> URITemplate.  Like the re module's cache, it is emptied when
+# full, so a hit is a single dict lookup.
+_templates = {}
+
+def compile_template(source):
+    '''
+    Return the :class:`URITemplate` of ``source``, which is kept for
+    later calls until more than TEMPLATE_CACHE_SIZE templates have been
+    compiled.
+    '''
+    try:
+        return _templates[source]
+    except KeyError:
+        pass
+    template = URITemplate(source)
+    if len(_templates) >= TEMPLATE_CACHE_SIZE:
+        _templates.clear()
+    _templates[source] = template
+    return template
+
+class TemplateMatcher(object):
+    '''
+    Matches URIs against a URI template, the reverse of expanding it.
+
+    :meth:`match` returns the variables of a URI in a dict, with lists for
+    exploded and comma separated values and dicts for key/value pairs, or
+    None if the URI is no expansion of the template.  Values are
+    percent-decoded.  Those of reserved and fragment expressions keep their
+    commas, which they may hold.
+
+    Expansion leaves out undefined variables and does not encode every
+    separator in values, so a URI may not give back the context it was
+    expanded with.
+    '''
+
+    __slots__ = ('template', 'regex', '_match', '_decoders')
+
+    def __init__(self, source):
+        self.template = compile_template(source)
+        regex = []
+        self._decoders = []
+        for expr_type, value in self.template.parts:
+            if expr_type is None:
+                regex.append(re.escape(value))
+            else:
+                regex.append(expr_type.match_regex())
+                self._decoders.append(expr_type.match_decoder(value))
+        self.regex = re.compile(''.join(regex) + r'\Z')
+        self._match = self.regex.match
+
+    def __repr__(self):
+        return 'TemplateMatcher(%r)' % (self.template.source,)
+
+    def match(self, uri):
+        match = self._match(uri)
+        if match is None:
+            return None
+        values = {}
+        try:
+            # One group for each expression.
+            for decode, text in izip(self._decoders, match.groups()):
+                if text is not None:
+                    decode(text, values)
+        except ValueError:
+            return None
+        return values
+
+def column_rows(names, columns):
+    '''
+    Return an iterator of the values of ``names`` in each row of the
+    ``columns`` dict, with None for names it has no column for.
+    '''
+    lengths = set(len(column) for column in columns.itervalues())
+    if len(lengths) > 1:
+        raise ValueError("Columns differ in length: %s" % ', '.join(map(str, sorted(lengths))))
+    count = 0
+    if lengths:
+        count = lengths.pop()
+    if not names:
+        return repeat((), count)
+    return izip(*[columns[name] if name in columns else repeat(None, count) for name in names])
+
+def expand_rows(steps, rows):
+    # Literal text is a string, expressions a function of the row.
+    for row in rows:
+        yield ''.join([step(row) if type(step) is FunctionType else step for step in steps])
+
+# Marks values not yet expanded, as None is expanded too.
+_unexpanded = object()
+
+def memoized(function):
+    '''
+    Return a function of one argument returning the result of ``function``
+    kept for equal arguments, of which it keeps up to EXPANSION_CACHE_SIZE.
+    Unhashable arguments are passed on every time.
+    '''
+    results = {}
+
+    def cached(value):
+        try:
+            result = results.get(value, _unexpanded)
+        except TypeError:
+            return function(value)
+        if result is _unexpanded:
+            result = function(value)
+            if len(results) >= EXPANSION_CACHE_SIZE:
+                results.clear()
+            results[value] = result
+        return result
+    return cached
+
+def variable_expander(expr_type, name, explode, max_length):
+    '''
+    Return a function expanding a value of the variable ``name`` in an
+    expression of ``expr_type``, or returning None if it expands to nothing.
+    '''
+    expand_name = expr_type.expand_name
+    expand_one = expr_type.expand_one
+
+    def expand(value):
+        if value is None:
+            return None
+        if isinstance(value, basestring):
+            # What expand_name comes to for strings.
+            return expand_one(name, value, max_length)
+        return expand_name(name, value, explode, max_length)
+    return expand
+
+def expression_expander(expr_type, variables, keys):
+    '''
+    Return a function expanding the expression of ``expr_type`` with
+    ``variables`` given a row holding the value of each variable at its
+    key in ``keys``.
+    '''
+    leader = expr_type.leader
+    glue = expr_type.glue
+    expanders = [variable_expander(expr_type, name, explode, max_length)
+                 for name, explode, max_length in variables]
+    row_keys = [keys[name] for name, explode, max_length in variables]
+    # The value of the only variable, or a tuple of the values of all.
+    values = itemgetter(*row_keys)
+    if len(expanders) == 1:
+        expand_variable, = expanders
+        row_key, = row_keys
+
+        def missing_values(row):
+            return row.get(row_key)
+
+        def expand_values(value):
+            result = expand_variable(value)
+            if result is None:
+                return ''
+            return leader + result
+    else:
+        def missing_values(row):
+            return tuple(map(row.get, row_keys))
+
+        # A variable may repeat its values while the others do not.
+        expanders = map(memoized, expanders)
+
+        def expand_values(values):
+            results = []
+            for value, expand_variable in izip(values, expanders):
+                result = expand_variable(value)
+                if result is not None:
+                    results.append(result)
+            if results:
+                return leader + glue.join(results)
+            return ''
+    expanded = {}
+
+    def expand(row):
+        try:
+            value = values(row)
+        except KeyError:
+            # Variables missing from a context expand as if they were None.
+            value = missing_values(row)
+        try:
+            result = expanded.get(value, _unexpanded)
+        except TypeError:
+            return expand_values(value)
+        if result is _unexpanded:
+            result = expand_values(value)
+            if len(expanded) >= EXPANSION_CACHE_SIZE:
+                expanded.clear()
+            expanded[value] = result
+        return result
+    return expand
 
 def expand_regex(source, params):
     debug("expand_regex: %s" % source)
@@ -92,30 +427,44 @@ def expand_regex(source, params):
 
     debug("regex_template: %s", regex_template)
 
-    done = False
-    valid_regex_list=[]
-    while not done:
-        regex_dict = {}
-        # Construct a map of param to regex mappings.
-        for i in range(len(validations)):
-            validation_idx = validations[i][1]
-            regex_dict[validations[i][0]] = validations[i][2][validation_idx]
-
-        valid_regex_list.append(regex_template % regex_dict)
-
-        # Increment combinations.
-        i = 0
-        while 1:
-            validations[i][1] += 1
-            if len(validations[i][2]) == validations[i][1]:
-                validations[i][1] = 0
-                i += 1
-                if len(validations) == i:
-                    done = True
-                    break
-            else:
-                break
-    return valid_regex_list
+    # Each parameter accepts any of its validations, so they are combined
+    # as alternatives inside the parameter's group rather than expanded
+    # into one regex per combination.  A parameter that may match more
+    # than once in an expression must match the same validation each
+    # time, the one picked by its choice markers.
+    regex_dict = {}
+    markers = []
+    for param_key, param_validators, param_markers in validations:
+        if len(param_validators) == 1:
+            regex_dict[param_key] = param_validators[0]
+        elif param_markers is None:
+            regex_dict[param_key] = "|".join(["(?:%s)" % v for v in param_validators])
+        else:
+            regex = "(?:%s)" % param_validators[-1]
+            for marker, validator in reversed(zip(param_markers, param_validators)):
+                regex = "(?(%s)(?:%s)|%s)" % (marker, validator, regex)
+            regex_dict[param_key] = regex
+            markers += param_markers
+
+    regex = regex_template % regex_dict
+    if markers:
+        regex = number_groups(regex, markers)
+    return [regex]
+
+def number_groups(regex, names):
+    '''
+    Replace the empty named groups ``names`` of ``regex``, and the
+    conditionals on them, by numbered ones, so they are left out of the
+    groupdict of matches.
+    '''
+    try:
+        groups = sre_parse.parse(regex).pattern.groupdict
+    except re.error:
+        # Reported once the regex is compiled.
+        return regex
+    for name in names:
+        regex = regex.replace("(?P<%s>)" % name, "()").replace("(?(%s)" % name, "(?(%d)" % groups[name])
+    return regex
 
 def expand_regex_expression(expr, params, param_idx):
     if expr[0] in op_table:
@@ -132,10 +481,22 @@ class URITemplateError(Exception):
 class SimpleExpr(object):
     glue   = ','
     leader = ''
+    # What a match of an expansion may hold after the leader, as a regex
+    # character class, and whether commas in values separate list items.
+    match_chars  = unreserved_escaped + "%,="
+    split_values = True
 
     @classmethod
     def expand(cls, names, data):
-        expanded = []
+        return cls.expand_variables(cls.parse_names(names), data)
+
+    @classmethod
+    def parse_names(cls, names):
+        '''
+        Return a tuple of ``(name, explode, max_length)`` for the variable
+        names of an expression, with their modifiers.
+        '''
+        variables = []
         for name in names:
             # Check for explode prefix modifier.
             explode = name[-1] == '*'
@@ -147,38 +508,44 @@ class SimpleExpr(object):
                 try:
                     max_length = int(segments[-1])
                 except ValueError as e:
-                    debug("%s.expand: Skipping non-integer max-length in name '%s'" % (cls, name))
+                    if DEBUG:
+                        debug("%s.expand: Skipping non-integer max-length in name '%s'" % (cls, name))
 
                 if max_length is not None and max_length > 0 and max_length < 10000:
                     name = ":".join(segments[:-1])
-                    debug("%s.expand: Using max-length %s from name '%s'" % (cls, max_length, name))
+                    if DEBUG:
+                        debug("%s.expand: Using max-length %s from name '%s'" % (cls, max_length, name))
                 else:
                     max_length = None
-        
+            variables.append((name, explode, max_length))
+        return tuple(variables)
+
+    @classmethod
+    def expand_variables(cls, variables, data):
+        expanded = []
+        for name, explode, max_length in variables:
             if name in data:
-                debug("%s.expand: expanding '%s' (explode=%s, max_length=%s) using data: %s", (cls, name, explode, max_length, data[name]))
+                if DEBUG:
+                    debug("%s.expand: expanding '%s' (explode=%s, max_length=%s) using data: %s", (cls, name, explode, max_length, data[name]))
                 expanded_name = cls.expand_name(name, data[name], explode, max_length)
-                debug("%s.expand: expanded to: %s", (cls, expanded_name))
                 if expanded_name is not None:
-                    debug("%s.expand: appending: %s", (cls, expanded_name))
+                    if DEBUG:
+                        debug("%s.expand: appending: %s", (cls, expanded_name))
                     expanded.append(expanded_name)
-            else:
+            elif DEBUG:
                 debug("%s.expand: name '%s' not in context", (cls, name))
         if len(expanded) == 0:
             expanded_names = ''
         else:
             expanded_names = cls.leader + cls.glue.join(expanded)
-        debug("%s.expand: '%s' + '%s'.join(%s) => %s", (cls, cls.leader, cls.glue, expanded, expanded_names))
+        if DEBUG:
+            debug("%s.expand: '%s' + '%s'.join(%s) => %s", (cls, cls.leader, cls.glue, expanded, expanded_names))
         return expanded_names
 
     @classmethod
     def expand_regex(cls, names, params, param_idx):
         expanded_regex = []
-        param_regex = ''
-        if cls.leader != '':
-            param_regex += "\%s?" % cls.leader
-        param_regex += "(?:"
-
+        choices = ''
         param_regex_list = []
         for name in names:
             explode = name[-1] == '*'
@@ -189,8 +556,19 @@ class SimpleExpr(object):
 
             param_key = name + "_" + str(param_idx)
             name_regex, name_validators = cls.expand_param_regex(name, param_key, params)
-            expanded_regex.append([param_key, 0, name_validators])
+            markers = None
+            if len(names) > 1 and len(name_validators) > 1:
+                # The validation all matches of the parameter must pass,
+                # chosen before the expression by setting one of these
+                # empty groups, or none for the last one.
+                markers = ["_choice%d_%s" % (i, param_key) for i in range(len(name_validators) - 1)]
+                choices += "(?:%s|)" % "|".join(["(?P<%s>)" % marker for marker in markers])
+            expanded_regex.append((param_key, name_validators, markers))
             param_regex_list.append(name_regex)
+        param_regex = choices
+        if cls.leader != '':
+            param_regex += "\%s?" % cls.leader
+        param_regex += "(?:"
         param_regex += "|".join(param_regex_list)
         param_regex += "){0,%d}" % len(names)
         return param_regex, expanded_regex
@@ -237,28 +615,34 @@ class SimpleExpr(object):
             if hasattr(data, 'items'):
                 items = data.items()
                 sort = True
-                debug("%s.expand_name: data using attribute 'items': %s" % (cls, items))
+                if DEBUG:
+                    debug("%s.expand_name: data using attribute 'items': %s" % (cls, items))
             else:
                 items = data
                 sort = False
-                debug("%s.expand_name: data: %s" % (cls, items))
+                if DEBUG:
+                    debug("%s.expand_name: data: %s" % (cls, items))
             if type(items) in (list, tuple):
                 return cls.expand_pairs(name, items, explode, max_length, sort)
-            else:
+            elif DEBUG:
                 debug("%s.expand_name: Skipping expand_pairs on '%s' %s: %s", (cls, name, type(items), items))
         except TypeError as e:
-            debug("%s.expand_name: except %s", (cls, str(e)))
+            if DEBUG:
+                debug("%s.expand_name: except %s", (cls, str(e)))
         except ValueError as e:
-            debug("%s.expand_name: except %s", (cls, str(e)))
+            if DEBUG:
+                debug("%s.expand_name: except %s", (cls, str(e)))
 
         # Expand list types
         if not isinstance(data, basestring):
             try:
                 return cls.expand_list(name, data, explode, max_length)
             except TypeError as e:
-                debug("%s.expand_name: except %s", (cls, str(e)))
+                if DEBUG:
+                    debug("%s.expand_name: except %s", (cls, str(e)))
             except ValueError as e:
-                debug("%s.expand_name: except %s", (cls, str(e)))
+                if DEBUG:
+                    debug("%s.expand_name: except %s", (cls, str(e)))
 
         return cls.expand_one(name, data, max_length)
 
@@ -268,7 +652,8 @@ class SimpleExpr(object):
             expanded = None
         else:
             expanded = cls.escape(data, max_length)
-        debug("%s.expand_one: %s => %s", (cls, data, expanded))
+        if DEBUG:
+            debug("%s.expand_one: %s => %s", (cls, data, expanded))
         return expanded
 
     @classmethod
@@ -276,15 +661,18 @@ class SimpleExpr(object):
         glue = explode and cls.glue or ','
         #import pdb; pdb.set_trace();
         if sort:
-            debug("%s.expand_pairs: sorting items", cls)
+            if DEBUG:
+                debug("%s.expand_pairs: sorting items", cls)
             items.sort()
         pairs_list = []
         for k, v in items:
             if v is None:
-                debug("%s.expand_pairs: skipping undefined key '%s'", (cls, k))
+                if DEBUG:
+                    debug("%s.expand_pairs: skipping undefined key '%s'", (cls, k))
                 continue
             pairs_list.append(cls.expand_pair(k, v, explode, max_length))
-        debug("%s.expand_pairs: checking for 0 length on %s", (cls, pairs_list))
+        if DEBUG:
+            debug("%s.expand_pairs: checking for 0 length on %s", (cls, pairs_list))
         if len(pairs_list) == 0:
             return None
         return glue.join(pairs_list)
@@ -296,28 +684,115 @@ class SimpleExpr(object):
         else:
             pairglue = explode and '=' or ','
             expanded = pairglue.join([k, cls.escape(v, max_length)])
-        debug("%s.expand_pair: (%s, %s) -> %s" % (cls, k, v, expanded))
+        if DEBUG:
+            debug("%s.expand_pair: (%s, %s) -> %s" % (cls, k, v, expanded))
         return expanded
     
     @classmethod
     def expand_list(cls, name, data, explode, max_length):
         items = [cls.escape(v, max_length) for v in data if v is not None]
         glue = explode and cls.glue or ','
-        debug("%s.expand_list: checking for 0 length on %s", (cls, items))
+        if DEBUG:
+            debug("%s.expand_list: checking for 0 length on %s", (cls, items))
         if len(items) == 0:
             expanded = None
         else:
             expanded = glue.join(items)
-        debug("%s.expand_list: %s => %s", (cls, data, expanded))
+        if DEBUG:
+            debug("%s.expand_list: %s => %s", (cls, data, expanded))
         return expanded
 
     @staticmethod
     def escape(value, max_length):
-        escaped = quote(str(value[:max_length]), safe='')
-        debug("SimpleExpr.escape: quote %s -> %s", (value, escaped))
+        escaped = encode_unreserved(str(value[:max_length]))
+        if DEBUG:
+            debug("SimpleExpr.escape: quote %s -> %s", (value, escaped))
         return escaped
 
+    @classmethod
+    def match_regex(cls):
+        '''
+        Return the regex source matching an expansion, with one group for
+        the expansion after the leader.  The group is None if the leader is
+        missing.
+        '''
+        if cls.leader:
+            return "(?:%s([%s]*))?" % (re.escape(cls.leader), cls.match_chars)
+        return "([%s]*)" % cls.match_chars
+
+    @classmethod
+    def match_value(cls):
+        '''
+        Return a function decoding a value matched in an expansion.
+        '''
+        if not cls.split_values:
+            return percent_decode
+
+        def value_of(value):
+            if ',' in value:
+                return map(percent_decode, value.split(','))
+            return percent_decode(value)
+        return value_of
+
+    @classmethod
+    def match_decoder(cls, variables):
+        '''
+        Return a function storing the variables of the text matched by the
+        group of :meth:`match_regex` in a dict.  ``variables`` are as
+        returned by :meth:`parse_names`.
+
+        Values are given to variables in order, so a variable left out of
+        the expansion takes the value of the one after it.  An exploded
+        variable, or else the last one, takes the values that are left.
+        '''
+        leader = cls.leader
+        glue = cls.glue
+        value_of = cls.match_value()
+        if len(variables) == 1 and not variables[0][1]:
+            name = variables[0][0]
+
+            def decode(text, values):
+                if text or leader:
+                    values[name] = value_of(text)
+            return decode
+
+        names = [name for name, explode, max_length in variables]
+        explodes = [explode for name, explode, max_length in variables]
+        if True in explodes:
+            rest = explodes.index(True)
+        else:
+            rest = len(names) - 1
+        before, rest_name, after = names[:rest], names[rest], names[rest + 1:]
+        explode = explodes[rest]
+
+        def decode(text, values):
+            if not text and not leader:
+                return
+            items = text.split(glue)
+            for name, item in izip(before, items):
+                values[name] = value_of(item)
+            items = items[len(before):]
+            count = max(len(items) - len(after), 0)
+            for name, item in izip(after, items[count:]):
+                values[name] = value_of(item)
+            items = items[:count]
+            if not items:
+                return
+            if explode:
+                if any('=' in item for item in items):
+                    values[rest_name] = decode_pairs([item.partition('=')[::2] for item in items])
+                else:
+                    values[rest_name] = map(percent_decode, items)
+            elif len(items) == 1:
+                values[rest_name] = value_of(items[0])
+            else:
+                values[rest_name] = map(percent_decode, items)
+        return decode
+
 class ReservedExpr(SimpleExpr):
+    match_chars  = unreserved_escaped + "%" + reserved_escaped
+    split_values = False
+
     @staticmethod
     def escape(value, max_length):
         '''
@@ -326,26 +801,13 @@ class ReservedExpr(SimpleExpr):
         characters in the union of ( unreserved / reserved / pct-encoded ) to
         be passed through without pct-encoding.
         '''
-        escaped = quote(str(value[:max_length]), safe="%" + reserved)
-
         # Note that the percent character ("%") is only allowed
         # as part of a pct-encoded triplet and only for reserved/fragment
         # expansion: in all other cases, a value character of "%" MUST be pct-
         # encoded as "%25" by variable expansion.
-        segments = escaped.split("%")
-        escaped = segments[0]
-        for segment in segments[1:]:
-            # Check for a valid pct-encoded triplet.
-            try:
-                h = int(segment[:2], 16)
-                # Valid.  Put back the '%'.
-                escaped += '%'
-            except:
-                # Invalid.  Insert a '%25' encoding.
-                escaped += '%25'
-            escaped += segment
-
-        debug("ReservedExpr.escape: quote %s -> %s", (value, escaped))
+        escaped = encode_reserved(str(value[:max_length]))
+        if DEBUG:
+            debug("ReservedExpr.escape: quote %s -> %s", (value, escaped))
         return escaped
 
 class FragmentExpr(ReservedExpr):
@@ -358,6 +820,7 @@ class LabelExpr(SimpleExpr):
 class PathSegmentExpr(SimpleExpr):
     glue   = '/'
     leader = '/'
+    match_chars = SimpleExpr.match_chars + "/"
 
 class KeepNameMixin(object):
     @classmethod
@@ -378,14 +841,16 @@ class KeepNameMixin(object):
         else:
             items = [cls.escape(v, max_length) for v in data if v is not None]
         glue = explode and cls.glue or ','
-        debug("%s.expand_list: checking for 0 length on %s", (cls, items))
+        if DEBUG:
+            debug("%s.expand_list: checking for 0 length on %s", (cls, items))
         if len(items) == 0:
             expanded = None
         else:
             expanded = glue.join(items)
             if not explode:
                 expanded = name + '=' + expanded
-        debug("%s.expand_list: %s => %s", (cls, data, expanded))
+        if DEBUG:
+            debug("%s.expand_list: %s => %s", (cls, data, expanded))
         return expanded
 
 
@@ -394,7 +859,8 @@ class KeepNameMixin(object):
         expanded = super(KeepNameMixin, cls).expand_pairs(name, data, explode, max_length, sort)
         if expanded is not None and not explode:
             expanded = name + '=' + expanded
-        debug("%s.expand_pairs: expanding '%s' => '%s' with data: %s" % (cls, name, expanded, data))
+        if DEBUG:
+            debug("%s.expand_pairs: expanding '%s' => '%s' with data: %s" % (cls, name, expanded, data))
         return expanded
 
     @classmethod
@@ -402,22 +868,65 @@ class KeepNameMixin(object):
         expanded = super(KeepNameMixin, cls).expand_pair(k, v, explode, max_length)
         if explode and cls.form_style and v == "":
             expanded += "="
-        debug("%s.expand_pair: (%s, %s) -> %s" % (cls, k, v, expanded))
+        if DEBUG:
+            debug("%s.expand_pair: (%s, %s) -> %s" % (cls, k, v, expanded))
         return expanded
 
     @classmethod
     def expand_name_regex(cls, name, param_key):
         return "%s?%s=?(?P<%s>%%(%s)s)()" % (cls.glue, name, param_key, param_key)
 
+    @classmethod
+    def match_decoder(cls, variables):
+        '''
+        Return a function storing the variables of the text matched by the
+        group of :meth:`match_regex` in a dict.  Values are found by name,
+        in any order.  Other names are keys of the first exploded variable,
+        or make the match fail with ValueError if there is none.
+
+        An exploded variable is a list if all of its items are named after
+        it, and else a dict of pairs, keys included.
+        '''
+        glue = cls.glue
+        value_of = cls.match_value()
+        explodes = dict((name, explode) for name, explode, max_length in variables)
+        exploded = [name for name, explode, max_length in variables if explode]
+        pairs_name = exploded and exploded[0] or None
+
+        def decode(text, values):
+            if not text:
+                return
+            # Exploded variable name -> its (name, value) items.
+            items = {}
+            for item in text.split(glue):
+                name, equals, value = item.partition('=')
+                explode = explodes.get(name)
+                if explode is False:
+                    values[name] = value_of(value)
+                elif explode:
+                    items.setdefault(name, []).append((name, value))
+                elif pairs_name is not None:
+                    items.setdefault(pairs_name, []).append((name, value))
+                else:
+                    raise ValueError("Unknown variable: %s" % name)
+            for name, name_items in items.iteritems():
+                if all(key == name for key, value in name_items):
+                    values[name] = [percent_decode(value) for key, value in name_items]
+                else:
+                    values[name] = decode_pairs(name_items)
+        return decode
+
 
 class PathParamExpr(KeepNameMixin, SimpleExpr):
     leader = ';'
     glue   = ';'
+    match_chars = SimpleExpr.match_chars + ";"
     form_style = False
 
 class QueryExpr(KeepNameMixin, SimpleExpr):
     leader = '?'
     glue   = '&'
+    match_chars = SimpleExpr.match_chars + "&"
     form_style = True
 
 class QueryContinuationExpr(QueryExpr):
@@ -1,7 +1,14 @@
 
 import validictory
 import re
-from .uritemplate import expand_regex
+from threading import Lock
+from .uritemplate import expand_regex, URITemplateError
+from .router import ResourceRouter, PathCache, LazyRegex
+from .overlap import overlapping_routes, route_overlaps, resource_overlaps
+from .plan import MethodPlan, PlanTables
+from .compact import StringTable, compact_json, compact_restdoc, slim_resource
+from .schema import compile_schemas, dependent_schemas, LazySchemas, SchemaCycleError
+from .body import read_body, BodyError
 
 DEBUG=True
 
@@ -14,50 +21,508 @@ def debug(mesg, params=None):
 
 class RestdocError(ValueError):
     '''
-    errors encountered during restdoc validation
+    errors encountered during restdoc validation.  ``resource_name`` is the
+    name of the resource a request or response was found to be for, if the
+    error was raised after finding it.
     '''
+    resource_name = None
+
+class RestdocBodyError(RestdocError):
+    '''
+    a body matching none of the schemas it was validated against.
+
+    Validation stops at the first schema that matches, so the errors of the
+    individual schemas are only collected, by validating the body against
+    each of them again, when ``errors`` or the message is first read.
+    '''
+
+    def __init__(self, message, diagnose):
+        RestdocError.__init__(self, message)
+        self.summary = message
+        self._diagnose = diagnose
+        self._errors = None
+
+    @property
+    def errors(self):
+        if self._errors is None:
+            self._errors = self._diagnose()
+        return self._errors
+
+    def __str__(self):
+        return "%s  Errors: %s" % (self.summary, self.errors)
+
+class ValidatorState(object):
+    '''
+    Everything a :class:`RestdocValidator` looks up while validating, for
+    one version of its restdoc.
+
+    A state is never changed once a validator is using it.  Updates build a
+    new state, sharing whatever did not change with the old one, and swap
+    it in, so a lookup that starts with one state sees only that state.
+    '''
+
+    def __init__(self, restdoc, validator, compiled_schemas, cache_size):
+        self.restdoc = restdoc
+        self.validator = validator
+        self.compiled_schemas = compiled_schemas
+        self.cache_size = cache_size
+        self.resource_names = {}
+        self.resource_plans = {}
+        self.router = ResourceRouter()
+        # Resource id -> the resources whose path regexes overlap its own,
+        # for resources overlapping any; None if not worked out.
+        self.ambiguous = None
+        self.path_cache = self._pathCache()
+        self.plan_tables = PlanTables()
+
+    @property
+    def resource_patterns(self):
+        '''
+        A dict of each resource's path regex to the resource, made when
+        asked for; the router holds the regexes.
+        '''
+        return dict((route.regex, route.resource) for route in self.router.routes())
+
+    def _pathCache(self):
+        if self.cache_size:
+            return PathCache(self.cache_size)
+        return None
+
+    def copy(self, **changes):
+        '''
+        Return a copy of this state with the given attributes changed, and
+        a new path cache.
+        '''
+        state = ValidatorState.__new__(ValidatorState)
+        state.__dict__.update(self.__dict__)
+        state.resource_names = dict(self.resource_names)
+        state.resource_plans = dict(self.resource_plans)
+        state.__dict__.update(changes)
+        state.path_cache = state._pathCache()
+        return state
+
+    def __getstate__(self):
+        attributes = dict(self.__dict__)
+        # Resource ids do not survive pickling, so plans are kept with
+        # their resource instead.
+        attributes['resource_plans'] = [(resource, self.resource_plans.get(id(resource)))
+                                        for resource in self.restdoc['resources']]
+        if self.ambiguous is not None:
+            attributes['ambiguous'] = [(resource, self.ambiguous[id(resource)])
+                                       for resource in self.restdoc['resources']
+                                       if id(resource) in self.ambiguous]
+        del attributes['path_cache']
+        del attributes['plan_tables']
+        return attributes
+
+    def __setstate__(self, attributes):
+        self.__dict__.update(attributes)
+        self.resource_plans = dict((id(resource), plans)
+                                   for resource, plans in attributes['resource_plans']
+                                   if plans is not None)
+        if self.ambiguous is not None:
+            self.ambiguous = dict((id(resource), resources)
+                                  for resource, resources in attributes['ambiguous'])
+        self.path_cache = self._pathCache()
+        self.plan_tables = PlanTables()
+
+class ResourceRegex(LazyRegex):
+    '''
+    The path regex of a resource, expanded and compiled when first used.
+    '''
+
+    __slots__ = ('resource', 'shared')
+
+    def __init__(self, resource, shared=None):
+        self.resource = resource
+        self.shared = shared
+        self._lock = Lock()
+
+    def _compile(self):
+        # Raised while validating, so errors in the template are reported
+        # as errors in the restdoc.
+        try:
+            return path_regex(self.resource, self.shared)
+        except URITemplateError as e:
+            raise RestdocError(str(e))
+
+def path_regex(resource, shared=None):
+    # Compile the path regex; expand_regex combines all of the
+    # parameter validations into a single expansion.
+    valid_regex = expand_regex(resource['path'], resource.get('params', {}))[0]
+    try:
+        if shared is not None:
+            return shared.regex(valid_regex)
+        return re.compile(valid_regex)
+    except re.error as e:
+        raise RestdocError("Invalid validation regex (%s): %s" % (e, valid_regex))
+
+def state_attribute(name):
+    return property(lambda self: getattr(self._state, name))
 
 class RestdocValidator(object):
     '''
     Restdoc validator.  See https://github.com/RestDoc/specification/blob/master/specification.md
+
+    If ``cache_size`` is given, up to that many path lookups made by
+    :meth:`findResource` are cached, least recently used first out.
+
+    Bodies are normally passed already decoded.  Raw JSON bodies, as
+    strings with ``raw_body`` set or as file-like objects, are decoded once
+    before validation.  They are rejected as soon as more than
+    ``max_body_size`` bytes have been read, and bodies longer than
+    ``scan_body_size`` are checked for malformed JSON while being read.
+
+    Resources and schemas can be changed while the validator is in use
+    with :meth:`addResource`, :meth:`removeResource`,
+    :meth:`replaceResource` and :meth:`updateSchemas`, which only compile
+    what changed.  Each validation sees the restdoc either entirely before
+    or entirely after a change, without taking a lock.
+
+    If ``lazy`` is set, only the literal path prefixes needed for routing
+    are gathered up front.  The path regex of a resource is compiled the
+    first time a path is tried against it, and its method plans and the
+    schemas they use are compiled when it is first validated against.
+    Each is compiled exactly once, even with many threads validating.
+    Errors in the restdoc, such as invalid regexes or schema reference
+    cycles, are then only found when the part in error is compiled;
+    :meth:`warm` compiles everything at once.
+
+    Resources whose paths may match the same path are found when the
+    validator is built, and are listed by :meth:`ambiguities`; looking up
+    a path matched by one of the others stops at the first match.  Unless
+    ``allow_ambiguous`` is set, such resources are an error.  Lazy
+    validators only look for them if it is not set.
+
+    The validator keeps the restdoc it was given, and returns its resource
+    dicts from lookups.  Unless ``keep_restdoc`` is set, it only keeps a
+    compact copy of the parts it needs, with each string stored once, and
+    resources hold only their ``id`` and ``path``.  Lazy validators need
+    the whole restdoc.
+
+    Validators built with the same ``shared``, a
+    :class:`restdoc.registry.SharedDefinitions`, share their compiled path
+    regexes and schemas with each other.
     '''
 
-    def __init__(self, restdoc, validator_cls=validictory.SchemaValidator, format_validators=None):
+    restdoc = state_attribute('restdoc')
+    validator = state_attribute('validator')
+    compiled_schemas = state_attribute('compiled_schemas')
+    resource_patterns = state_attribute('resource_patterns')
+    resource_names = state_attribute('resource_names')
+    resource_plans = state_attribute('resource_plans')
+    router = state_attribute('router')
+    ambiguous = state_attribute('ambiguous')
+    path_cache = state_attribute('path_cache')
+
+    @property
+    def resources(self):
+        return self._state.restdoc['resources']
+
+    @property
+    def schemas(self):
+        return self._state.restdoc.get('schemas', {})
+
+    def __init__(self, restdoc, validator_cls=validictory.SchemaValidator, format_validators=None,
+                 cache_size=None, max_body_size=None, scan_body_size=1 << 20, lazy=False,
+                 keep_restdoc=True, shared=None, allow_ambiguous=True):
         # Basic validation of restdoc itself.
         if not isinstance(restdoc, dict):
             raise RestdocError("Restdoc must be a dictionary.")
-        self.restdoc = restdoc
-        if 'resources' not in self.restdoc:
+        if 'resources' not in restdoc:
             raise RestdocError("Restdoc missing 'resources'.")
-        self.resources = self.restdoc['resources']
-        if not isinstance(self.resources, list):
+        if not isinstance(restdoc['resources'], list):
             raise RestdocError("Resources must be a list.")
 
-        self.schemas = self.restdoc.get('schemas', {})
-
-        # Instantiate the validator.
-        self.validator = validator_cls(format_validators, required_by_default=False,
-                            blank_by_default=False, disallow_unknown_properties=True,
-                            disallow_unknown_schemas=True, schemas=self.schemas)
+        self.validator_cls = validator_cls
+        self.format_validators = format_validators
+        self.max_body_size = max_body_size
+        self.scan_body_size = scan_body_size
+        self.lazy = lazy
+        self.allow_ambiguous = allow_ambiguous
+        # Serializes updates; validation never takes it.
+        self._update_lock = Lock()
+        # Serializes lazy compilation.
+        self._compile_lock = Lock()
+        self.stats = None
+        self._instrumentation = None
+        self._shared = shared
+        self._sharedSchemas = None
+        if shared is not None:
+            self._sharedSchemas = shared.sharedSchemas(validator_cls, format_validators,
+                                                       lambda: self._schemaValidator({}))
+        # Shared strings of a compact restdoc, or None if it is kept whole.
+        self._strings = None
+        if not keep_restdoc:
+            if lazy:
+                raise RestdocError("Lazy validators must keep the restdoc.")
+            self._strings = StringTable()
+            restdoc = compact_restdoc(restdoc, self._strings)
+
+        schemas = restdoc.get('schemas', {})
+        validator = self._schemaValidator(schemas)
+        state = ValidatorState(restdoc, validator, self._compileSchemas(schemas, validator), cache_size)
 
         # Basic validation of each resource as well as pre-populating
         # path regex -> resource lookup table.
-        self.resource_patterns = {}
-        self.resource_names = {}
-        for resource in self.resources:
+        resources = []
+        for resource in restdoc['resources']:
             self._validateResource(resource)
-            self._addResource(resource)
-
-    def _addResource(self, resource):
-        # Compile the list of valid regex expansions.
-        for valid_regex in expand_regex(resource['path'], resource.get('params', {})):
-            try:
-                regex = re.compile(valid_regex)
-            except re.error as e:
-                raise RestdocError("Invalid validation regex (%s): %s" % (e, valid_regex))
-            self.resource_patterns[regex] = resource
+            resource, regex, plans = self._compileResource(state, resource)
+            resources.append(resource)
+            state.router.add(resource, regex)
+            self._indexResource(state, resource, regex, plans)
+        if not keep_restdoc:
+            state.restdoc['resources'] = resources
+        if not (lazy and allow_ambiguous):
+            state.ambiguous = route_overlaps(state.router)
+            if state.ambiguous and not allow_ambiguous:
+                raise RestdocError(self._ambiguityMessage(state.router))
+        self._state = state
+
+    def __getstate__(self):
+        attributes = dict(self.__dict__)
+        del attributes['_update_lock']
+        del attributes['_compile_lock']
+        # Copies are not instrumented.
+        if self._instrumentation is not None:
+            for name in self._instrumentation.methods:
+                del attributes[name]
+            attributes['stats'] = attributes['_instrumentation'] = None
+        return attributes
+
+    def __setstate__(self, attributes):
+        self.__dict__.update(attributes)
+        self._update_lock = Lock()
+        self._compile_lock = Lock()
+
+    def _schemaValidator(self, schemas):
+        return self.validator_cls(self.format_validators, required_by_default=False,
+                            blank_by_default=False, disallow_unknown_properties=True,
+                            disallow_unknown_schemas=True, schemas=schemas)
+
+    def _compileSchemas(self, schemas, validator, unchanged=None):
+        if self.lazy:
+            return LazySchemas(schemas, validator, unchanged, self._sharedSchemas)
+        try:
+            return compile_schemas(schemas, validator, unchanged, self._sharedSchemas)
+        except SchemaCycleError as e:
+            raise RestdocError(str(e))
+
+    def _compileResource(self, state, resource):
+        '''
+        Return the resource to keep, its path regex and the validation
+        plans of its methods, or None for plans to be compiled later.
+        '''
+        if self.lazy:
+            return resource, ResourceRegex(resource, self._shared), None
+        regex = path_regex(resource, self._shared)
+        plans = self._methodPlans(state, resource)
+        if self._strings is not None:
+            resource = slim_resource(resource)
+        return resource, regex, plans
+
+    def _methodPlans(self, state, resource):
+        name = self._getResourceName(resource)
+        try:
+            return dict((method, MethodPlan(method + " " + name, method_spec, state.restdoc,
+                                            state.compiled_schemas, state.plan_tables))
+                        for method, method_spec in resource['methods'].iteritems())
+        except SchemaCycleError as e:
+            raise RestdocError(str(e))
+
+    def _lazyMethodPlans(self, state, resource):
+        with self._compile_lock:
+            plans = state.resource_plans.get(id(resource))
+            if plans is None:
+                plans = state.resource_plans[id(resource)] = self._methodPlans(state, resource)
+            return plans
+
+    def warm(self):
+        '''
+        Compile every part of the restdoc not compiled yet.  Raises
+        RestdocError for the first error found.
+        '''
+        state = self._state
+        for route in state.router.routes():
+            if isinstance(route.regex, LazyRegex):
+                route.regex.compiled()
+        for resource in state.restdoc['resources']:
+            if id(resource) not in state.resource_plans:
+                self._lazyMethodPlans(state, resource)
+        if isinstance(state.compiled_schemas, LazySchemas):
+            with self._compile_lock:
+                try:
+                    state.compiled_schemas.compile_all()
+                except SchemaCycleError as e:
+                    raise RestdocError(str(e))
+
+    def _indexResource(self, state, resource, regex, plans):
         # Add this resource to lookup-by-name table.
-        self.resource_names[self._getResourceName(resource)] = resource
+        state.resource_names[self._getResourceName(resource)] = resource
+        if plans is not None:
+            state.resource_plans[id(resource)] = plans
+
+    def _unindexResource(self, state, resource):
+        name = self._getResourceName(resource)
+        if state.resource_names.get(name) is resource:
+            del state.resource_names[name]
+        state.resource_plans.pop(id(resource), None)
+
+    def addResource(self, resource):
+        '''
+        Add a resource.  Raises RestdocError if the resource is invalid or
+        one with the same name exists.
+        '''
+        resource = self._compactJSON(resource)
+        self._validateResource(resource)
+        with self._update_lock:
+            state = self._state
+            name = self._getResourceName(resource)
+            if name in state.resource_names:
+                raise RestdocError("Resource '%s' already exists." % name)
+            resource, regex, plans = self._compileResource(state, resource)
+            restdoc = dict(state.restdoc, resources=state.restdoc['resources'] + [resource])
+            router = state.router.added(resource, regex)
+            new_state = state.copy(restdoc=restdoc, router=router,
+                                   ambiguous=self._ambiguousAdded(state.ambiguous, router, resource))
+            self._indexResource(new_state, resource, regex, plans)
+            self._state = new_state
+
+    def removeResource(self, resource_name):
+        '''
+        Remove the resource named ``resource_name``.
+        '''
+        with self._update_lock:
+            state = self._state
+            resource = self._findResourceByName(state, resource_name)
+            restdoc = dict(state.restdoc, resources=[r for r in state.restdoc['resources']
+                                                     if r is not resource])
+            new_state = state.copy(restdoc=restdoc, router=state.router.removed(resource),
+                                   ambiguous=self._ambiguousRemoved(state.ambiguous, resource))
+            self._unindexResource(new_state, resource)
+            self._state = new_state
+
+    def replaceResource(self, resource_name, resource):
+        '''
+        Replace the resource named ``resource_name`` with ``resource``,
+        which keeps its place among the resources.
+        '''
+        resource = self._compactJSON(resource)
+        self._validateResource(resource)
+        with self._update_lock:
+            state = self._state
+            old = self._findResourceByName(state, resource_name)
+            name = self._getResourceName(resource)
+            if name != resource_name and name in state.resource_names:
+                raise RestdocError("Resource '%s' already exists." % name)
+            resource, regex, plans = self._compileResource(state, resource)
+            restdoc = dict(state.restdoc, resources=[r is old and resource or r
+                                                     for r in state.restdoc['resources']])
+            router = state.router.removed(old).added(resource, regex)
+            ambiguous = self._ambiguousAdded(self._ambiguousRemoved(state.ambiguous, old),
+                                             router, resource)
+            new_state = state.copy(restdoc=restdoc, router=router, ambiguous=ambiguous)
+            self._unindexResource(new_state, old)
+            self._indexResource(new_state, resource, regex, plans)
+            self._state = new_state
+
+    def _ambiguousAdded(self, ambiguous, router, resource):
+        '''
+        Return a copy of ``ambiguous`` with the overlaps of ``resource``,
+        just added to ``router``.
+        '''
+        if ambiguous is None:
+            return None
+        resources = resource_overlaps(router, resource)
+        if not resources:
+            return ambiguous
+        if not self.allow_ambiguous:
+            raise RestdocError(self._ambiguityMessage(router, resource))
+        ambiguous = dict(ambiguous)
+        ambiguous[id(resource)] = resources
+        for other in resources:
+            ambiguous[id(other)] = ambiguous.get(id(other), ()) + (resource,)
+        return ambiguous
+
+    def _ambiguousRemoved(self, ambiguous, resource):
+        if ambiguous is None or id(resource) not in ambiguous:
+            return ambiguous
+        ambiguous = dict(ambiguous)
+        for other in ambiguous.pop(id(resource)):
+            resources = tuple(r for r in ambiguous[id(other)] if r is not resource)
+            if resources:
+                ambiguous[id(other)] = resources
+            else:
+                del ambiguous[id(other)]
+        return ambiguous
+
+    def ambiguities(self):
+        '''
+        Return a sorted list of ``(resource name, resource name, path)``
+        for each pair of resources whose paths may match the same path,
+        with such a path, or None if none is known.
+        '''
+        return self._ambiguities(self._state.router)
+
+    def _ambiguities(self, router, resource=None):
+        ambiguities = []
+        for resource1, resource2, example in overlapping_routes(router, resource):
+            names = sorted([self._getResourceName(resource1), self._getResourceName(resource2)])
+            ambiguities.append(tuple(names) + (example,))
+        return sorted(ambiguities)
+
+    def _ambiguityMessage(self, router, resource=None):
+        return "Resources may match the same path: %s" % ', '.join(
+                "'%s' and '%s'%s" % (name1, name2, example is not None and " ('%s')" % example or '')
+                for name1, name2, example in self._ambiguities(router, resource))
+
+    def updateSchemas(self, schemas):
+        '''
+        Add or replace the schemas in the dict ``schemas``, removing those
+        whose spec is None.  Only the changed schemas, the schemas referring
+        to them, and the methods using any of those are compiled again.
+        '''
+        with self._update_lock, self._compile_lock:
+            state = self._state
+            all_schemas = dict(state.restdoc.get('schemas', {}))
+            for name, schema_spec in schemas.iteritems():
+                if schema_spec is None:
+                    all_schemas.pop(name, None)
+                else:
+                    all_schemas[name] = self._compactJSON(schema_spec)
+            changed = dependent_schemas(all_schemas, schemas)
+            validator = self._schemaValidator(all_schemas)
+            # The schemas left unchanged still hold the validator they were
+            # compiled with, which knows every schema they can refer to.
+            unchanged = dict((name, schema) for name, schema in state.compiled_schemas.iteritems()
+                             if name not in changed)
+            compiled = self._compileSchemas(all_schemas, validator, unchanged)
+            new_state = state.copy(restdoc=dict(state.restdoc, schemas=all_schemas),
+                                   validator=validator, compiled_schemas=compiled,
+                                   plan_tables=PlanTables())
+            rebound_plans = {}
+            for resource in new_state.restdoc['resources']:
+                plans = new_state.resource_plans.get(id(resource))
+                if plans is None:
+                    continue
+                if self.lazy:
+                    if any(not changed.isdisjoint(plan.schema_names) for plan in plans.itervalues()):
+                        del new_state.resource_plans[id(resource)]
+                else:
+                    # Plans only refer to schemas through their choices,
+                    # so the plans using changed schemas are rebound to
+                    # the new ones, and all others are kept.
+                    if any(not changed.isdisjoint(plan.schema_names) for plan in plans.itervalues()):
+                        new_state.resource_plans[id(resource)] = dict(
+                            (method, plan.rebound(compiled, rebound_plans))
+                            for method, plan in plans.iteritems())
+            self._state = new_state
+
+    def _compactJSON(self, node):
+        if self._strings is None:
+            return node
+        return compact_json(node, self._strings)
 
     def _getResourceName(self, resource):
         if 'id' in resource:
@@ -79,14 +544,24 @@ class RestdocValidator(object):
             raise RestdocError("Resource '%s' has no methods." % name)
 
     def findResource(self, path):
+        return self._findResource(self._state, path)
+
+    def _findResource(self, state, path):
+        if state.path_cache is not None:
+            cached = state.path_cache.get(path)
+            if cached is not None:
+                resource, uri_params = cached
+                return resource, dict((param, list(values)) for param, values in uri_params)
+
         matches = set()
         last_match = None
-        for regex, resource in self.resource_patterns.iteritems():
-            r = regex.match(path)
-            if r is not None:
-                matches.add(resource['path'])
-                last_match = r
-                last_resource = resource
+        for resource, r in state.router.match(path):
+            matches.add(resource['path'])
+            last_match = r
+            last_resource = resource
+            # A resource overlapping no other is the only one matching.
+            if state.ambiguous is not None and id(resource) not in state.ambiguous:
+                break
         if len(matches) > 1:
             raise RestdocError("Multiple resources match path '%s': %s" % (path, list(matches)))
         if last_match is None:
@@ -98,134 +573,176 @@ class RestdocValidator(object):
                 uri_params[param] = []
             if value is not None:
                 uri_params[param].append(value)
+
+        if state.path_cache is not None:
+            # Cache an immutable copy so callers cannot modify cached params.
+            state.path_cache.put(path, (last_resource, tuple(
+                (param, tuple(values)) for param, values in uri_params.iteritems())))
         return last_resource, uri_params
 
     def findResourceByName(self, resource_name):
-        if resource_name in self.resource_names:
-            return self.resource_names[resource_name]
+        return self._findResourceByName(self._state, resource_name)
+
+    def _findResourceByName(self, state, resource_name):
+        if resource_name in state.resource_names:
+            return state.resource_names[resource_name]
         raise RestdocError("Unknown resource name: %s" % resource_name)
 
-    def validateRequest(self, method, path, body='', headers={}, lazy_schema_matching=False, resource_name=None):
+    def _findMethodPlan(self, method, path, resource_name):
+        state = self._state
         if resource_name is None:
-            resource, uri_params = self.findResource(path)
+            resource, uri_params = self._findResource(state, path)
             resource_name = self._getResourceName(resource)
         else:
             uri_params={}
-            resource = self.findResourceByName(resource_name)
-        if method not in resource['methods']:
-            raise RestdocError("Resource '%s' does not have method '%s'" % (resource_name, method))
-        method_name = method + " " + resource_name
-
-        resource_method = resource['methods'][method]
-        if 'headers' in resource_method:
-            for header, header_spec in resource_method['headers'].iteritems():
-                if 'required' in header_spec and header_spec['required']:
-                    if header not in headers and header.lower() not in headers:
-                        raise RestdocError("Method '%s' requires header '%s'" % (method_name, header))
-
-        matching_schema = None
-        if 'accepts' in resource_method:
-            errors = []
-
-            for accept in resource_method['accepts']:
-                if self._validate_schema(accept, body, errors, lazy_schema_matching):
-                    matching_schema = accept
-                    break
+            resource = self._findResourceByName(state, resource_name)
+        plans = state.resource_plans.get(id(resource))
+        if plans is None:
+            plans = self._lazyMethodPlans(state, resource)
+        plan = plans.get(method)
+        if plan is None:
+            error = RestdocError("Resource '%s' does not have method '%s'" % (resource_name, method))
+            error.resource_name = resource_name
+            raise error
+        return resource, uri_params, plan
+
+    def validateRequest(self, method, path, body='', headers={}, lazy_schema_matching=False, resource_name=None,
+                        raw_body=False):
+        resource, uri_params, plan = self._findMethodPlan(method, path, resource_name)
 
-            if matching_schema is None:
-                raise RestdocError("Method '%s' does not accept given body.  Errors: %s" % (method_name, errors)) 
-
-        if 'headers' in self.restdoc:
-            for header, header_spec in self.restdoc['headers'].get('request', {}).iteritems():
-                if 'required' in header_spec and header_spec['required']:
-                    if header not in headers and header.lower() not in headers:
-                        raise RestdocError("Method '%s' requires header '%s'" % (method_name, header))
+        try:
+            for header, lower_header in plan.required_headers:
+                if header not in headers and lower_header not in headers:
+                    raise RestdocError("Method '%s' requires header '%s'" % (plan.name, header))
+
+            matching_schema = None
+            if plan.accepts is not None:
+                if raw_body or hasattr(body, 'read'):
+                    body = self._readBody(body)
+                matching_schema = self._matchSchema(plan.accepts, body, lazy_schema_matching)
+                if matching_schema is None:
+                    raise RestdocBodyError("Method '%s' does not accept given body." % plan.name,
+                            lambda: self._schemaErrors([plan.accepts], body, lazy_schema_matching))
+        except RestdocError as e:
+            e.resource_name = self._getResourceName(resource)
+            raise
 
         return resource, uri_params, matching_schema
 
-    def validateResponse(self, method, path, status, body='', headers={}, lazy_schema_matching=False, resource_name=None):
-        if resource_name is None:
-            resource, uri_params = self.findResource(path)
-            resource_name = self._getResourceName(resource)
-        else:
-            uri_params={}
-            resource = self.findResourceByName(resource_name)
-        if method not in resource['methods']:
-            raise RestdocError("Resource '%s' does not have method '%s'" % (resource_name, method))
-        method_name = method + " " + resource_name
+    def validateResponse(self, method, path, status, body='', headers={}, lazy_schema_matching=False, resource_name=None,
+                         raw_body=False):
+        resource, uri_params, plan = self._findMethodPlan(method, path, resource_name)
 
-        resource_method = resource['methods'][method]
-        if 'statusCodes' not in resource_method:
-            raise RestdocError("Method '%s' missing statusCodes definition")
+        try:
+            if plan.responses is None:
+                raise RestdocError("Method '%s' missing statusCodes definition" % plan.name)
 
-        statusCodes = self.restdoc.get('statusCodes', {})
-        statusCodes.update(resource_method['statusCodes'])
+            response_plan = plan.responses.get(status)
+            if response_plan is None:
+                response_plan = plan.responses.get(str(status))
+                if response_plan is None:
+                    raise RestdocError("Method '%s' responding with invalid status code '%s'" % (plan.name, status))
 
-        if str(status) not in statusCodes:
-            raise RestdocError("Method '%s' responding with invalid status code '%s'" % (method_name, status))
+            for header, lower_header in response_plan.required_headers:
+                if header not in headers and lower_header not in headers:
+                    raise RestdocError("Method '%s' response requires header '%s'" % (plan.name, header))
 
-        matching_schema = None
-        errors = []
-        status_spec = statusCodes[str(status)]
-        match_attempts = 0
-        if isinstance(status_spec, dict) and 'response' in status_spec:
-            for response_type in status_spec['response'].get('types', []):
-                match_attempts += 1
-                if self._validate_schema(response_type, body, errors, lazy_schema_matching):
-                    matching_schema = response_type
-                    break
-
-            for header, header_spec in status_spec['response'].get('headers', {}).iteritems():
-                if 'required' in header_spec and header_spec['required']:
-                    if header not in headers and header.lower() not in headers:
-                        raise RestdocError("Method '%s' response requires header '%s'" % (method_name, header))
-
-        if 'response' in resource_method:
-            for response_type in resource_method['response'].get('types', []):
-                match_attempts += 1
-                if self._validate_schema(response_type, body, errors, lazy_schema_matching):
-                    matching_schema = response_type
-                    break
-
-            for header, header_spec in resource_method['response'].get('headers', {}).iteritems():
-                if 'required' in header_spec and header_spec['required']:
-                    if header not in headers and header.lower() not in headers:
-                        raise RestdocError("Method '%s' response requires header '%s'" % (method_name, header))
-
-        if 'headers' in self.restdoc:
-            for header, header_spec in self.restdoc['headers'].get('response', {}).iteritems():
-                if 'required' in header_spec and header_spec['required']:
-                    if header not in headers and header.lower() not in headers:
-                        raise RestdocError("Method '%s' response requires header '%s'" % (method_name, header))
-            
-        if matching_schema is None:
-            raise RestdocError("Method '%s' responded with invalid body.  Matched against %d schemas.  Errors: %s" % (method_name, match_attempts, errors)) 
+            if raw_body or hasattr(body, 'read'):
+                body = self._readBody(body)
+
+            # A match against the method's response types takes precedence.
+            matching_schema = self._matchSchema(response_plan.method_types, body, lazy_schema_matching)
+            if matching_schema is None:
+                matching_schema = self._matchSchema(response_plan.status_types, body, lazy_schema_matching)
+
+            if matching_schema is None:
+                selectors = [response_plan.status_types, response_plan.method_types]
+                match_attempts = sum(len(selector.choices) for selector in selectors)
+                raise RestdocBodyError("Method '%s' responded with invalid body.  Matched against %d schemas." % (plan.name, match_attempts),
+                        lambda: self._schemaErrors(selectors, body, lazy_schema_matching))
+        except RestdocError as e:
+            e.resource_name = self._getResourceName(resource)
+            raise
 
         return resource, uri_params, matching_schema
 
-    def _validate_schema(self, method_schema, body, errors, lazy_schema_matching):
-        if 'schema' not in method_schema or method_schema['schema'] not in self.schemas:
-            if not lazy_schema_matching:
-                # Ignore this schema; do not assume success.
-                return False
-            # Unknown schema.  Assume body is valid.
-            return True
+    def enableStats(self, callback=None):
+        '''
+        Start recording statistics of each validation into ``stats``, a
+        :class:`restdoc.stats.ValidatorStats`, which is returned.
+        ``callback``, if given, is called after each validation with
+        ``(kind, resource_name, phases, error)``; see :mod:`restdoc.stats`.
+        '''
+        from .stats import ValidatorStats, Instrumentation
+        self.disableStats()
+        self.stats = ValidatorStats()
+        self._instrumentation = Instrumentation(self, self.stats, callback)
+        self._instrumentation.install()
+        return self.stats
+
+    def disableStats(self):
+        '''
+        Stop recording statistics.  ``stats`` keeps the last totals.
+        '''
+        if self._instrumentation is not None:
+            self._instrumentation.uninstall()
+            self._instrumentation = None
+
+    def statsSnapshot(self):
+        '''
+        Return a copy of the statistics recorded, including the hit rate
+        of the path cache, or None if statistics were never enabled.
+        '''
+        if self.stats is None:
+            return None
+        return self.stats.snapshot(self._state.path_cache)
+
+    def validateMany(self, records, workers=1, chunk_size=256, diagnose=False):
+        '''
+        Validate many request and response records, yielding a result for
+        each in order.  See :func:`restdoc.batch.validate_many`.
+        '''
+        from .batch import validate_many
+        return validate_many(self, records, workers, chunk_size, diagnose)
+
+    def _readBody(self, body):
+        try:
+            return read_body(body, self.max_body_size, scan_size=self.scan_body_size)
+        except BodyError as e:
+            raise RestdocError(str(e))
+
+    def _matchSchema(self, selector, body, lazy_schema_matching):
+        '''
+        Return the spec of the first choice of ``selector`` matching
+        ``body``, or None.
+        '''
+        for choice in selector.select(body):
+            if self._validate_schema(choice, body, None, lazy_schema_matching):
+                return choice.spec
+        return None
+
+    def _schemaErrors(self, selectors, body, lazy_schema_matching):
+        '''
+        Return the errors of validating ``body`` against every choice of
+        ``selectors`` in turn.
+        '''
+        errors = []
+        for selector in selectors:
+            for choice in selector.choices:
+                self._validate_schema(choice, body, errors, lazy_schema_matching)
+        return errors
 
-        schema_spec = self.schemas[method_schema['schema']]
-        if schema_spec.get('type', 'url') != 'inline' or 'schema' not in schema_spec:
-            if not lazy_schema_matching:
-                # Ignore this schema; do not assume success.
-                return False
-            # Cannot analyse schema.  Assume body is valid.
-            return True
+    def _validate_schema(self, choice, body, errors, lazy_schema_matching):
+        if choice.schema is None:
+            # Unknown or non-inline schema.  Only assume the body is valid
+            # when matching lazily.
+            return lazy_schema_matching
 
         # Validate body against schema.
         try:
-            self.validator.validate(body, schema_spec['schema'])
+            choice.schema(body)
             return True
         except ValueError as e:
-            errors.append(e)
+            if errors is not None:
+                errors.append(e)
             return False
-
-
-
@@ -0,0 +1,275 @@
+'''
+WSGI middleware validating the requests to and responses from an
+application against a restdoc.
+'''
+import os
+import random
+from io import BytesIO
+from logging import getLogger
+from threading import Lock, Thread
+from Queue import Queue, Full
+
+from .validate import RestdocError, RestdocBodyError
+
+log = getLogger(__name__)
+
+def environ_headers(environ):
+    '''
+    Return the request headers of a WSGI environ, keyed by lowercased name.
+    '''
+    headers = {}
+    for key, value in environ.iteritems():
+        if key.startswith('HTTP_'):
+            headers[key[5:].replace('_', '-').lower()] = value
+    for key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+        if environ.get(key):
+            headers[key.replace('_', '-').lower()] = environ[key]
+    return headers
+
+def is_json(headers):
+    return 'json' in headers.get('content-type', '')
+
+def error_message(error):
+    '''
+    Return the message of a validation error, without the errors of each
+    schema a rejected body was checked against, which take validating it
+    against each of them again.
+    '''
+    if isinstance(error, RestdocBodyError):
+        return error.summary
+    return str(error)
+
+class ValidationMiddleware(object):
+    '''
+    Validates requests inline and responses either inline or, if
+    ``async_responses`` is set, on a background thread, so that response
+    validation adds no latency.
+
+    Only a ``sample_rate`` fraction of the requests to a resource is
+    validated; ``sample_rates`` overrides it for individual resources by
+    name.  Response checks wait on a queue of at most ``queue_size``
+    entries and are dropped when it is full.  Request and response bodies
+    are only checked up to ``max_body_size`` bytes; the checks of requests
+    with larger bodies, or bodies of unknown length, are skipped.  JSON
+    bodies are handed to the validator raw, within its own body limits.
+
+    If ``reject_invalid`` is set, invalid requests are answered with
+    ``400 Bad Request`` instead of being passed on.  Failures are logged,
+    and passed to ``on_failure``, if given, as ``(kind, method, path,
+    error)`` where kind is 'request' or 'response' and error the
+    RestdocError raised.  Only the summary of a rejected body is logged
+    or sent back; ``error.errors`` holds the errors of each schema.
+
+    ``validated``, ``failed``, ``dropped`` and ``skipped`` count the checks
+    made, the checks that failed, the response checks dropped, and the
+    request checks skipped, because the request was not sampled or its
+    body could not be read.
+
+    The response validation thread is started by the first request, and
+    again, with a queue of its own, by the first request of a process
+    forked from the one that started it, so that the middleware can be
+    built before a pre-forking server forks its workers.
+    '''
+
+    def __init__(self, app, validator, sample_rate=1.0, sample_rates=None,
+                 async_responses=True, queue_size=1000, max_body_size=1 << 20,
+                 reject_invalid=False, on_failure=None):
+        self.app = app
+        self.validator = validator
+        self.sample_rate = sample_rate
+        self.sample_rates = sample_rates or {}
+        self.max_body_size = max_body_size
+        self.reject_invalid = reject_invalid
+        self.on_failure = on_failure
+        self.validated = 0
+        self.failed = 0
+        self.dropped = 0
+        self.skipped = 0
+        self._lock = Lock()
+        self.queue = None
+        self.thread = None
+        # The process the thread was started in, or False once closed.
+        self._pid = None
+        if async_responses:
+            self.queue = Queue(queue_size)
+
+    def _startThread(self):
+        pid = os.getpid()
+        with self._lock:
+            if self._pid is False or self._pid == pid:
+                return
+            if self._pid is not None:
+                # Forked: the thread stayed in the parent, along with the
+                # checks queued so far.
+                self.queue = Queue(self.queue.maxsize)
+            self.thread = Thread(target=self._work, args=(self.queue,),
+                                 name="restdoc response validation")
+            self.thread.daemon = True
+            self.thread.start()
+            self._pid = pid
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _fail(self, kind, method, path, error):
+        self._count('failed')
+        log.warning("Invalid %s to %s %s: %s", kind, method, path, error_message(error))
+        if self.on_failure is not None:
+            self.on_failure(kind, method, path, error)
+
+    def __call__(self, environ, start_response):
+        if self.queue is not None and self._pid != os.getpid():
+            self._startThread()
+        method = environ['REQUEST_METHOD']
+        path = environ.get('PATH_INFO', '')
+        if environ.get('QUERY_STRING'):
+            path += '?' + environ['QUERY_STRING']
+
+        try:
+            resource, uri_params = self.validator.findResource(path)
+        except RestdocError as e:
+            self._count('validated')
+            self._fail('request', method, path, e)
+            return self._passOrReject(environ, start_response, e)
+        resource_name = self.validator._getResourceName(resource)
+
+        if random.random() >= self.sample_rates.get(resource_name, self.sample_rate):
+            self._count('skipped')
+            return self.app(environ, start_response)
+
+        headers = environ_headers(environ)
+        data = self._readBody(environ, headers)
+        if data is None:
+            self._count('skipped')
+        else:
+            self._count('validated')
+            try:
+                self.validator.validateRequest(method, path, data, headers, resource_name=resource_name,
+                                               raw_body=is_json(headers))
+            except RestdocError as e:
+                self._fail('request', method, path, e)
+                if self.reject_invalid:
+                    return self._passOrReject(environ, start_response, e)
+
+        response = {}
+        def capture_start_response(status, response_headers, exc_info=None):
+            response['status'] = int(status.split(None, 1)[0])
+            response['headers'] = dict((header.lower(), value) for header, value in response_headers)
+            return start_response(status, response_headers, exc_info)
+
+        body = self.app(environ, capture_start_response)
+        return ResponseBody(body, self.max_body_size,
+                lambda chunks: self._checkResponse(method, path, resource_name, response, chunks))
+
+    def _readBody(self, environ, headers):
+        '''
+        Return the request body, or None if its length is unknown or more
+        than ``max_body_size``.
+        '''
+        if not environ.get('CONTENT_LENGTH'):
+            if 'transfer-encoding' in headers:
+                return None
+            return ''
+        try:
+            length = int(environ['CONTENT_LENGTH'])
+        except ValueError:
+            return None
+        if length <= 0:
+            return ''
+        if length > self.max_body_size:
+            return None
+        data = environ['wsgi.input'].read(length)
+        # Let the application read the body again.
+        environ['wsgi.input'] = BytesIO(data)
+        return data
+
+    def _passOrReject(self, environ, start_response, error):
+        if not self.reject_invalid:
+            return self.app(environ, start_response)
+        start_response('400 Bad Request', [('Content-Type', 'text/plain')])
+        return [error_message(error)]
+
+    def _checkResponse(self, method, path, resource_name, response, chunks):
+        if 'status' not in response or chunks is None:
+            # No response, or a body too large to check.
+            return
+        check = (method, path, resource_name, response['status'], response['headers'], ''.join(chunks))
+        if self.queue is None:
+            self._validateResponse(*check)
+            return
+        try:
+            self.queue.put_nowait(check)
+        except Full:
+            self._count('dropped')
+
+    def _validateResponse(self, method, path, resource_name, status, headers, data):
+        self._count('validated')
+        try:
+            self.validator.validateResponse(method, path, status, data, headers,
+                                            resource_name=resource_name, raw_body=is_json(headers))
+        except RestdocError as e:
+            self._fail('response', method, path, e)
+
+    def _work(self, queue):
+        while True:
+            check = queue.get()
+            try:
+                if check is None:
+                    return
+                self._validateResponse(*check)
+            except Exception:
+                log.exception("Response validation failed")
+            finally:
+                queue.task_done()
+
+    def join(self):
+        '''
+        Wait until every queued response check is done.
+        '''
+        if self.queue is not None:
+            self.queue.join()
+
+    def close(self):
+        '''
+        Stop the response validation thread once queued checks are done.
+        Response checks are queued but no longer made afterwards.
+        '''
+        with self._lock:
+            started = self._pid == os.getpid()
+            self._pid = False
+        if started:
+            self.queue.put(None)
+            self.thread.join()
+        self.thread = None
+
+class ResponseBody(object):
+    '''
+    Passes on the body of a response while keeping a copy of up to
+    ``max_size`` bytes, and calls ``done`` with the chunks of the body, or
+    None if it was larger, when the server closes it.
+    '''
+
+    def __init__(self, body, max_size, done):
+        self.body = body
+        self.max_size = max_size
+        self.done = done
+        self.chunks = []
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self.body:
+            if self.chunks is not None:
+                self.size += len(chunk)
+                if self.size > self.max_size:
+                    self.chunks = None
+                else:
+                    self.chunks.append(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.done(self.chunks)
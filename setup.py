@@ -15,5 +15,5 @@ setup(name='restdoc',
                 'urllib3==1.3',
                 'validictory',
                ],
-      scripts=['scripts/rdc'],
+      scripts=['scripts/rdc', 'scripts/rdc-check'],
       )